@@ -3,4 +3,7 @@
 GUNICORN_CONF=./src/gunicorn.conf.py
 GUNICORN_PID=./src/gunicorn.pid
 
-pipenv run gunicorn --reload -c $GUNICORN_CONF --pid $GUNICORN_PID src.app:app
+# Pass --reload while working on the code to restart the workers when it
+# changes. It stops the master preloading the app for the workers, so the
+# workers boot slower (see "preload" in the gunicorn config).
+pipenv run gunicorn "$@" -c $GUNICORN_CONF --pid $GUNICORN_PID src.app:app
@@ -0,0 +1,103 @@
+###############################################################################
+# Description: Boots the API in this process against a fake redis
+# Version: 0.1
+###############################################################################
+
+import importlib.util
+import os
+import time
+
+import yaml
+
+GUNICORN_CONF = "./src/gunicorn.conf.py"
+
+
+def use_fake_redis() -> None:
+    """
+    Point every redis connection the API makes at one in memory fakeredis
+    server, so a benchmark never touches (or wipes) a real room. Has to run
+    before anything in "src" is imported.
+    """
+    import fakeredis
+    import redis
+
+    server = fakeredis.FakeServer()
+
+    class FakePool(redis.BlockingConnectionPool):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop("host", None)
+            kwargs.pop("port", None)
+            super().__init__(*args, connection_class=fakeredis.FakeConnection,
+                             server=server, **kwargs)
+
+    redis.BlockingConnectionPool = FakePool
+    return
+
+
+def node_ip(i: int) -> str:
+    """
+    Every simulated node gets its own loopback address, 127.1.0.1 and up.
+    """
+    return f"127.1.{i // 250}.{i % 250 + 1}"
+
+
+def write_config(node_count: int, directory: str,
+                 base_config: str = "./src/config.yaml") -> str:
+    """
+    The real config, with "node_count" simulated pis split over the two
+    subrooms. Returns the path of the new config.
+    """
+    with open(base_config, "r") as f:
+        config = yaml.safe_load(f)
+    config.pop("rooms", None)
+    config["api"]["worker_mode"] = "gthread"
+    config["room_info"]["subroom_1"] = "Bench 1"
+    config["room_info"]["subroom_2"] = "Bench 2"
+    config["room_info"].pop("subroom_triggers", None)
+    config["pi_nodes"] = [
+        {"name": f"node{i:04}", "ip": node_ip(i),
+         "location": f"Bench {i % 2 + 1}"}
+        for i in range(node_count)
+    ]
+    path = os.path.join(directory, f"bench_{node_count}.yaml")
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return path
+
+
+def boot(config_file: str):
+    """
+    Start the API the way gunicorn does (the master's "initialize", then a
+    worker's "init_worker"), in this process. Returns the app module.
+    """
+    from src.enums import ConfigKeys
+    ConfigKeys.CONFIG_YAML = config_file
+
+    spec = importlib.util.spec_from_file_location("gunicorn_conf",
+                                                  GUNICORN_CONF)
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    gunicorn_conf.initialize()
+
+    import src.app
+    src.app.init_worker()
+    return src.app
+
+
+def wait_until_ready(app_module, timeout: float = 120) -> float:
+    """
+    Wait for the room to load, returns how long it took.
+    """
+    from src.enums import RoomStatus
+    from src.redis_keys import RedisKeys
+
+    started = time.monotonic()
+    room = app_module.rooms.get()
+    while time.monotonic() - started < timeout:
+        status = room.keys.get(RedisKeys.API_ROOM_STATUS)
+        if status == RoomStatus.READY:
+            return time.monotonic() - started
+        if status == RoomStatus.ERROR:
+            break
+        time.sleep(0.05)
+    raise RuntimeError(f"Room never loaded, it's {status}")
@@ -0,0 +1,568 @@
+###############################################################################
+# Description: Hundreds of simulated TaskNodes in one process, for scale tests
+# Version: 0.1
+###############################################################################
+"""
+Run from "ControlPanel/api". The fleet is a room of its own: write its
+config, add it to "rooms" in the config (fleet: "/tmp/fleet.yaml"), and
+bind the API to 127.0.0.1 (not 0.0.0.0) so the simulated pis can have port
+12413 on their own addresses:
+
+    pipenv run python -m bench.fleet --nodes 300 --config-out /tmp/fleet.yaml
+    ./api.sh -b 127.0.0.1:12413
+    pipenv run python -m bench.fleet --nodes 300 --room fleet --duration 60
+    pipenv run python -m bench.fleet --fleet ./my_fleet.yaml
+
+Every simulated pi answers "/status", "/relay/<message>" and "/restart_api"
+like a TaskNode, and its role sends triggers and status updates back to
+the control panel. Nothing leaves the machine.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import resource
+import time
+import urllib.parse
+
+import yaml
+from bench.environment import node_ip
+
+NODE_PORT = 12413  # The port every pi listens on, see "PiNode.port"
+HANG_SECS = 60  # How long a hanging pi holds a request before dropping it
+SEND_TIMEOUT = 5  # Seconds a trigger or status update gets, like a TaskNode
+SEND_ATTEMPTS = 3  # Tries for each trigger or status update
+BURST_GAP = 1.0  # Seconds without a relay that end a broadcast
+
+
+class Statuses:
+    INIT = "INIT"
+    READY = "READY"
+    ACTIVE = "ACTIVE"
+    PAUSED = "PAUSED"
+    STOPPED = "STOPPED"
+
+
+# Relay: the status the role moves to, see "TaskNode/src/role.py".
+RELAY_STATUSES = {
+    "ROOM_START": Statuses.ACTIVE,
+    "START": Statuses.ACTIVE,
+    "RESUME": Statuses.ACTIVE,
+    "PAUSE": Statuses.PAUSED,
+    "STOP": Statuses.STOPPED,
+}
+
+
+def parse_latency(spec) -> callable:
+    """
+    A latency distribution, in ms, to a function that draws seconds.
+        "fixed:20", "uniform:5:50", "normal:20:5", "lognormal:15:0.6"
+    lognormal takes the median and the sigma, a long tail like real wifi.
+    """
+    kind, *args = str(spec or "fixed:0").split(":")
+    args = [float(arg) for arg in args]
+    if kind == "fixed":
+        return lambda rng: args[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(max(args[0], 0.001))
+        return lambda rng: rng.lognormvariate(mu, args[1]) / 1000
+    raise ValueError(f"Unknown latency {spec}, use fixed, uniform, "
+                     "normal or lognormal")
+
+
+def percentiles(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    def at(share):
+        index = min(len(values) - 1, int(len(values) * share))
+        return round(values[index] * 1000, 3)
+
+    return {"count": len(values), "p50_ms": at(0.5), "p99_ms": at(0.99),
+            "max_ms": at(1.0)}
+
+
+class FleetStats:
+    """
+    What the whole fleet saw, added up over every pi.
+
+    Public Methods:
+    -count: Add to a counter.
+    -relay_arrived: Note when a pi got a relay, for the broadcast spread.
+    -summary: Everything, as a dict.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.send_times = {"trigger": [], "status": []}
+        self.bursts = {}  # message: [first, last, pis] of the newest burst
+        self.spreads = {}  # message: [(secs, pis)] of every burst before
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+        return
+
+    def relay_arrived(self, message: str) -> None:
+        """
+        Every pi gets its own relay id, so a broadcast is every relay of
+        the same message until none arrive for BURST_GAP.
+        """
+        now = time.monotonic()
+        burst = self.bursts.get(message)
+        if burst is not None and now - burst[1] <= BURST_GAP:
+            burst[1] = now
+            burst[2] += 1
+            return
+        if burst is not None:
+            self.spreads.setdefault(message, []).append(
+                (burst[1] - burst[0], burst[2]))
+        self.bursts[message] = [now, now, 1]
+        return
+
+    def summary(self) -> dict:
+        """
+        The spread of a broadcast is how long it took to reach every pi
+        that got it, from the first to the last.
+        """
+        spreads = {message: list(bursts)
+                   for message, bursts in self.spreads.items()}
+        for message, (first, last, pis) in self.bursts.items():
+            spreads.setdefault(message, []).append((last - first, pis))
+        summary = {}
+        summary["counters"] = dict(sorted(self.counters.items()))
+        summary["trigger_send"] = percentiles(self.send_times["trigger"])
+        summary["status_send"] = percentiles(self.send_times["status"])
+        summary["broadcast_spread"] = {
+            message: {**percentiles([secs for secs, _pis in bursts]),
+                      "most_pis": max(pis for _secs, pis in bursts)}
+            for message, bursts in sorted(spreads.items())}
+        return summary
+
+
+class SimulatedNode:
+    """
+    One TaskNode, on its own loopback address.
+
+    Its role starts in INIT, is READY after "load_secs", and follows the
+    room's broadcasts (ROOM_START, PAUSE, RESUME, STOP). While ACTIVE it
+    sends one of its "triggers" about every "trigger_every_secs". Every
+    status change is sent to the control panel, like "Role.set_status".
+
+    Faults, all drawn from the node's own seeded random so a run can be
+    repeated:
+    -latency: How long every answer takes, see "parse_latency".
+    -failure_rate: Share of requests answered with a 500.
+    -hang_rate: Share of requests never answered, the caller times out.
+    -offline: Share of the pis that start offline, refusing connections.
+    -flap_every_secs / flap_down_secs: Goes offline that often, that long.
+    "/restart_api" and a RESET relay take it offline for "restart_secs",
+    then it loads again.
+
+    Public Methods:
+    -start / stop: Start and stop the node (and its role).
+    -go_offline / go_online: Refuse connections, or take them again.
+    """
+
+    def __init__(self, index: int, settings: dict, control_url: str,
+                 stats: FleetStats, seed: int):
+        self.name = f"sim{index:04}"
+        self.ip = node_ip(index)
+        self.location = settings.get("location", "Fleet")
+        self.settings = settings
+        self.control_url = control_url
+        self.stats = stats
+        self.rng = random.Random(f"{seed}:{index}")
+        self.latency = parse_latency(settings.get("latency_ms"))
+        self.status = Statuses.INIT
+        self.__server = None
+        self.__connections = set()
+        self.__tasks = []
+        self.__seen = set()
+        self.__loaded = None
+
+    async def start(self) -> None:
+        if self.rng.random() >= float(self.settings.get("offline", 0)):
+            await self.go_online()
+        self.__tasks.append(asyncio.create_task(self.__role()))
+        flap_every = self.settings.get("flap_every_secs")
+        if flap_every:
+            self.__tasks.append(asyncio.create_task(self.__flap(flap_every)))
+        return
+
+    async def stop(self) -> None:
+        for task in self.__tasks:
+            task.cancel()
+        await self.go_offline()
+        return
+
+    async def go_online(self) -> None:
+        if self.__server is None:
+            self.__server = await asyncio.start_server(
+                self.__serve, self.ip, NODE_PORT, reuse_address=True)
+            self.stats.count("online")
+        return
+
+    async def go_offline(self) -> None:
+        if self.__server is None:
+            return
+        self.__server.close()
+        for writer in list(self.__connections):
+            writer.close()
+        self.__server = None
+        self.stats.count("offline")
+        return
+
+    async def restart(self) -> None:
+        """
+        Like a TaskNode restarting its API: gone for a while, then loads.
+        """
+        await asyncio.sleep(0.05)  # Let the answer get out first
+        await self.go_offline()
+        await asyncio.sleep(self.settings.get("restart_secs", 2))
+        self.status = Statuses.INIT
+        await self.go_online()
+        self.__load()
+        return
+
+    ###########################################################################
+    #                               The Endpoints                             #
+    ###########################################################################
+
+    async def __serve(self, reader, writer):
+        self.__connections.add(writer)
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers = request
+                if self.rng.random() < self.settings.get("hang_rate", 0):
+                    self.stats.count("injected_hangs")
+                    await asyncio.sleep(HANG_SECS)
+                    break
+                await asyncio.sleep(self.latency(self.rng))
+                if self.rng.random() < self.settings.get("failure_rate", 0):
+                    self.stats.count("injected_failures")
+                    code, body = 500, "Simulated Failure"
+                else:
+                    code, body = self.__answer(method, path, headers)
+                writer.write(response_bytes(code, body))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.__connections.discard(writer)
+            writer.close()
+
+    def __answer(self, method, path, headers):
+        if method == "GET" and path == "/status":
+            self.stats.count("status_requests")
+            return 200, self.status
+        if method == "POST" and path.startswith("/relay/"):
+            return self.__relay(urllib.parse.unquote(path[len("/relay/"):]),
+                                headers.get("idempotency-key"))
+        if method == "POST" and path == "/restart_api":
+            self.stats.count("restarts")
+            asyncio.create_task(self.restart())
+            return 200, "Restarting Server"
+        if method == "OPTIONS":
+            return 200, ""
+        return 404, "Not Found"
+
+    def __relay(self, message, key):
+        self.stats.count("relays")
+        if key is not None:
+            if key in self.__seen:
+                self.stats.count("relay_duplicates")
+                return 200, f"Relay Already Received: {message}"
+            self.__seen.add(key)
+        self.stats.relay_arrived(message)
+        message = message.upper().replace("-", "_").replace(" ", "_")
+        if message == "RESET":
+            asyncio.create_task(self.restart())
+            return 200, "Restarting Server"
+        status = RELAY_STATUSES.get(message)
+        if status is None:
+            return 200, f"Relay Received, No Action Taken: {message}"
+        self.__set_status(status)
+        return 200, f"Relay Received, Action Taken: {message}"
+
+    ###########################################################################
+    #                                 The Role                                #
+    ###########################################################################
+
+    async def __role(self):
+        self.__load()
+        triggers = self.settings.get("triggers") or []
+        every = self.settings.get("trigger_every_secs")
+        while True:
+            if not (triggers and every) or self.status != Statuses.ACTIVE:
+                await asyncio.sleep(0.25)
+                continue
+            await asyncio.sleep(self.rng.expovariate(1 / every))
+            if self.status == Statuses.ACTIVE and self.__server:
+                trigger = self.rng.choice(triggers)
+                asyncio.create_task(self.__send(
+                    "trigger", f"/trigger/{urllib.parse.quote(trigger)}"))
+
+    def __load(self):
+        async def load():
+            await asyncio.sleep(self.settings.get("load_secs", 0.5))
+            self.__set_status(Statuses.READY)
+        if self.__loaded is not None:
+            self.__loaded.cancel()
+        self.__loaded = asyncio.create_task(load())
+        return
+
+    def __set_status(self, status):
+        if status == self.status:
+            return
+        self.status = status
+        quoted = urllib.parse.quote(status)
+        asyncio.create_task(self.__send(
+            "status", f"/update_status/{self.name}/{quoted}"))
+        return
+
+    async def __send(self, kind, path):
+        """
+        POST to the control panel, like the TaskNode's Transmitter.
+        """
+        if self.control_url is None:
+            return
+        for _ in range(SEND_ATTEMPTS):
+            started = time.monotonic()
+            try:
+                code = await asyncio.wait_for(
+                    post(self.control_url, path), SEND_TIMEOUT)
+                if code == 200:
+                    self.stats.count(f"{kind}_sent")
+                    self.stats.send_times[kind].append(
+                        time.monotonic() - started)
+                    return
+            except (OSError, asyncio.TimeoutError, ValueError):
+                pass
+            self.stats.count(f"{kind}_send_errors")
+        return
+
+    async def __flap(self, every):
+        down = self.settings.get("flap_down_secs", 5)
+        while True:
+            await asyncio.sleep(self.rng.expovariate(1 / every))
+            await self.go_offline()
+            await asyncio.sleep(down)
+            await self.go_online()
+
+
+async def read_request(reader):
+    """
+    (method, path, {header: value}) of the next request on a connection,
+    None when the client hung up.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    method, path, _version = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length:
+        await reader.readexactly(length)
+    return method, path, headers
+
+
+def response_bytes(code: int, body: str) -> bytes:
+    body = body.encode("utf-8")
+    reason = {200: "OK", 404: "Not Found", 500: "Internal Server Error"}
+    head = (f"HTTP/1.1 {code} {reason.get(code, 'OK')}\r\n"
+            f"Content-Type: text/html; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n")
+    return head.encode("latin-1") + body
+
+
+async def post(base_url: str, path: str) -> int:
+    """
+    One POST, on its own connection, returns the status code.
+    """
+    url = urllib.parse.urlsplit(base_url)
+    reader, writer = await asyncio.open_connection(url.hostname,
+                                                   url.port or 80)
+    try:
+        writer.write((f"POST {url.path}{path} HTTP/1.1\r\n"
+                      f"Host: {url.netloc}\r\n"
+                      f"Content-Length: 0\r\nConnection: close\r\n\r\n"
+                      ).encode("latin-1"))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+class Fleet:
+    """
+    Every simulated pi, from the "groups" of a fleet file:
+
+        seed: 1
+        control_panel: {ip: 127.0.0.1, port: 12413, room: fleet}
+        groups:
+          - count: 250
+            location: "Fleet 1"
+            latency_ms: "lognormal:15:0.6"
+            failure_rate: 0.01
+            triggers: ["DOOR_OPEN", "BUTTON"]
+            trigger_every_secs: 20
+          - count: 50
+            latency_ms: "uniform:50:400"
+            hang_rate: 0.02
+            flap_every_secs: 30
+
+    Public Methods:
+    -pi_nodes: The fleet as the control panel's "pi_nodes".
+    -run: Run the fleet, returns the stats.
+    """
+
+    def __init__(self, fleet_config: dict):
+        self.config = fleet_config
+        self.stats = FleetStats()
+        self.seed = fleet_config.get("seed", 1)
+        control = fleet_config.get("control_panel")
+        control_url = None
+        if control:
+            control_url = f"http://{control['ip']}:{control['port']}"
+            if control.get("room"):
+                control_url += f"/rooms/{control['room']}"
+        self.nodes = []
+        for group in fleet_config["groups"]:
+            for _ in range(group.get("count", 1)):
+                self.nodes.append(SimulatedNode(
+                    len(self.nodes), group, control_url, self.stats,
+                    self.seed))
+
+    def pi_nodes(self) -> list:
+        return [{"name": node.name, "ip": node.ip,
+                 "location": node.location} for node in self.nodes]
+
+    async def run(self, duration: float = None) -> dict:
+        raise_file_limit(len(self.nodes) * 4)
+        for node in self.nodes:
+            await node.start()
+        print(f"{len(self.nodes)} simulated pis on {self.nodes[0].ip} to "
+              f"{self.nodes[-1].ip}, port {NODE_PORT}")
+        started = time.monotonic()
+        try:
+            while duration is None or time.monotonic() - started < duration:
+                left = 5 if duration is None else duration - (
+                    time.monotonic() - started)
+                await asyncio.sleep(max(0, min(5, left)))
+                counters = self.stats.counters
+                print(f"{time.monotonic() - started:.0f}s: "
+                      f"{counters.get('status_requests', 0)} polls, "
+                      f"{counters.get('relays', 0)} relays, "
+                      f"{counters.get('trigger_sent', 0)} triggers sent")
+        finally:
+            for node in self.nodes:
+                await node.stop()
+        summary = self.stats.summary()
+        summary["nodes"] = len(self.nodes)
+        summary["secs"] = round(time.monotonic() - started, 1)
+        return summary
+
+
+def raise_file_limit(wanted: int) -> None:
+    """
+    Every pi holds a listening socket and its connections.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        new_soft = wanted if hard == resource.RLIM_INFINITY else min(
+            wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+    return
+
+
+def write_room_config(fleet: Fleet, path: str,
+                      base_config: str = "./src/config.yaml") -> None:
+    """
+    The real config with the fleet as its pis, for the API to run against.
+    """
+    with open(base_config, "r") as f:
+        config = yaml.safe_load(f)
+    config.pop("rooms", None)
+    config["pi_nodes"] = fleet.pi_nodes()
+    with open(path, "w") as f:
+        yaml.safe_dump(config, f)
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--fleet", help="A fleet file, see \"Fleet\"")
+    parser.add_argument("--nodes", type=int, default=100,
+                        help="Pis, without a fleet file")
+    parser.add_argument("--latency", default="lognormal:10:0.5",
+                        help="Answer latency in ms, without a fleet file")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--control", default="127.0.0.1:12413",
+                        help="The control panel, \"none\" to send nothing")
+    parser.add_argument("--room", help="The control panel room")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--duration", type=float,
+                        help="Seconds to run, forever if not given")
+    parser.add_argument("--config-out",
+                        help="Write a control panel config for the fleet")
+    parser.add_argument("--out", help="Write the stats as JSON")
+    args = parser.parse_args()
+
+    if args.fleet:
+        with open(args.fleet, "r") as f:
+            fleet_config = yaml.safe_load(f)
+    else:
+        fleet_config = {}
+        fleet_config["seed"] = args.seed
+        if args.control != "none":
+            ip, _, port = args.control.partition(":")
+            fleet_config["control_panel"] = {
+                "ip": ip, "port": int(port or NODE_PORT), "room": args.room}
+        fleet_config["groups"] = [{
+            "count": args.nodes,
+            "latency_ms": args.latency,
+            "failure_rate": args.failure_rate,
+            "hang_rate": args.hang_rate,
+            "triggers": ["SIM_TRIGGER"],
+            "trigger_every_secs": 10,
+        }]
+    fleet = Fleet(fleet_config)
+
+    if args.config_out:
+        write_room_config(fleet, args.config_out)
+        print(f"Control panel config written to {args.config_out}")
+
+    try:
+        summary = asyncio.run(fleet.run(args.duration))
+    except KeyboardInterrupt:
+        summary = fleet.stats.summary()
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(summary, f, indent=2)
+    return
+
+
+if __name__ == "__main__":
+    main()
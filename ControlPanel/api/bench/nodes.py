@@ -0,0 +1,103 @@
+###############################################################################
+# Description: A pool of simulated TaskNodes for the benchmarks
+# Version: 0.1
+###############################################################################
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NODE_PORT = 12413  # The port every pi listens on, see "PiNode.port"
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Every pi gets polled at once while loading
+
+
+class SimulatedNodes:
+    """
+    Answers for every simulated pi at once. Each pi has its own loopback
+    address (see "environment.node_ip"), so the API opens a connection
+    per pi like it would in a room, and one server on NODE_PORT answers
+    them all.
+
+    They answer like a TaskNode: "/status" says READY, "/relay/<message>"
+    takes the relay. "latency" slows every answer down, like a busy pi.
+
+    Nothing else can be on NODE_PORT while this runs, a running API
+    included.
+
+    Public Methods:
+    -start / stop: Start and stop answering.
+    -relays: How many relays have arrived since "reset".
+    -wait_for_relays: Wait until that many relays have arrived.
+    -reset: Forget the relays so far.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.__relays = 0
+        self.__condition = threading.Condition()
+        self.__server = None
+
+    def start(self) -> None:
+        nodes = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep alive, like the real pis
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self.__answer("Status: READY")
+                else:
+                    self.__answer("Not Found", 404)
+
+            def do_POST(self):
+                if self.path.startswith("/relay/"):
+                    nodes.count_relay()
+                    self.__answer("OK")
+                else:
+                    self.__answer("Not Found", 404)
+
+            def __answer(self, text, code=200):
+                if nodes.latency:
+                    time.sleep(nodes.latency)
+                body = text.encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.__server = _Server(("0.0.0.0", NODE_PORT), Handler)
+        threading.Thread(target=self.__server.serve_forever,
+                         daemon=True).start()
+        return
+
+    def stop(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+        return
+
+    def count_relay(self) -> None:
+        with self.__condition:
+            self.__relays += 1
+            self.__condition.notify_all()
+        return
+
+    def relays(self) -> int:
+        return self.__relays
+
+    def reset(self) -> None:
+        with self.__condition:
+            self.__relays = 0
+        return
+
+    def wait_for_relays(self, count: int, timeout: float) -> bool:
+        with self.__condition:
+            return self.__condition.wait_for(
+                lambda: self.__relays >= count, timeout)
@@ -0,0 +1,298 @@
+###############################################################################
+# Description: Benchmarks the API at several room sizes, against a baseline
+# Version: 0.1
+###############################################################################
+"""
+Run from "ControlPanel/api", nothing else can be using port 12413:
+
+    pipenv run python -m bench.run                  # 2, 20, 200, 1000 pis
+    pipenv run python -m bench.run --nodes 2,20 --duration 5
+    pipenv run python -m bench.run --save-baseline  # after a known good run
+
+Every room size runs in its own process, with a fresh fake redis and its
+own simulated pis, so the sizes can't affect each other.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_NODES = "2,20,200,1000"
+DEFAULT_OUT = "./bench/results.json"
+DEFAULT_BASELINE = "./bench/baseline.json"
+
+# What gets benchmarked, name: (method, url).
+ENDPOINTS = {
+    "fetch_all": ("GET", "/fetch/all"),
+    "fetch_dynamic": ("GET", "/fetch/dynamic"),
+    "fetch_key": ("GET", "/fetch/room_status"),
+    "toggle_state": ("POST", "/toggle_state"),
+    "trigger": ("POST", "/trigger/BENCH"),
+}
+
+DELIVERY_ROUNDS = 5  # Broadcasts timed until every pi has them
+DELIVERY_TIMEOUT = 60  # Seconds one broadcast gets to reach every pi
+MIN_DELTA_MS = 1.0  # Latency changes smaller than this are noise
+
+
+def summarize(latencies: list, elapsed: float, errors: int) -> dict:
+    """
+    Throughput and latency percentiles of one benchmark, in ms.
+    """
+    latencies = sorted(latencies)
+
+    def percentile(share):
+        if not latencies:
+            return 0.0
+        index = min(len(latencies) - 1, int(len(latencies) * share))
+        return round(latencies[index] * 1000, 3)
+
+    summary = {}
+    summary["requests"] = len(latencies)
+    summary["errors"] = errors
+    summary["rps"] = round(len(latencies) / elapsed, 1) if elapsed else 0.0
+    summary["p50_ms"] = percentile(0.50)
+    summary["p99_ms"] = percentile(0.99)
+    summary["max_ms"] = percentile(1.0)
+    return summary
+
+
+def measure(app, method: str, url: str, duration: float,
+            concurrency: int) -> dict:
+    """
+    "concurrency" threads send requests back to back for "duration"
+    seconds, through the app's test client (no sockets, so only the API's
+    own work is measured).
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client_loop():
+        client = app.test_client()
+        mine = []
+        failed = 0
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            response = client.open(url, method=method)
+            mine.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client_loop)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, errors[0])
+
+
+def clear_relay_queues(room) -> None:
+    """
+    Drop the relays the toggle and trigger benchmarks queued, nothing was
+    sending them.
+    """
+    from src.redis_keys import RedisKeys
+    r = RedisKeys.REDIS.value
+    names = room.pi_node_controller.names
+    r.delete(*[room.relay_queue.key(name) for name in names])
+    return
+
+
+def measure_delivery(api, nodes, node_count: int) -> dict:
+    """
+    Time a "/toggle_state" broadcast until every pi has it, with the relay
+    dispatcher running like it does under gunicorn.
+    """
+    from src.dispatcher import Dispatcher
+
+    room = api.rooms.get()
+    clear_relay_queues(room)
+    dispatcher = Dispatcher([room.pi_node_controller])
+    threading.Thread(target=dispatcher.run, daemon=True).start()
+
+    client = api.app.test_client()
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(DELIVERY_ROUNDS):
+        nodes.reset()
+        sent = time.perf_counter()
+        client.post("/toggle_state")
+        if nodes.wait_for_relays(node_count, DELIVERY_TIMEOUT):
+            latencies.append(time.perf_counter() - sent)
+        else:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+
+def run_size(node_count: int, duration: float, concurrency: int) -> dict:
+    """
+    Everything for one room size. Runs in its own process, see "main".
+    """
+    from bench import environment
+    from bench.nodes import SimulatedNodes
+
+    environment.use_fake_redis()
+    nodes = SimulatedNodes()
+    nodes.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            config_file = environment.write_config(node_count, directory)
+            booted = time.perf_counter()
+            api = environment.boot(config_file)
+            results = {}
+            results["boot"] = {"secs": round(time.perf_counter() - booted,
+                                             3)}
+            results["room_load"] = {
+                "secs": round(environment.wait_until_ready(api), 3)}
+            for name, (method, url) in ENDPOINTS.items():
+                results[name] = measure(api.app, method, url, duration,
+                                        concurrency)
+            results["broadcast_delivery"] = measure_delivery(api, nodes,
+                                                             node_count)
+    finally:
+        nodes.stop()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Every benchmark that got more than "tolerance" worse than the baseline.
+    """
+    regressions = []
+    for size, benchmarks in results["nodes"].items():
+        for name, now in benchmarks.items():
+            was = baseline.get("nodes", {}).get(size, {}).get(name)
+            if not was or "p99_ms" not in now:
+                continue
+            p99_limit = was["p99_ms"] * (1 + tolerance)
+            if (now["p99_ms"] > p99_limit
+                    and now["p99_ms"] - was["p99_ms"] > MIN_DELTA_MS):
+                regressions.append(
+                    f"{size} pis {name}: p99 {was['p99_ms']}ms -> "
+                    f"{now['p99_ms']}ms")
+            if was["rps"] and now["rps"] < was["rps"] * (1 - tolerance):
+                regressions.append(
+                    f"{size} pis {name}: {was['rps']} -> {now['rps']} req/s")
+    return regressions
+
+
+def print_results(results: dict, baseline: dict) -> None:
+    baseline_nodes = (baseline or {}).get("nodes", {})
+    print(f"{'pis':>5} {'benchmark':<20} {'req/s':>9} {'p50 ms':>9} "
+          f"{'p99 ms':>9} {'errors':>6} {'p99 was':>9}")
+    for size, benchmarks in results["nodes"].items():
+        if "error" in benchmarks:
+            print(f"{size:>5} failed: {benchmarks['error']}")
+            continue
+        for name, now in benchmarks.items():
+            if "secs" in now:
+                print(f"{size:>5} {name:<20} {now['secs']:>9}s")
+                continue
+            was = baseline_nodes.get(size, {}).get(name, {})
+            print(f"{size:>5} {name:<20} {now['rps']:>9} {now['p50_ms']:>9} "
+                  f"{now['p99_ms']:>9} {now['errors']:>6} "
+                  f"{was.get('p99_ms', '-'):>9}")
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", default=DEFAULT_NODES,
+                        help="Room sizes, comma separated")
+    parser.add_argument("--duration", type=float, default=3,
+                        help="Seconds each endpoint is benchmarked")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Clients sending at once")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="How much worse than the baseline is a "
+                             "regression, 0.25 is 25%%")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        # One room size, for the parent process. The API prints a lot, only
+        # the results matter here.
+        results = run_size(args.size, args.duration, args.concurrency)
+        with open(args.out, "w") as f:
+            json.dump(results, f)
+        os._exit(0)  # The API's threads never stop on their own
+
+    results = {}
+    results["meta"] = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": f"{platform.node()} {platform.machine()}",
+        "python": platform.python_version(),
+        "redis": "fakeredis",
+        "duration_secs": args.duration,
+        "concurrency": args.concurrency,
+    }
+    results["nodes"] = {}
+    for size in args.nodes.split(","):
+        print(f"Benchmarking {size} pis...")
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            command = [sys.executable, "-m", "bench.run", "--size", size,
+                       "--duration", str(args.duration),
+                       "--concurrency", str(args.concurrency),
+                       "--out", out.name]
+            done = subprocess.run(command, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.PIPE, text=True)
+            if done.returncode != 0:
+                error = done.stderr.strip().splitlines()[-1:] or ["failed"]
+                results["nodes"][size] = {"error": error[0]}
+                continue
+            with open(out.name, "r") as f:
+                results["nodes"][size] = json.load(f)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.out}")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline")
+        return 0
+    if baseline["meta"].get("machine") != results["meta"]["machine"]:
+        print(f"The baseline is from {baseline['meta'].get('machine')}, "
+              "the numbers may not be comparable")
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    failed = [size for size, benchmarks in results["nodes"].items()
+              if "error" in benchmarks]
+    if regressions or failed:
+        return 1
+    print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,22 +3,131 @@
 # Version: 0.1
 ###############################################################################
 import os
+import threading
 import time
 
-import markdown
-from flask import Flask, jsonify, render_template
+from flask import (Blueprint, Flask, Response, abort, g, jsonify,
+                   render_template, request)
 from flask_cors import CORS
-from src.enums import Broadcasts, ConfigKeys, LoadingStatus, RoomStatus
-from src.pi_node import PiNodeController
+from src.boot_profile import BootProfile
+from src.config_snapshot import ConfigWatcher, config_store
+from src.enums import Broadcasts
+from src.event_log import EventTypes
+from src.loader import RoomLoader
+from src.metrics import metrics, room_label
+from src.profiler import RequestProfiler
+from src.pi_node import http_pool, node_cache
 from src.redis_keys import RedisKeys
-from src.timer import Timer  # Treated as a global Timer()
-from src.yaml_reader import open_yaml_as_dict
+from src.rooms import RoomRegistry
+from src.serving import serving_settings
+from src.snapshot import RoomSnapshot
+from src.static_cache import MissingFileError
+from src.stream import StreamHub, parse_id
+from src.timer import TIMER_ERRORS, Timer, TimerResults, wall_ms
 
 app = Flask(__name__)
 CORS(app)
-config = open_yaml_as_dict(RedisKeys.API_YAML_CONFIG.get())
-worker_id = RedisKeys.API_WORKER_ID.get_then_increment()
-pi_node_controller = PiNodeController(config[ConfigKeys.PI_NODES])
+worker_id = None  # Set in every worker by "init_worker"
+rooms = RoomRegistry()
+config = rooms.config
+config_watcher = ConfigWatcher(rooms)
+serving = serving_settings(config["api"])
+stream_hub = StreamHub(serving["stream_clients"], rooms.stream_keys())
+profiler = RequestProfiler(config.get("profiling"), serving["worker_mode"])
+
+# Every route belongs to a room. The default room's routes are at "/", the
+# other rooms' at "/rooms/<room_id>/", see "src/rooms.py".
+room_routes = Blueprint("room", __name__)
+
+
+@room_routes.url_value_preprocessor
+def pull_room(endpoint, values):
+    room_id = values.pop("room_id", None) if values else None
+    g.room = rooms.get(room_id)
+    if g.room is None:
+        abort(404)
+
+
+# Streams are open for as long as the client wants, timing them says nothing.
+UNTIMED_ROUTES = ("/stream",)
+
+
+def request_route() -> str:
+    """
+    The route of the request, the same for every room (not its url, so
+    "/trigger/<message>" is one route however many messages there are).
+    """
+    rule = request.url_rule.rule if request.url_rule else "unmatched"
+    return rule.removeprefix("/rooms/<room_id>") or "/"
+
+
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    if profiler.wanted(request.headers):
+        g.profile = profiler.start()
+
+
+@app.after_request
+def save_profile(response):
+    """
+    Save the request's profile (see "src/profiler.py"), and say where.
+    """
+    profile = g.pop("profile", None)
+    if profile is not None:
+        file_name = profiler.stop(profile, request_route())
+        if file_name:
+            response.headers["X-Profile-File"] = file_name
+    return response
+
+
+@app.teardown_request
+def drop_profile(error):
+    # A request that raised never got to "save_profile".
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profiler.stop(profile, request_route())
+
+
+@app.teardown_request
+def release_stream(error):
+    # A "/stream" response lost to an error is never closed.
+    release = g.pop("stream_release", None)
+    if release is not None and error is not None:
+        release()
+
+
+@app.after_request
+def record_timing(response):
+    """
+    Time every request into "/metrics", by its route.
+    """
+    started = g.pop("started", None)
+    route = request_route()
+    if started is None or route in UNTIMED_ROUTES:
+        return response
+    room = g.get("room")
+    labels = {}
+    labels["room"] = room_label(room.room_id) if room else ""
+    labels["route"] = route
+    labels["method"] = request.method
+    metrics.observe("escapewright_http_request_seconds",
+                    time.perf_counter() - started, labels)
+    metrics.inc("escapewright_http_responses_total", {
+        "room": labels["room"],
+        "route": route,
+        "status": response.status_code,
+    })
+    return response
+
+
+@app.errorhandler(MissingFileError)
+def missing_file(error):
+    """
+    The script (or another file the static payload needs) was moved or
+    renamed while the API ran.
+    """
+    return f"Error: File Not Found ({error.file_name})", 500
 
 
 ###############################################################################
@@ -26,7 +135,7 @@ pi_node_controller = PiNodeController(config[ConfigKeys.PI_NODES])
 ###############################################################################
 
 
-@app.route("/")
+@room_routes.route("/")
 def home():
     """
     Micro-Frontend for the room.
@@ -35,12 +144,13 @@ def home():
 
     See "templates/index.html" for how the Micro-Frontend is structured.
     """
-    all_data = generate_full_payload()
+    all_data = generate_full_payload(g.room)
     last_boot = all_data["static"]["last_boot"]
     last_boot = time.strftime(
         "%d %b %Y %H:%M:%S", time.localtime(int(last_boot)))
     all_data["last_boot_formatted"] = last_boot
     all_data["uptime"] = uptime()
+    all_data["base"] = g.room.url_prefix
     return render_template("index.html", **all_data)
 
 
@@ -49,40 +159,164 @@ def home():
 ###############################################################################
 
 
-@app.route("/fetch/all", methods=["GET"])
+@room_routes.route("/fetch/all", methods=["GET"])
 def fetch_all():
     """
     Return all the data to the requester.
     This is used to initialize the front end.
     """
-    return jsonify(generate_full_payload()), 200
+    return jsonify(generate_full_payload(g.room)), 200
 
 
-@app.route("/fetch/dynamic", methods=["GET"])
+@room_routes.route("/fetch/dynamic", methods=["GET"])
 def fetch_dynamic():
     """
     Return the dynamic data to the requester.
     This is data that may change after the server has started.
     """
-    return jsonify(generate_dynamic_payload()), 200
+    return jsonify(generate_dynamic_payload(g.room)), 200
 
 
-@app.route("/fetch/static", methods=["GET"])
+@room_routes.route("/fetch/static", methods=["GET"])
 def fetch_static():
     """
     Return the static data to the requester.
     This is data that will not change after the server has started.
     """
-    return jsonify(generate_static_payload()), 200
+    return jsonify(generate_static_payload(g.room)), 200
+
+
+@room_routes.route("/fetch/timer", methods=["GET"])
+def fetch_timer():
+    """
+    Return the timer descriptor, the client runs the clock from it.
+    """
+    return jsonify(g.room.timer().snapshot().descriptor()), 200
 
 
-@app.route("/fetch/<specific_data>", methods=["GET"])
+@room_routes.route("/fetch/clock", methods=["GET"])
+def fetch_clock():
+    """
+    Return the server's clock in milliseconds. Clients time the round trip
+    to work out how far their clock is off from the server's.
+    """
+    return jsonify({"server_time_ms": wall_ms()}), 200
+
+
+@room_routes.route("/fetch/cache_stats", methods=["GET"])
+def fetch_cache_stats():
+    """
+    Return the hit/miss counters of the static payload cache.
+    """
+    return jsonify(g.room.static_cache.stats()), 200
+
+
+@room_routes.route("/fetch/pool_stats", methods=["GET"])
+def fetch_pool_stats():
+    """
+    Return how this worker's HTTP connection pool is being used.
+    """
+    return jsonify(http_pool.stats()), 200
+
+
+@room_routes.route("/fetch/node_cache_stats", methods=["GET"])
+def fetch_node_cache_stats():
+    """
+    Return this worker's PiNode cache counters and invalidation lag.
+    """
+    return jsonify(node_cache.stats()), 200
+
+
+@room_routes.route("/fetch/boot_stats", methods=["GET"])
+def fetch_boot_stats():
+    """
+    Return how long the master and the workers took to boot, newest first.
+    """
+    return jsonify(BootProfile.recent()), 200
+
+
+@room_routes.route("/metrics", methods=["GET"])
+def fetch_metrics():
+    """
+    Every metric of every worker and room, in the Prometheus text format.
+    """
+    return Response(metrics.render(room_gauges()),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@room_routes.route("/profile", methods=["GET"])
+def fetch_profile():
+    """
+    The stacks of the newest profiled requests added up, as a collapsed
+    stack file for a flamegraph. ?route= only that route ("/fetch/all"),
+    ?count= how many profiles (default 50).
+    """
+    try:
+        count = int(request.args.get("count", 50))
+    except ValueError:
+        return "Error: count Must Be A Number", 400
+    names = profiler.profiles(request.args.get("route"), count)
+    return Response(profiler.collapsed(names), mimetype="text/plain")
+
+
+@room_routes.route("/fetch/profiles", methods=["GET"])
+def fetch_profiles():
+    """
+    Return the newest saved profiles, and if profiling is on.
+    """
+    payload = {}
+    payload["enabled"] = profiler.enabled
+    payload["sample_rate"] = profiler.sample_rate
+    payload["directory"] = profiler.directory
+    payload["profiles"] = profiler.profiles(request.args.get("route"))
+    return jsonify(payload), 200
+
+
+@room_routes.route("/fetch/routes", methods=["GET"])
+def fetch_routes():
+    """
+    Return which pis get which triggers.
+    """
+    return jsonify(g.room.pi_node_controller.router.to_dict()), 200
+
+
+@room_routes.route("/fetch/relay_queue", methods=["GET"])
+def fetch_relay_queue():
+    """
+    Return the relays waiting for each pi, and the newest dead letters.
+    """
+    relay_queue = g.room.relay_queue
+    payload = relay_queue.stats(g.room.pi_node_controller.names)
+    payload["newest_dead_letters"] = relay_queue.dead_letters(20)
+    return jsonify(payload), 200
+
+
+@room_routes.route("/fetch/config", methods=["GET"])
+def fetch_config():
+    """
+    Return the version of the room's config, the one this worker uses and
+    the newest stored, and why the last edit was rejected if it was.
+    """
+    payload = config_store.status(g.room.keys)
+    payload["worker_version"] = g.room.config_version
+    return jsonify(payload), 200
+
+
+@room_routes.route("/fetch/rooms", methods=["GET"])
+def fetch_rooms():
+    """
+    Return every room this API serves, and where its routes are.
+    """
+    return jsonify([room.to_dict() for room in rooms.rooms()]), 200
+
+
+@room_routes.route("/fetch/<specific_data>", methods=["GET"])
 def fetch_specific_data(specific_data):
     """
     Return a specific data payload for the room.
     This might be good to just call all the time and get the data you want.
     """
-    full_payload = generate_full_payload()
+    full_payload = generate_full_payload(g.room)
     data = search_nested_dicts(full_payload, specific_data)
     if data is not None:
         return jsonify(data), 200
@@ -90,82 +324,147 @@ def fetch_specific_data(specific_data):
         return "Data Not Found", 404
 
 
-@app.route("/start/", defaults={"gameguide": "None", "players": "None"})
-@app.route("/start/<gameguide>/<players>", methods=["POST"])
+@room_routes.route("/events", methods=["GET"])
+def events():
+    """
+    Page through the event log, oldest first.
+    ?cursor= the "next" of the last page, ?count= up to 1000,
+    ?type= only these types (repeat it for more), ?reverse=1 newest first.
+    """
+    try:
+        count = int(request.args.get("count", 100))
+    except ValueError:
+        return "Error: count Must Be A Number", 400
+    cursor = request.args.get("cursor")
+    if cursor and parse_id(cursor) is None:
+        return "Error: cursor Must Be An Event Id", 400
+    page = g.room.event_log.range(
+        cursor=cursor,
+        count=count,
+        types=request.args.getlist("type"),
+        reverse=request.args.get("reverse") in ("1", "true"),
+    )
+    return jsonify(page), 200
+
+
+@room_routes.route("/fetch/event_log_stats", methods=["GET"])
+def fetch_event_log_stats():
+    """
+    Return how many events this worker logged, and how many it dropped.
+    """
+    return jsonify(g.room.event_log.stats()), 200
+
+
+@room_routes.route("/stream", methods=["GET"])
+def stream():
+    """
+    Push room status, timer and pi node status changes as Server-Sent
+    Events, only when they change. Reconnecting clients send
+    "Last-Event-ID" and pick up where they left off.
+    Each worker only holds so many streams (see "src/serving.py"), the
+    rest get a 503 and poll.
+    """
+    release = stream_hub.connect()
+    if release is None:
+        return "Too Many Streams, Poll Instead", 503, {"Retry-After": "10"}
+    g.stream_release = release
+    room = g.room
+    last_id = request.headers.get("Last-Event-ID")
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    events = stream_hub.events(
+        room.keys.key(RedisKeys.API_STREAM_EVENTS), last_id,
+        lambda: generate_dynamic_payload(room), release)
+    response = Response(events, mimetype="text/event-stream",
+                        headers=headers)
+    # A body that's never read never runs the generator's "finally".
+    response.call_on_close(release)
+    return response
+
+
+@room_routes.route("/start/",
+                   defaults={"gameguide": "None", "players": "None"})
+@room_routes.route("/start/<gameguide>/<players>", methods=["POST"])
 def start(gameguide, players):
     """
     Start the room!
     Get the gameguide name and number of players
     This will eventually log the room running in a database
     """
-    if Timer().has_started:
-        return "Error: Room Already Started", 400
-    return toggle_state()
+    return transition_room("start")
 
 
-@app.route("/toggle_state", methods=["POST"])
+@room_routes.route("/toggle_state", methods=["POST"])
 def toggle_state():
-    timer = Timer()
-    if not timer.has_started:
-        timer.start()
-        pi_node_controller.broadcast(Broadcasts.ROOM_START)
-        RedisKeys.API_ROOM_STATUS.set(RoomStatus.RUNNING)
-        return Broadcasts.ROOM_START, 200
-
-    if not timer.is_paused:
-        timer.pause()
-        pi_node_controller.broadcast(Broadcasts.PAUSE)
-        RedisKeys.API_ROOM_STATUS.set(RoomStatus.PAUSED)
-        return RoomStatus.PAUSED, 200
-
-    timer.resume()
-    pi_node_controller.broadcast(Broadcasts.RESUME)
-    RedisKeys.API_ROOM_STATUS.set(RoomStatus.RUNNING)
-    return RoomStatus.RUNNING, 200
+    """
+    Start, pause or resume the room, whichever is next.
+    Send "X-State-Version" to have it refused (409) if the room changed
+    since that version.
+    """
+    return transition_room("toggle")
 
 
-@app.route("/override/<trigger_name>", methods=["POST"])
+@room_routes.route("/override/<trigger_name>", methods=["POST"])
 def override_broadcast(trigger_name):
     """
     Set an override for the room.
     """
-    pi_node_controller.broadcast(trigger_name)
+    g.room.event_log.record(EventTypes.OVERRIDE, {"message": trigger_name})
+    g.room.pi_node_controller.dispatch(trigger_name)
     return "Not Implemented (Override Broadcast)", 501
 
 
-@app.route("/override/<trigger_name>/<pi_name>", methods=["POST"])
+@room_routes.route("/override/<trigger_name>/<pi_name>", methods=["POST"])
 def override_relay(trigger_name, pi_name):
     """
     Set an override for a specific Pi.
     """
-    pi_node_controller.relay(pi_name, trigger_name)
+    g.room.event_log.record(EventTypes.OVERRIDE, {
+        "message": trigger_name,
+        "name": pi_name,
+    })
+    g.room.pi_node_controller.relay(pi_name, trigger_name)
     return "Not Implemented (Override Relay)", 501
 
 
-@app.route("/reset", methods=["POST"])
+@room_routes.route("/reset", methods=["POST"])
 def reset():
-    print("SIMULATING RESET SINCE NO PIS ARE CONNECTED")
-    pi_node_controller.broadcast(Broadcasts.RESET)
-    return restart_api()
+    """
+    Reset the room and load it again. Only this room is touched, the API
+    and the other rooms keep running.
+    """
+    response = transition_room("reset")
+    if response[1] != 200:
+        return response
+    g.room.initialize()
+    start_loading(g.room)
+    return "Resetting Room", 200
 
 
-@app.route("/stop", methods=["POST"])
+@room_routes.route("/stop", methods=["POST"])
 def stop():
     """
     Stop the room.
     """
-    Timer().stop()
-    pi_node_controller.broadcast(Broadcasts.STOP)
-    RedisKeys.API_ROOM_STATUS.set(RoomStatus.STOPPED)
-    return RoomStatus.STOPPED, 200
+    return transition_room("stop")
 
 
-@app.route("/restart_api", methods=["POST"])
+@room_routes.route("/relay_queue/retry_dead", methods=["POST"])
+def retry_dead_relays():
+    """
+    Queue every dead letter again, the pis ignore any they already ran.
+    Dead letters of pis that were removed from the config are kept.
+    """
+    requeued = g.room.relay_queue.retry_dead(g.room.pi_node_controller.names)
+    return f"Requeued {requeued} Relays", 200
+
+
+@room_routes.route("/restart_api", methods=["POST"])
 def restart_api():
     """
-    Restart the server.
-    This might be useful outside of "reset" but I doubt it.
-    This probably breaks everything if you do it while the room is running.
+    Restart the server, for every room. Config edits are picked up
+    without this (see "config_snapshot.py"), except for the "api",
+    "redis", "rooms" and "profiling" sections.
+    This probably breaks everything if you do it while a room is running.
     """
     pid = RedisKeys.GUNICORN_PID.get()
     print(f"Restarting server with PID: {pid}")
@@ -178,24 +477,28 @@ def restart_api():
 ###############################################################################
 
 
-@app.route("/trigger/", defaults={"message": "None"})
-@app.route("/trigger/<message>", methods=["POST"])
+@room_routes.route("/trigger/", defaults={"message": "None"})
+@room_routes.route("/trigger/<message>", methods=["POST"])
 def trigger(message):
     """
     This is technically identical to "override_broadcast" but it's the pi
     nodes alerting the server of a trigger, rather than the front end trying
     to bypass a problem or manually setting the state of something.
     """
-    pi_node_controller.broadcast(message)
+    g.room.event_log.record(EventTypes.TRIGGER, {
+        "message": message,
+        "from": request.remote_addr,
+    })
+    g.room.pi_node_controller.dispatch(message)
     return f"Triggered: {message}", 200
 
 
-@app.route("/update_status/<pi_name>/<status>", methods=["POST"])
+@room_routes.route("/update_status/<pi_name>/<status>", methods=["POST"])
 def update_status(pi_name, status):
     """
     Update the status of a Pi.
     """
-    pi_node_controller.update_status(pi_name, status)
+    g.room.pi_node_controller.update_status(pi_name, status)
     return f"Updated Status: {pi_name} - {status}", 200
 
 
@@ -204,61 +507,119 @@ def update_status(pi_name, status):
 ###############################################################################
 
 
-def generate_full_payload() -> dict:
+def generate_full_payload(room) -> dict:
     """
     Combine the two payloads into one, keep data divided.
     """
     payload = {}
-    payload["dynamic"] = generate_dynamic_payload()
-    payload["static"] = generate_static_payload()
+    payload["dynamic"] = generate_dynamic_payload(room)
+    payload["static"] = generate_static_payload(room)
     return payload
 
 
-def generate_dynamic_payload() -> dict:
+def generate_dynamic_payload(room) -> dict:
     """
     Generate the dynamic payload for the room.
     This is data that will likely change during the server's uptime.
+    Everything is read in one round trip, see "snapshot.py".
     """
-    payload = {}
-    payload["worker_id"] = worker_id
-    payload["load_percentage"] = RedisKeys.API_LOAD_PERCENTAGE.get()
-    payload["room_status"] = RedisKeys.API_ROOM_STATUS.get()
-    payload["time_remaining_secs"] = Timer().get_remaining_time()
-    payload["time_remaining_formatted"] = Timer().get_time_formatted()
-    payload["pi_nodes"] = pi_node_controller.get_serializable_pis()
-    return payload
+    snapshot = RoomSnapshot(room.pi_node_controller, room.keys)
+    return snapshot.to_payload(worker_id)
 
 
-def generate_static_payload():
+def generate_static_payload(room):
     """
     Generate the static payload for the room.
     This is data that will not change between server restarts.
+    The file based data is cached, see "static_cache.py".
+    """
+    config = room.config
+    payload = dict(room.static_cache.get(
+        room.config_file, lambda _: build_static_payload(config),
+        version=room.config_version))
+    payload["last_boot"] = RedisKeys.API_LAST_BOOT.get()
+    return payload
+
+
+def build_static_payload(config):
+    """
+    Build the file based part of the static payload from the room's
+    compiled config. Returns the payload and every file it was read from.
     """
-    config = open_yaml_as_dict(RedisKeys.API_YAML_CONFIG.get())
     payload = {}
     payload["room_name"] = config["room_info"]["name"].upper()
-    payload["last_boot"] = RedisKeys.API_LAST_BOOT.get()
     payload["overrides"] = generate_override_endpoints()
-    payload["script"] = generate_script_html()
+    payload["script"] = generate_script_html(config["script"])
     payload["timer_length_secs"] = Timer().length * 60
-    return payload
+    return payload, [config["script"]]
 
 
-def generate_script_html():
+def generate_script_html(script_file):
     """
     Return the script for the room.
     This gives the front end the script to display for the gameguide.
     """
     # Open file and return the contents.
-    script_file = config["script"]
     script_data = ""
     with open(script_file, "r") as f:
         script_data = f.read()
 
+    # Only needed when the script changes, so it's imported here.
+    import markdown
     html = markdown.markdown(script_data)
     return html
 
 
+def transition_room(op):
+    """
+    Move the timer, the room status and the broadcast together (see
+    "room_state.py"), then send the broadcast. Returns the response.
+    """
+    version = request.headers.get("X-State-Version")
+    if version is not None and not version.isdigit():
+        return "Error: X-State-Version Must Be A Number", 400
+
+    room_state = g.room.room_state
+    transition = room_state.transition(op, version)
+    if transition.result == TimerResults.STALE:
+        return f"Error: Room Changed (Now {transition.version})", 409
+    if transition.result == TimerResults.ALREADY_STARTED:
+        return "Error: Room Already Started", 400
+    if not transition.ok:
+        return f"Error: {TIMER_ERRORS[transition.result]}", 400
+
+    room_state.flush()
+    if transition.op == "start":
+        return Broadcasts.ROOM_START, 200
+    return transition.room_status, 200
+
+
+def room_gauges() -> list:
+    """
+    The metrics that are read right now, not counted: queue depths, event
+    stream lengths and the static cache counters of every room.
+    """
+    gauges = []
+    for room in rooms.rooms():
+        label = room_label(room.room_id)
+        queued = room.relay_queue.stats(room.pi_node_controller.names)
+        for name, depth in queued["pending"].items():
+            gauges.append(("escapewright_relay_queue_depth",
+                           {"room": label, "pi": name}, depth))
+        gauges.append(("escapewright_relay_dead_letters",
+                       {"room": label}, queued["dead_letters"]))
+        gauges.append(("escapewright_event_log_length", {"room": label},
+                       room.event_log.length()))
+        cache = room.static_cache.stats()
+        gauges.append(("escapewright_static_cache_hits_total",
+                       {"room": label}, cache["total_hits"]))
+        gauges.append(("escapewright_static_cache_misses_total",
+                       {"room": label}, cache["total_misses"]))
+        gauges.append(("escapewright_static_cache_hit_ratio",
+                       {"room": label}, cache["hit_ratio"]))
+    return gauges
+
+
 def generate_override_endpoints():
     return "TODO"
 
@@ -310,40 +671,47 @@ def uptime() -> str:
     return formatted_time
 
 
-def load():
-    """
-    Return the load percentage of the room.
-    This will be for letting the front end to know it can open up.
-    Right now this is just phony data, TODO real loading.
-    This will need error checking, it will need to restart the API if it locks
-    out from HTML requests. This will be a beeeefy function.
-    """
-    print("Loading Room...")
-    RedisKeys.API_LOADING_STATUS.set(LoadingStatus.ACTIVE)
-    print("WARNING THIS IS NOT A REAL LOAD PERCENTAGE")
-    percent = RedisKeys.API_LOAD_PERCENTAGE.get()
-    percent = int(percent)
+###############################################################################
+#                               Worker Startup                                #
+###############################################################################
 
-    while percent < 100:
-        time.sleep(0.5)
-        percent += 10
-        RedisKeys.API_LOAD_PERCENTAGE.set(percent)
-        print(f"Loading Room... {percent}%")
 
-    if percent >= 100:
-        RedisKeys.API_ROOM_STATUS.set(RoomStatus.READY)
-    RedisKeys.API_LOADING_STATUS.set(LoadingStatus.IDLE)
-    return
+app.register_blueprint(room_routes)
+app.register_blueprint(room_routes, url_prefix="/rooms/<room_id>",
+                       name="rooms")
 
 
-###############################################################################
-#                              Initial Room Loading                           #
-###############################################################################
+def start_loading(room):
+    """
+    Load the room in the background, the worker serves requests right away.
+    Only one worker (whichever gets the lock) does the loading.
+    """
+    RoomLoader(
+        room.pi_node_controller,
+        warmups=[lambda: generate_static_payload(room)],
+        set_room_status=room.set_status,
+        keys=room.keys,
+        log=room.event_log,
+    ).start()
+    return
 
 
-if worker_id == 0:
-    load()
+def init_worker():
+    """
+    Everything that has to happen in each worker, after it's forked.
+    The rest of this module is imported once by the gunicorn master and
+    shared by the workers, see "preload" in "gunicorn.conf.py".
+    """
+    global worker_id
+    worker_id = RedisKeys.API_WORKER_ID.get_then_increment()
+    config_watcher.start()
+    for room in rooms.rooms():
+        threading.Thread(target=room.pi_node_controller.prewarm_connections,
+                         daemon=True).start()
+        start_loading(room)
+    return
 
 
 if __name__ == "__main__":
+    init_worker()
     app.run()
@@ -0,0 +1,77 @@
+###############################################################################
+# Description: Times how long the master and every worker take to boot
+# Version: 0.1
+###############################################################################
+
+import json
+import time
+
+from src.redis_keys import RedisKeys
+
+
+class BootProfile:
+    """
+    Times the phases of one boot, from when it's made until "report".
+    Every "mark" ends a phase, so the phases always add up to the total.
+
+    The report is printed, and kept in redis (the newest KEPT of them) so
+    the boot times before and after a change can be compared with
+    "/fetch/boot_stats".
+
+    Public Properties:
+    -label: What booted, ("Master", "Worker 3")
+    -total: Seconds since the profile was made.
+
+    Public Methods:
+    -mark: End the current phase.
+    -report: Print and save the phases.
+    -recent: The newest reports, from every process.
+    """
+
+    KEPT = 50  # Reports kept in redis
+
+    def __init__(self, label: str):
+        self.label = label
+        self.__started = time.perf_counter()
+        self.__last = self.__started
+        self.__phases = []
+
+    @property
+    def total(self) -> float:
+        return self.__last - self.__started
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.__phases.append((phase, now - self.__last))
+        self.__last = now
+        return
+
+    def report(self) -> dict:
+        phases = ", ".join(f"{phase} {secs * 1000:.0f}ms"
+                           for phase, secs in self.__phases)
+        print(f"{self.label} ready in {self.total * 1000:.0f}ms ({phases})")
+
+        report = {}
+        report["label"] = self.label
+        report["at"] = time.time()
+        report["total_ms"] = round(self.total * 1000, 1)
+        report["phases_ms"] = {phase: round(secs * 1000, 1)
+                               for phase, secs in self.__phases}
+        try:
+            r = RedisKeys.REDIS.value
+            pipe = r.pipeline(transaction=False)
+            pipe.lpush(str(RedisKeys.API_BOOT_TIMES), json.dumps(report))
+            pipe.ltrim(str(RedisKeys.API_BOOT_TIMES), 0, self.KEPT - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"Boot report not saved: {e}")
+        return report
+
+    @classmethod
+    def recent(cls, count: int = KEPT) -> list:
+        """
+        The newest reports first.
+        """
+        raws = RedisKeys.REDIS.value.lrange(
+            str(RedisKeys.API_BOOT_TIMES), 0, count - 1)
+        return [json.loads(raw) for raw in raws]
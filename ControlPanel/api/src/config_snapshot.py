@@ -0,0 +1,378 @@
+###############################################################################
+# Description: Compiled, versioned room configs shared through redis
+# Version: 0.1
+###############################################################################
+
+import hashlib
+import ipaddress
+import json
+import os
+import threading
+import time
+
+import yaml
+from src.enums import ConfigKeys
+from src.event_log import EventTypes
+from src.redis_keys import RedisKeys, RoomKeys
+from src.redis_pool import get_redis
+
+# Sections only read while the API boots, changing them needs a restart.
+RESTART_SECTIONS = ("api", "redis", "rooms", "profiling")
+
+# Stores a compiled config, and bumps the version only if it changed.
+# The fingerprint is stored either way, so nobody compiles it again.
+# KEYS[1] = snapshot hash, KEYS[2] = version counter
+# ARGV = hash, data, fingerprint, config_file, compiled_at
+publish_script = get_redis().register_script("""
+if redis.call('HGET', KEYS[1], 'hash') == ARGV[1] then
+    redis.call('HSET', KEYS[1], 'fingerprint', ARGV[3])
+    redis.call('HDEL', KEYS[1], 'rejected', 'error')
+    return {0, tonumber(redis.call('HGET', KEYS[1], 'version'))}
+end
+local version = redis.call('INCR', KEYS[2])
+redis.call('HSET', KEYS[1], 'hash', ARGV[1], 'data', ARGV[2],
+           'fingerprint', ARGV[3], 'config_file', ARGV[4],
+           'compiled_at', ARGV[5], 'version', version)
+redis.call('HDEL', KEYS[1], 'rejected', 'error')
+return {1, version}
+""")
+
+
+class ConfigError(ValueError):
+    """
+    A config that can't be used, with every problem found in it.
+    """
+
+    def __init__(self, config_file: str, problems: list):
+        self.config_file = config_file
+        self.problems = problems
+        super().__init__(f"{config_file}: {'; '.join(problems)}")
+
+
+def compile_config(config_file: str) -> dict:
+    """
+    Parse a room's config and check everything the API needs from it.
+    The pi nodes come back with every field filled in, so nothing after
+    this has to check them again. Raises a ConfigError.
+    """
+    try:
+        with open(config_file, "r") as f:
+            config = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise ConfigError(config_file, [str(e)])
+    if not isinstance(config, dict):
+        raise ConfigError(config_file, ["not a YAML mapping"])
+
+    problems = []
+    room_info = config.get("room_info")
+    if not isinstance(room_info, dict) or not room_info.get("name"):
+        problems.append("room_info needs a name")
+    script = config.get("script")
+    if not isinstance(script, str) or not os.path.isfile(script):
+        problems.append(f"script {script} is not a file")
+    if not isinstance(config.get("rooms") or {}, dict):
+        problems.append("rooms must be a mapping of id: config file")
+    if not isinstance(config.get("room_overrides") or [], list):
+        problems.append("room_overrides must be a list")
+
+    pi_nodes = []
+    names = set()
+    for i, pi in enumerate(config.get(ConfigKeys.PI_NODES) or []):
+        if not isinstance(pi, dict) or not pi.get("name"):
+            problems.append(f"pi_nodes[{i}] needs a name")
+            continue
+        name = str(pi["name"])
+        if name in names:
+            problems.append(f"pi {name} is in pi_nodes twice")
+        names.add(name)
+        try:
+            ip = str(ipaddress.ip_address(str(pi.get("ip"))))
+        except ValueError:
+            problems.append(f"pi {name} has a bad ip {pi.get('ip')}")
+            continue
+        triggers = pi.get("triggers") or []
+        if not isinstance(triggers, list):
+            problems.append(f"pi {name} triggers must be a list")
+            continue
+        node = {}
+        node["name"] = name
+        node["ip"] = ip
+        node["location"] = pi.get("location")
+        node["triggers"] = [str(trigger) for trigger in triggers]
+        pi_nodes.append(node)
+    if problems:
+        raise ConfigError(config_file, problems)
+
+    config[ConfigKeys.PI_NODES] = pi_nodes
+    return config
+
+
+def fingerprint(config_file: str) -> str:
+    """
+    Changes whenever the file is written, without reading it.
+    """
+    try:
+        stat = os.stat(config_file)
+    except FileNotFoundError:
+        return f"{config_file}:missing"
+    return f"{config_file}:{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def diff_pi_nodes(old: list, new: list) -> dict:
+    """
+    The names of the pis that were added, removed, moved (a new ip or
+    location, so the PiNode has to be rebuilt) or only given new triggers.
+    """
+    old = {pi["name"]: pi for pi in old or []}
+    new = {pi["name"]: pi for pi in new or []}
+    diff = {}
+    diff["added"] = [name for name in new if name not in old]
+    diff["removed"] = [name for name in old if name not in new]
+    diff["moved"] = []
+    diff["rerouted"] = []
+    for name in new:
+        if name not in old:
+            continue
+        if (new[name]["ip"], new[name]["location"]) != (
+                old[name]["ip"], old[name]["location"]):
+            diff["moved"].append(name)
+        elif new[name]["triggers"] != old[name]["triggers"]:
+            diff["rerouted"].append(name)
+    return diff
+
+
+def diff_configs(old: dict, new: dict) -> dict:
+    """
+    What changed between two compiled configs: the pis (see
+    "diff_pi_nodes"), the other sections, and which of those need a
+    restart to take effect.
+    """
+    old = old or {}
+    diff = diff_pi_nodes(old.get(ConfigKeys.PI_NODES),
+                         new.get(ConfigKeys.PI_NODES))
+    sections = [section for section in set(old) | set(new)
+                if section != ConfigKeys.PI_NODES
+                and old.get(section) != new.get(section)]
+    diff["sections"] = sorted(sections)
+    diff["restart_needed"] = sorted(
+        section for section in sections if section in RESTART_SECTIONS)
+    return diff
+
+
+class ConfigStore:
+    """
+    Every room's compiled config, kept in the room's APIConfigSnapshot hash
+    so a process loads it with one HMGET and a json.loads, instead of
+    parsing and checking the YAML again.
+
+    A snapshot is stored with a hash of its contents. Storing the same
+    config again changes nothing, a different one gets the next number of
+    the APIConfigVersion counter (shared by every room), so a process only
+    has to read that counter to know if any room changed.
+
+    Public Methods:
+    -version: The newest version of any room's config.
+    -get / get_many: The stored snapshots, None if there isn't one.
+    -load: The stored snapshot, compiled and stored first if there isn't
+        one (or it's for another file).
+    -publish: Compile a config and store it, if it changed.
+    -reject: Remember a config that didn't compile, so it's tried once.
+    -status: The version and the last error, for "/fetch/config".
+    """
+
+    FIELDS = ("version", "hash", "data", "config_file", "fingerprint",
+              "rejected")
+
+    def __init__(self):
+        self.r = RedisKeys.REDIS.value
+
+    def version(self) -> int:
+        return int(self.r.get(str(RedisKeys.API_CONFIG_VERSION)) or 0)
+
+    def get(self, keys: RoomKeys) -> dict:
+        return self.get_many([keys])[0]
+
+    def get_many(self, keys_list: list) -> list:
+        pipe = self.r.pipeline(transaction=False)
+        for keys in keys_list:
+            pipe.hmget(keys.key(RedisKeys.API_CONFIG_SNAPSHOT), self.FIELDS)
+        return [self.__snapshot(values) for values in pipe.execute()]
+
+    def load(self, keys: RoomKeys, config_file: str) -> dict:
+        snapshot = self.get(keys)
+        if snapshot is None or snapshot["config_file"] != config_file:
+            snapshot = self.publish(keys, config_file)[1]
+        return snapshot
+
+    def publish(self, keys: RoomKeys, config_file: str,
+                config: dict = None) -> tuple:
+        """
+        Store "config" (compiled from "config_file" if not given).
+        Returns (changed, snapshot). Raises a ConfigError.
+        """
+        stamp = fingerprint(config_file)
+        if config is None:
+            config = compile_config(config_file)
+        data = json.dumps(config, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        changed, version = publish_script(
+            keys=[keys.key(RedisKeys.API_CONFIG_SNAPSHOT),
+                  str(RedisKeys.API_CONFIG_VERSION)],
+            args=[digest, data, stamp, config_file, time.time()])
+        snapshot = {}
+        snapshot["version"] = version
+        snapshot["hash"] = digest
+        snapshot["config"] = config
+        snapshot["config_file"] = config_file
+        snapshot["fingerprint"] = stamp
+        snapshot["rejected"] = None
+        return bool(changed), snapshot
+
+    def reject(self, keys: RoomKeys, stamp: str, error: str) -> None:
+        self.r.hset(keys.key(RedisKeys.API_CONFIG_SNAPSHOT),
+                    mapping={"rejected": stamp, "error": error})
+        return
+
+    def status(self, keys: RoomKeys) -> dict:
+        values = self.r.hmget(keys.key(RedisKeys.API_CONFIG_SNAPSHOT),
+                              ("version", "hash", "config_file",
+                               "compiled_at", "error"))
+        values = [v.decode("utf-8") if v is not None else None
+                  for v in values]
+        status = {}
+        status["version"] = int(values[0] or 0)
+        status["hash"] = values[1]
+        status["config_file"] = values[2]
+        status["compiled_at"] = float(values[3] or 0)
+        status["error"] = values[4]
+        return status
+
+    def __snapshot(self, values):
+        if values[0] is None:
+            return None
+        values = [v.decode("utf-8") if v is not None else None
+                  for v in values]
+        snapshot = {}
+        snapshot["version"] = int(values[0])
+        snapshot["hash"] = values[1]
+        snapshot["config"] = json.loads(values[2])
+        snapshot["config_file"] = values[3]
+        snapshot["fingerprint"] = values[4]
+        snapshot["rejected"] = values[5]
+        return snapshot
+
+
+config_store = ConfigStore()
+
+
+class ConfigWatcher:
+    """
+    Picks up config edits without restarting anything. Every process runs
+    one on a background thread, every POLL_INTERVAL it:
+
+    1. Looks at every room's config file (one os.stat each). If one was
+       written, whichever process gets the APIConfigWatcher lock compiles
+       it and stores it (see "ConfigStore"). The others see the new
+       fingerprint in redis and leave it alone. A config that doesn't
+       compile is reported once and the old one stays in use.
+    2. Reads the version counter. If it moved, the rooms with a new
+       snapshot apply it as a diff (see "Room.apply"): only the pis that
+       were added, removed or moved change, every other pi keeps its
+       PiNode, its connections and its cached state.
+
+    Changes to RESTART_SECTIONS are stored, but only used after a restart.
+
+    Public Methods:
+    -start: Start watching in this process, if it isn't already.
+    -poll: One round of the above, returns if anything was applied.
+    """
+
+    POLL_INTERVAL = 1  # Seconds between looks at the files and the counter
+    LOCK_TTL = 10  # Seconds the lock outlives a process that died with it
+
+    def __init__(self, registry, on_change=None):
+        self.registry = registry
+        self.on_change = on_change
+        self.store = config_store
+        self.__fingerprints = {}  # room id: the fingerprint last handled
+        self.__version = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Threads don't survive a fork, so this checks the pid.
+        """
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            threading.Thread(target=self.__watch, daemon=True).start()
+            self.__pid = os.getpid()
+        return
+
+    def poll(self) -> bool:
+        for room_id, config_file in self.registry.config_files().items():
+            stamp = fingerprint(config_file)
+            if self.__fingerprints.get(room_id) != stamp:
+                if self.__compile(room_id, config_file, stamp):
+                    self.__fingerprints[room_id] = stamp
+
+        version = self.store.version()
+        if version == self.__version:
+            return False
+        self.__version = version
+        applied = self.registry.apply(self.store)
+        if applied and self.on_change is not None:
+            self.on_change()
+        return applied
+
+    def __watch(self):
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Config watcher failed: {e}")
+
+    def __compile(self, room_id, config_file, stamp) -> bool:
+        """
+        Compile and store the file unless someone already did. Returns
+        False if it has to be looked at again.
+        """
+        keys = RoomKeys(room_id)
+        stored = self.store.get(keys)
+        if stored is not None and stamp in (stored["fingerprint"],
+                                            stored["rejected"]):
+            return True
+        lock = self.store.r.lock(str(RedisKeys.API_CONFIG_WATCHER),
+                                 timeout=self.LOCK_TTL)
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            try:
+                config = compile_config(config_file)
+            except ConfigError as e:
+                print(f"Config not applied, keeping the old one: {e}")
+                self.store.reject(keys, stamp, str(e))
+                return True
+            diff = diff_configs(stored and stored["config"], config)
+            room = self.registry.get(room_id)
+            if room is not None:
+                room.prepare(diff, config)
+            changed, snapshot = self.store.publish(keys, config_file, config)
+            if changed and room is not None:
+                event = dict(diff)
+                event["version"] = snapshot["version"]
+                room.event_log.record(EventTypes.CONFIG, event)
+            if changed:
+                print(f"Config v{snapshot['version']} of {config_file}: "
+                      f"+{len(diff['added'])} -{len(diff['removed'])} "
+                      f"~{len(diff['moved']) + len(diff['rerouted'])} pis, "
+                      f"sections {diff['sections']}")
+            for section in diff["restart_needed"]:
+                print(f"Config: \"{section}\" changed, restart to use it")
+        finally:
+            lock.release()
+        return True
@@ -0,0 +1,246 @@
+###############################################################################
+# Description: The one process that sends queued relays to the pis
+# Version: 0.1
+###############################################################################
+
+import random
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from src.config_snapshot import ConfigWatcher
+from src.event_log import EventTypes
+from src.pi_node import PiNodeController
+from src.redis_keys import RedisKeys
+from src.relay_queue import relay_queue
+from src.rooms import RoomRegistry
+
+
+class Dispatcher:
+    """
+    Drains the relay queues (see "relay_queue.py") of every room. Gunicorn
+    starts one in "when_ready", and a redis lock makes sure only one is ever
+    sending, even if a second one gets started.
+
+    Every pi has at most one relay in flight, so relays arrive in order.
+    A pass only looks at the queues it was woken for (see "RelayQueue.wake"),
+    the ones that just finished a relay and the ones due a retry, all of a
+    room's heads in one round trip. Every queue is looked at when the
+    dispatcher starts or the config changes.
+    A pi that fails gets retried with exponential backoff (and jitter),
+    while every other pi carries on. After MAX_ATTEMPTS the relay goes to
+    the dead letters so the pi's queue can move on.
+
+    Public Methods:
+    -run: Dispatch until the process is stopped.
+    -refresh: Pick up pis that were added or removed, before the next pass.
+    -stop: Let go of the lock, so the next dispatcher takes over at once.
+    """
+
+    BACKOFF_BASE = 0.25  # Seconds before the first retry
+    BACKOFF_MAX = 30  # Longest wait between retries
+    MAX_ATTEMPTS = 10  # About a minute and a half, enough for a reboot
+    LOCK_TTL = 10  # Seconds the lock outlives a dispatcher that died
+    IDLE_WAIT = 1  # Longest sleep when nothing is happening
+
+    def __init__(self, pi_node_controllers):
+        self.r = RedisKeys.REDIS.value
+        self.controllers = pi_node_controllers
+        self.lanes = self.__lanes()
+        self.stale = False  # Set by "refresh", from another thread
+        self.lock = self.r.lock(str(RedisKeys.API_RELAY_DISPATCHER),
+                                timeout=self.LOCK_TTL)
+        self.workers = 0
+        self.executor = None
+        self.__resize()
+        self.pending = set()  # Lanes to look at on the next pass
+        self.in_flight = {}  # lane: future
+        self.attempts = {}  # lane: (relay id, attempts so far)
+        self.retry_at = {}  # lane: monotonic time of the next attempt
+
+    def run(self):
+        while True:
+            if not self.lock.acquire(blocking=True, blocking_timeout=None):
+                continue
+            print("Relay dispatcher running")
+            self.pending = set(self.lanes)
+            try:
+                while True:
+                    self.lock.reacquire()
+                    if self.stale:
+                        self.stale = False
+                        self.lanes = self.__lanes()
+                        self.pending.update(self.lanes)
+                        self.__resize()
+                    self.__collect()
+                    self.__send_ready()
+                    self.pending.update(relay_queue.wait(self.__next_wake()))
+            except redis.exceptions.LockError:
+                print("Relay dispatcher lost its lock, waiting for it again")
+            except redis.exceptions.ConnectionError as e:
+                print(f"Relay dispatcher lost redis: {e}")
+                time.sleep(1)
+
+    def refresh(self):
+        self.stale = True
+        return
+
+    def stop(self):
+        """
+        Relays still in flight stay at the head of their queue, the next
+        dispatcher sends them again with the same idempotency key.
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            if self.lock.owned():
+                self.lock.release()
+        except redis.exceptions.RedisError as e:
+            print(f"Relay dispatcher couldn't let go of its lock: {e}")
+        return
+
+    def __lanes(self) -> dict:
+        """
+        Every pi of every room is a lane, named after its queue's key.
+        """
+        lanes = {}  # queue key: (pi_node_controller, name)
+        for controller in self.controllers:
+            for name in controller.names:
+                lanes[controller.relay_queue.key(name)] = (controller, name)
+        return lanes
+
+    def __resize(self):
+        """
+        One thread per lane, so a slow pi never holds up another one.
+        """
+        workers = max(1, len(self.lanes))
+        if workers == self.workers:
+            return
+        old = self.executor
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="dispatcher")
+        self.workers = workers
+        if old is not None:
+            old.shutdown(wait=False)  # Relays in flight finish on it
+        return
+
+    def __send_ready(self):
+        """
+        Start sending the head of every pending queue that isn't busy or
+        backing off. Busy ones are looked at again when their relay
+        finishes, backing off ones when their retry is due.
+        """
+        now = time.monotonic()
+        for lane, retry_at in self.retry_at.items():
+            if retry_at <= now:
+                self.pending.add(lane)
+        by_controller = {}  # pi_node_controller: [name]
+        for lane in self.pending:
+            if lane not in self.lanes or lane in self.in_flight:
+                continue
+            if self.retry_at.get(lane, 0) > now:
+                continue
+            controller, name = self.lanes[lane]
+            by_controller.setdefault(controller, []).append(name)
+        self.pending = set()
+
+        for controller, names in by_controller.items():
+            heads = controller.relay_queue.heads(names)
+            for name, (raw, relay) in heads.items():
+                pi = controller.find_by_name(name)
+                if pi is None:
+                    continue  # Removed from the config since "refresh"
+                future = self.executor.submit(self.__deliver, pi, raw, relay)
+                future.add_done_callback(self.__wake)
+                self.in_flight[controller.relay_queue.key(name)] = future
+
+    def __wake(self, future):
+        """
+        Cut the dispatcher's wait short, a relay finished.
+        """
+        relay_queue.wake([])
+        return
+
+    def __deliver(self, pi, raw, relay):
+        start = time.monotonic()
+        ok = pi.relay(relay["message"], PiNodeController.RELAY_TIMEOUT,
+                      idempotency_key=relay["id"])
+        return raw, relay, ok, time.monotonic() - start
+
+    def __collect(self):
+        """
+        Handle every relay that finished since the last pass.
+        """
+        for lane, future in list(self.in_flight.items()):
+            if not future.done():
+                continue
+            del self.in_flight[lane]
+            if lane not in self.lanes:
+                continue  # The pi was removed from the config
+            controller, name = self.lanes[lane]
+            raw, relay, ok, latency = future.result()
+            relay_id, attempts = self.attempts.get(lane, (relay["id"], 0))
+            if relay_id != relay["id"]:
+                attempts = 0
+            attempts += 1
+
+            event = {}
+            event["name"] = name
+            event["message"] = relay["message"]
+            event["id"] = relay["id"]
+            event["ok"] = ok
+            event["latency"] = latency
+            event["attempt"] = attempts
+            event["queued_secs"] = time.time() - relay["queued_at"]
+            controller.event_log.record(EventTypes.RELAY_RESULT, event)
+
+            if ok:
+                controller.relay_queue.done(name, raw)
+                self.attempts.pop(lane, None)
+                self.retry_at.pop(lane, None)
+                self.pending.add(lane)
+            elif attempts >= self.MAX_ATTEMPTS:
+                print(f"Relay {relay['message']} to {name} gave up")
+                controller.relay_queue.kill(name, raw,
+                                            f"failed {attempts} times")
+                self.attempts.pop(lane, None)
+                self.retry_at.pop(lane, None)
+                self.pending.add(lane)
+            else:
+                self.attempts[lane] = (relay["id"], attempts)
+                self.retry_at[lane] = time.monotonic() + self.__backoff(
+                    attempts)
+
+    def __backoff(self, attempts) -> float:
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def __next_wake(self) -> float:
+        """
+        How long to wait for new relays before something else needs doing.
+        Relays that finish wake the dispatcher themselves.
+        """
+        wake = self.IDLE_WAIT
+        now = time.monotonic()
+        for retry_at in self.retry_at.values():
+            wake = min(wake, retry_at - now)
+        return wake
+
+
+def main():
+    registry = RoomRegistry()
+    dispatcher = Dispatcher([room.pi_node_controller
+                             for room in registry.rooms()])
+    ConfigWatcher(registry, on_change=dispatcher.refresh).start()
+    # Gunicorn stops it on a reload and starts a new one, see "on_reload".
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        dispatcher.run()
+    finally:
+        dispatcher.stop()
+        print("Relay dispatcher stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,7 @@ class LoadingStatus():
 class ConfigKeys():
     CONFIG_YAML = "./src/config.yaml"
     PI_NODES = "pi_nodes"
+    REDIS = "redis"
 
 
 class Broadcasts():
@@ -0,0 +1,283 @@
+###############################################################################
+# Description: Append only log of everything that happens during a run
+# Version: 0.1
+###############################################################################
+
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+from src.metrics import metrics
+from src.redis_keys import RedisKeys
+
+
+class EventTypes:
+    """
+    The typed events in the log. The live stream ("/stream") pushes the
+    same events under the same names.
+    """
+    TRIGGER = "trigger"
+    OVERRIDE = "override"
+    RELAY_RESULT = "relay_result"
+    NODE_STATUS = "node_status"
+    ROOM_STATUS = "room_status"
+    TIMER = "timer"
+    CONFIG = "config"
+
+
+def now_us() -> int:
+    """
+    Microseconds on the wall clock, every event is stamped with this when
+    it happens, not when it's written.
+    """
+    return time.time_ns() // 1000
+
+
+def entry_fields(event_type: str, data: dict, ts_us: int = None) -> dict:
+    """
+    The fields of one stream entry.
+    """
+    fields = {}
+    fields["event"] = event_type
+    fields["ts_us"] = now_us() if ts_us is None else ts_us
+    fields["data"] = json.dumps(data)
+    return fields
+
+
+class EventWriter:
+    """
+    Writes are batched. "record" only queues the entry, a writer thread in
+    each worker sends whatever is queued in one pipelined round trip. A
+    request never waits on the log.
+
+    There is one writer per process, shared by every room's EventLog, so
+    another room never means another thread.
+
+    Public Methods:
+    -record: Queue an entry for a stream, returns right away.
+    -flush: Write everything that's queued.
+    -stats: Entries written and dropped by this worker.
+    """
+
+    BATCH = 200  # Most events written in one round trip
+    LINGER = 0.05  # Seconds the writer waits to fill a batch
+    QUEUE_SIZE = 10000  # Events a worker buffers before dropping new ones
+    RETENTION = 10000  # Events kept in each stream, a few runs worth
+
+    def __init__(self):
+        self.r = RedisKeys.REDIS.value
+        self.__queue = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.__write_lock = threading.Lock()
+        self.__written = 0
+        self.__dropped = 0
+        atexit.register(self.flush)
+
+    def record(self, stream_key: str, fields: dict) -> None:
+        try:
+            self.__get_queue().put_nowait((stream_key, fields))
+        except queue.Full:
+            self.__dropped += 1
+            metrics.inc("escapewright_event_log_dropped_total")
+        return
+
+    def flush(self) -> None:
+        """
+        Write everything that's queued in this worker, from this thread.
+        """
+        if self.__pid != os.getpid():
+            return
+        batch = self.__drain(block=False)
+        while batch:
+            self.__write(batch)
+            batch = self.__drain(block=False)
+        return
+
+    def stats(self) -> dict:
+        stats = {}
+        stats["written"] = self.__written
+        stats["dropped"] = self.__dropped
+        stats["queued"] = self.__queue.qsize() if self.__queue else 0
+        stats["retention"] = self.RETENTION
+        return stats
+
+    def count_written(self, count: int = 1) -> None:
+        self.__written += count
+        return
+
+    def __get_queue(self) -> queue.Queue:
+        """
+        Threads don't survive a fork, so every worker starts its own writer
+        the first time it records something.
+        """
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+                    self.__written = 0
+                    self.__dropped = 0
+                    thread = threading.Thread(target=self.__writer,
+                                              daemon=True)
+                    thread.start()
+                    self.__pid = os.getpid()
+        return self.__queue
+
+    def __drain(self, block: bool) -> list:
+        """
+        Take up to a batch off the queue. When blocking, wait for the first
+        event, then give the rest LINGER seconds to show up.
+        """
+        batch = []
+        try:
+            if block:
+                batch.append(self.__queue.get(timeout=1))
+                stop_at = time.monotonic() + self.LINGER
+                while len(batch) < self.BATCH:
+                    remaining = stop_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    batch.append(self.__queue.get(timeout=remaining))
+            while len(batch) < self.BATCH:
+                batch.append(self.__queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def __write(self, batch) -> None:
+        with self.__write_lock:
+            pipe = self.r.pipeline(transaction=False)
+            for stream_key, fields in batch:
+                pipe.xadd(stream_key, fields, maxlen=self.RETENTION,
+                          approximate=True)
+            pipe.execute()
+            self.__written += len(batch)
+        return
+
+    def __writer(self):
+        while True:
+            batch = self.__drain(block=True)
+            while batch:
+                try:
+                    self.__write(batch)
+                    batch = []
+                except Exception as e:
+                    print(f"Event log lost redis: {e}")
+                    time.sleep(1)
+
+
+event_writer = EventWriter()
+
+
+class EventLog:
+    """
+    Every trigger, relay, status change and timer transition of one room,
+    in order, in one capped redis stream. The stream is the live feed as
+    well, the "/stream" hub reads the same key, so there is one place to
+    look.
+
+    Writes go through the process's EventWriter, so a room's log is only
+    its stream key.
+
+    The stream id is the order the events were written in. "ts_us" is when
+    the event actually happened.
+
+    Public Methods:
+    -record: Queue an event, returns right away.
+    -append: Write an event now, returns its id.
+    -flush: Write everything that's queued.
+    -range: A page of events, oldest or newest first, with a cursor.
+    -length: Events in the stream right now.
+    -stats: Events written and dropped by this worker.
+    """
+
+    RETENTION = EventWriter.RETENTION  # Events kept in redis
+    MAX_PAGE = 1000  # Most events returned by one "range"
+
+    def __init__(self, stream_key: str = str(RedisKeys.API_STREAM_EVENTS),
+                 writer: EventWriter = None):
+        self.r = RedisKeys.REDIS.value
+        self.stream_key = stream_key
+        self.writer = writer or event_writer
+
+    def record(self, event_type: str, data: dict) -> None:
+        """
+        Stamp the event and queue it for the writer thread.
+        """
+        self.writer.record(self.stream_key, entry_fields(event_type, data))
+        return
+
+    def append(self, event_type: str, data: dict) -> str:
+        """
+        Write one event right now, for when the caller needs the id.
+        """
+        event_id = self.r.xadd(
+            self.stream_key, entry_fields(event_type, data),
+            maxlen=self.RETENTION, approximate=True)
+        self.writer.count_written()
+        return event_id.decode("utf-8")
+
+    def flush(self) -> None:
+        self.writer.flush()
+        return
+
+    def range(self, cursor: str = None, count: int = 100, types=None,
+              reverse: bool = False) -> dict:
+        """
+        Return a page of events after "cursor" (before it if "reverse").
+        "types" keeps only those event types.
+        Returns {"events": [...], "next": the cursor of the next page, or
+        None when there are no more events}.
+        """
+        count = max(1, min(int(count), self.MAX_PAGE))
+        types = set(types) if types else None
+        events = []
+        more = True
+        while more and len(events) < count:
+            entries = self.__read_page(cursor, count, reverse)
+            more = len(entries) == count
+            for i, entry in enumerate(entries):
+                cursor = entry[0].decode("utf-8")
+                event = self.__decode(entry)
+                if types is None or event["type"] in types:
+                    events.append(event)
+                if len(events) == count:
+                    more = more or i + 1 < len(entries)
+                    break
+
+        page = {}
+        page["events"] = events
+        page["next"] = cursor if more else None
+        return page
+
+    def length(self) -> int:
+        return self.r.xlen(self.stream_key)
+
+    def stats(self) -> dict:
+        """
+        The writer's counters, they cover every room in this worker.
+        """
+        return self.writer.stats()
+
+    def __read_page(self, cursor, count, reverse):
+        if reverse:
+            high = f"({cursor}" if cursor else "+"
+            return self.r.xrevrange(self.stream_key, max=high, min="-",
+                                    count=count)
+        low = f"({cursor}" if cursor else "-"
+        return self.r.xrange(self.stream_key, min=low, max="+", count=count)
+
+    def __decode(self, entry) -> dict:
+        event_id, fields = entry
+        event = {}
+        event["id"] = event_id.decode("utf-8")
+        event["type"] = fields[b"event"].decode("utf-8")
+        event["ts_us"] = int(fields.get(b"ts_us", 0))
+        event["data"] = json.loads(fields[b"data"])
+        return event
+
+
+event_log = EventLog()
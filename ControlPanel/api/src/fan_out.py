@@ -0,0 +1,165 @@
+###############################################################################
+# Description: Concurrent calls to many PiNodes at once
+# Version: 0.1
+###############################################################################
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class NodeResult:
+    """
+    The outcome of one call to one pi during a fan out.
+
+    Public Properties:
+    -name: The name of the pi.
+    -ok: If the call succeeded.
+    -latency: Seconds from the start of the fan out until the pi answered.
+    -retries: How many times the call was retried.
+    -error: Why the call failed, None if it succeeded.
+    -value: Whatever the call returned.
+    """
+
+    def __init__(self, name, ok=False, latency=None, retries=0,
+                 error=None, value=None):
+        self.name = name
+        self.ok = ok
+        self.latency = latency
+        self.retries = retries
+        self.error = error
+        self.value = value
+
+    def __str__(self):
+        if self.ok:
+            return f"{self.name: <11} | OK {self.latency * 1000:.0f}ms"
+        return f"{self.name: <11} | FAILED ({self.error})"
+
+    def to_dict(self) -> dict:
+        info = {}
+        info["name"] = self.name
+        info["ok"] = self.ok
+        info["latency"] = self.latency
+        info["retries"] = self.retries
+        info["error"] = self.error
+        return info
+
+
+class FanOut:
+    """
+    Runs one call per pi on a thread pool, all at the same time. The pool
+    grows so every call in flight has a thread of its own, a room with more
+    dead pis than threads would otherwise queue the healthy ones behind
+    them until the deadline.
+
+    Every pi gets its own deadline (node_timeout), and the whole fan out
+    has a global deadline. A dead pi only costs its own deadline, and never
+    holds up the answer from the healthy ones. Calls still queued when the
+    deadline passes are cancelled, so the next fan out never waits on them.
+
+    The call is "call(pi, timeout)", it should return something truthy on
+    success. Falsy returns and exceptions are retried while there is time.
+
+    Public Methods:
+    -run: Call every pi and return {name: NodeResult}.
+    """
+
+    def __init__(self, min_workers: int = 16):
+        self.min_workers = min_workers
+        self.__executor = None
+        self.__workers = 0  # Threads in the current pool
+        self.__busy = 0  # Calls submitted that haven't finished
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    def run(self, pis, call, node_timeout=2.0, deadline=5.0,
+            retries=1) -> dict:
+        """
+        Call every pi in "pis" at once and wait until they all answered or
+        the global deadline passed. Pis that didn't make the deadline are
+        reported as failed, a call already running finishes in the
+        background, by its own timeout at the latest.
+        """
+        started = time.monotonic()
+        stop_at = started + deadline
+        pis = list(pis)
+        executor = self.__reserve(len(pis))
+
+        futures = {}
+        for pi in pis:
+            future = executor.submit(
+                self.__call_node, pi, call, node_timeout, stop_at, retries,
+                started)
+            future.add_done_callback(self.__release)
+            futures[future] = pi
+
+        done, not_done = wait(futures, timeout=deadline)
+        for future in not_done:
+            future.cancel()  # Only works if it never started
+
+        results = {}
+        for future, pi in futures.items():
+            if future in done:
+                results[pi.name] = future.result()
+            else:
+                results[pi.name] = NodeResult(pi.name, error="deadline")
+        return results
+
+    def __call_node(self, pi, call, node_timeout, stop_at, retries,
+                    started) -> NodeResult:
+        result = NodeResult(pi.name)
+        attempt = 0
+        while True:
+            timeout = min(node_timeout, stop_at - time.monotonic())
+            if timeout <= 0:
+                result.error = result.error or "deadline"
+                break
+            try:
+                value = call(pi, timeout)
+                if value:
+                    result.ok = True
+                    result.value = value
+                    result.error = None
+                    break
+                result.error = "failed"
+            except Exception as e:
+                result.error = str(e)
+
+            if attempt >= retries:
+                break
+            attempt += 1
+        result.retries = attempt
+        result.latency = time.monotonic() - started
+        return result
+
+    def __reserve(self, calls) -> ThreadPoolExecutor:
+        """
+        A pool with a thread for each of "calls" on top of the ones still
+        busy. A pool that's too small is replaced by a bigger one, the
+        calls on the old one finish there.
+
+        Threads don't survive a fork, so every gunicorn worker gets its own
+        pool the first time it fans out.
+        """
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__executor = None
+                self.__workers = 0
+                self.__busy = 0
+                self.__pid = os.getpid()
+            self.__busy += calls
+            if self.__executor is None or self.__busy > self.__workers:
+                old = self.__executor
+                self.__workers = max(self.min_workers, self.__busy)
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.__workers, thread_name_prefix="fan_out")
+                if old is not None:
+                    old.shutdown(wait=False)
+            return self.__executor
+
+    def __release(self, future):
+        with self.__lock:
+            self.__busy -= 1
+        return
+
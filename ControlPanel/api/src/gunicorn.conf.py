@@ -3,19 +3,40 @@ Gunicorn Configuration file for the API server.
 This handles starting all the globals that need to be initialized
 """
 
-import time
-from src.pi_node import PiNodeController
-from src.redis_keys import RedisKeys
-from src.timer import Timer
+from src.enums import ConfigKeys
+from src.serving import WorkerModes, patch_for_gevent, serving_settings
 from src.yaml_reader import open_yaml_as_dict
-from src.enums import RoomStatus, LoadingStatus, ConfigKeys
+
+api_config = open_yaml_as_dict(ConfigKeys.CONFIG_YAML)["api"]
+serving = serving_settings(api_config)
+if serving["worker_mode"] == WorkerModes.GEVENT:
+    # Before anything below imports redis, requests or threading.
+    # Changing "worker_mode" needs a restart, a reload is too late to patch.
+    patch_for_gevent()
+
+import gc  # noqa: E402
+import importlib  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from src.boot_profile import BootProfile  # noqa: E402
+from src.pi_node import migrate_string_keys  # noqa: E402
+from src.redis_keys import RedisKeys  # noqa: E402
+from src.rooms import RoomRegistry  # noqa: E402
+
+# gthread: open "/stream" connections each hold a thread, they get their own
+# threads so they never take the ones that serve normal requests.
+# gevent: every connection is a green thread, see "src/serving.py".
+stream_clients = serving["stream_clients"]
 
 # Settings that are used when running gunicorn with the -c flag.
 port = "12413"  # The EscapeWright API Port
 bind = f"0.0.0.0:{port}"  # Bind to all interfaces on port 12413
 workers = 5  # Number of copies of the application to start
-threads = 2  # Number of threads per worker
-worker_class = "gthread"  # Threaded worker class
+threads = serving["threads"]  # Number of threads per worker
+worker_class = serving["worker_class"]  # "gthread" or "gevent"
+if serving["worker_connections"]:
+    worker_connections = serving["worker_connections"]  # Per gevent worker
 timeout = 60  # One minute timeout for requests
 keepalive = 2  # Keep connections open for 2 seconds
 max_requests = 500  # Free memory after 500 requests
@@ -23,20 +44,131 @@ max_requests_jitter = 50  # Random jitter to prevent simultaneous restarts
 
 
 def on_starting(server):
-    initialize()
+    profile = BootProfile("Master")
+    initialize(profile)
+    preload(server, profile)
+    profile.report()
 
 
 def on_reload(server):
-    initialize()
+    profile = BootProfile("Master")
+    initialize(profile)
+    preload(server, profile)
+    profile.report()
+    restart_dispatcher(server)
+
+
+def post_fork(server, worker):
+    global worker_profile
+    worker_profile = BootProfile(f"Worker {worker.pid}")
+
+
+def post_worker_init(worker):
+    # Already imported if the master preloaded it, so this is free.
+    import src.app
+    worker_profile.mark("load app")
+    src.app.init_worker()
+    worker_profile.mark("init worker")
+    worker_profile.label = f"Worker {src.app.worker_id}"
+    worker_profile.report()
+
+
+def when_ready(server):
+    start_dispatcher(server)
+
+
+def on_exit(server):
+    stop_dispatcher(server)
 
 
-def initialize():
+dispatcher_stop_wait = 10  # Seconds the dispatcher gets to stop
+
+
+def start_dispatcher(server):
+    """
+    Start the process that sends queued relays to the pis (see
+    "src/dispatcher.py"), unless it's already running. It holds a redis
+    lock, so an extra one just waits.
+
+    Gunicorn runs this file again on every reload, so the process is kept
+    on the arbiter, a global here would be forgotten.
+    """
+    dispatcher = getattr(server, "relay_dispatcher", None)
+    if dispatcher is not None and dispatcher.poll() is None:
+        return
+    dispatcher = subprocess.Popen([sys.executable, "-m", "src.dispatcher"])
+    server.relay_dispatcher = dispatcher
+    print(f"Relay dispatcher PID: {dispatcher.pid}")
+
+
+def stop_dispatcher(server):
+    """
+    Stop the dispatcher and wait for it. It lets go of its lock on the way
+    out, so the next one doesn't wait for the lock to expire.
+    """
+    dispatcher = getattr(server, "relay_dispatcher", None)
+    if dispatcher is None or dispatcher.poll() is not None:
+        return
+    dispatcher.terminate()
+    try:
+        dispatcher.wait(timeout=dispatcher_stop_wait)
+    except subprocess.TimeoutExpired:
+        print("Relay dispatcher didn't stop, killing it")
+        dispatcher.kill()
+        dispatcher.wait()
+
+
+def restart_dispatcher(server):
+    """
+    The dispatcher reads the rooms when it starts, and a reload can add or
+    remove rooms, so the old one is replaced.
+    """
+    stop_dispatcher(server)
+    start_dispatcher(server)
+
+
+worker_profile = None  # This worker's boot times, see "src/boot_profile.py"
+
+
+def initialize(profile=None):
+    profile = profile or BootProfile("Master")
     init_pid()
     init_globals()
-    init_pis()
+    profile.mark("globals")
+    init_rooms()
+    profile.mark("rooms")
     startup_message()
 
 
+def preload(server, profile):
+    """
+    Import the app once in the master, so the workers are forked with the
+    config parsed, the PiNodes built and the static payload rendered,
+    instead of every worker doing it again. Gunicorn's own "preload_app"
+    imports the app before "on_starting", before redis is initialized.
+
+    On a reload the app is imported again, so new workers get the new
+    config. With --reload the workers have to import the code themselves,
+    or they'd never see the changes, so nothing is preloaded.
+    """
+    if server.cfg.reload:
+        print("Not preloading the app, --reload is on")
+        return
+    if "src.app" in sys.modules:
+        api = importlib.reload(sys.modules["src.app"])
+    else:
+        api = importlib.import_module("src.app")
+    profile.mark("import app")
+    for room in api.rooms.rooms():
+        api.generate_static_payload(room)
+    profile.mark("static payload")
+    # Everything so far lives as long as the master. Freezing it keeps the
+    # garbage collector from touching it, so the pages stay shared.
+    gc.collect()
+    gc.freeze()
+    profile.mark("freeze")
+
+
 def init_pid():
     """
     Initialize the PID for the gunicorn server.
@@ -56,25 +188,30 @@ def init_pid():
 def init_globals():
     """
     Initialize the global variables for the API server.
+    Everything that belongs to a room is set in "init_rooms".
     """
     RedisKeys.API_WORKER_ID.set(0)
-    RedisKeys.API_ROOM_STATUS.set(RoomStatus.BOOTING)
-    RedisKeys.API_LOADING_STATUS.set(LoadingStatus.IDLE)
-    RedisKeys.API_LOAD_PERCENTAGE.set(0)
-    RedisKeys.API_YAML_CONFIG.set(ConfigKeys.CONFIG_YAML)
-    Timer(new_timer=True)
     RedisKeys.API_LAST_BOOT.set(int(time.time()))
 
 
-def init_pis():
-    config = open_yaml_as_dict(RedisKeys.API_YAML_CONFIG.get())
-    pi_node_controller = PiNodeController(config[ConfigKeys.PI_NODES], initial=True)
-    pi_node_controller.clear_all_statuses()
-    pi_node_controller.print_all()
+def init_rooms():
+    """
+    Compile every room's config (see "src/config_snapshot.py"), and put
+    every room back to BOOTING, with its pis cleared and a new timer.
+    """
+    migrate_string_keys()
+    for room in RoomRegistry(initial=True).rooms():
+        room.initialize()
+        print(f"Room: {room.to_dict()['name']} ({room.url_prefix or '/'}), "
+              f"config v{room.config_version}")
+        room.pi_node_controller.print_all()
 
 
 def startup_message():
     print(f"Workers: {workers}, Threads: {threads}")
+    if serving["worker_connections"]:
+        print(f"Connections per worker: {worker_connections}")
+    print(f"Stream clients per worker: {stream_clients}")
     print(f"Worker class: {worker_class}, Timeout: {timeout}")
     print(f"Keepalive: {keepalive} Max requests: {max_requests}")
     print(f"Jitter: {max_requests_jitter}")
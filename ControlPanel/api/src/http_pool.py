@@ -0,0 +1,129 @@
+###############################################################################
+# Description: Shared keep-alive HTTP client for the whole process
+# Version: 0.1
+###############################################################################
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpPool:
+    """
+    One pooled, keep-alive requests.Session per process. Every request to
+    the same host reuses an open connection instead of doing a new TCP
+    handshake, so a relay or a status update costs the handler's time and
+    not the connection setup.
+
+    Each host gets at most "per_host" connections. Extra requests wait for
+    a connection to come back instead of opening new ones.
+
+    "max_hosts" caps how many hosts keep their connections, past that the
+    least recently used host loses its pool (and its open connections).
+    None (the default) keeps every host, a room's pis all stay warm
+    however many there are.
+
+    Public Methods:
+    -get / post: Same as requests.get / requests.post.
+    -prewarm: Open a connection to every host ahead of time.
+    -stats: Requests sent and connections opened, per host.
+    """
+
+    UNCAPPED_HOSTS = 100000  # urllib3 needs a number, pools are made on use
+    PREWARM_THREADS = 64  # Most hosts "prewarm" connects to at once
+
+    def __init__(self, per_host: int = 4, max_hosts: int = None):
+        self.per_host = per_host
+        self.max_hosts = max_hosts
+        self.__session = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.__sent = 0
+        self.__failed = 0
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Sockets can't be shared with a forked child, so every process
+        builds its own session the first time it needs one.
+        """
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__session = self.__build_session()
+                    self.__sent = 0
+                    self.__failed = 0
+                    self.__pid = os.getpid()
+        return self.__session
+
+    def __build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.max_hosts or self.UNCAPPED_HOSTS,
+            pool_maxsize=self.per_host,
+            pool_block=True,
+            max_retries=0,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        session = self.session
+        self.__sent += 1
+        try:
+            return session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.__failed += 1
+            raise
+
+    def prewarm(self, urls, timeout: float = 1.0, method="GET") -> dict:
+        """
+        Request every url once, all at the same time, so a connection to
+        each host is already open when it's needed. Use a cheap url, or
+        method="OPTIONS" so the server doesn't run the view at all.
+        Returns {url: True/False} for whether the host answered.
+        """
+        urls = list(urls)
+        if not urls:
+            return {}
+
+        def warm(url):
+            try:
+                self.request(method, url, timeout=timeout)
+                return True
+            except requests.exceptions.RequestException:
+                return False
+
+        workers = min(len(urls), self.PREWARM_THREADS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(urls, executor.map(warm, urls)))
+
+    def stats(self) -> dict:
+        """
+        How the pool is being used by this process.
+        """
+        stats = {}
+        stats["requests_sent"] = self.__sent
+        stats["requests_failed"] = self.__failed
+        stats["hosts"] = {}
+        adapter = self.session.get_adapter("http://")
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            connections = list(pool.pool.queue) if pool.pool else []
+            host = {}
+            host["connections_opened"] = pool.num_connections
+            host["requests"] = pool.num_requests
+            host["idle"] = sum(1 for conn in connections if conn is not None)
+            host["max"] = self.per_host
+            stats["hosts"][f"{pool.host}:{pool.port}"] = host
+        return stats
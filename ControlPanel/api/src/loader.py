@@ -0,0 +1,185 @@
+###############################################################################
+# Description: Loads the room in the background until every pi is READY
+# Version: 0.1
+###############################################################################
+
+import threading
+import time
+
+from src.enums import LoadingStatus, RoomStatus
+from src.event_log import EventTypes, event_log
+from src.redis_keys import RedisKeys, RoomKeys
+
+
+class RoomLoader:
+    """
+    Gets the room from BOOTING to READY without holding up any worker.
+
+    "start" returns right away, the loading runs on a background thread.
+    Every worker calls it, a redis lock lets exactly one of them load.
+
+    1. The warmups run (open connections, build cached payloads).
+    2. Every pi is asked for its status at the same time, and asked again
+       every POLL_INTERVAL until it says READY.
+    3. Every time a pi is READY the load percentage goes up, so it's the
+       share of pis that are really done, not a guess.
+
+    The room is READY as soon as the slowest pi is. Pis that aren't READY
+    by LOAD_DEADLINE put the room in ERROR.
+
+    Only the worker holding the lock logs, one line per REPORT_INTERVAL at
+    most and only when something changed, an offline pi isn't logged on
+    every poll.
+
+    Public Methods:
+    -start: Load the room in the background, if it needs loading.
+    """
+
+    READY = "READY"  # The status a pi reports when it's ready
+    STATUS_TIMEOUT = 2  # Seconds a pi gets to answer one status request
+    POLL_INTERVAL = 1  # Seconds between status requests to one pi
+    LOAD_DEADLINE = 120  # Seconds the whole room gets to be READY
+    REPORT_INTERVAL = 1  # Fewest seconds between two progress lines
+
+    def __init__(self, pi_node_controller, warmups=None,
+                 set_room_status=None, keys: RoomKeys = None, log=None):
+        self.r = RedisKeys.REDIS.value
+        self.pi_node_controller = pi_node_controller
+        self.warmups = warmups or []
+        self.keys = keys or RoomKeys()
+        self.log = log or event_log
+        self.set_room_status = set_room_status or (
+            lambda status: self.keys.set(RedisKeys.API_ROOM_STATUS, status))
+        self.__ready = 0
+        self.__lock = threading.Lock()
+
+    def start(self) -> None:
+        """
+        Start loading on a background thread, unless the room is already
+        loaded (or being loaded).
+        """
+        thread = threading.Thread(target=self.__run, daemon=True)
+        thread.start()
+        return
+
+    def __run(self):
+        if self.keys.get(RedisKeys.API_ROOM_STATUS) != RoomStatus.BOOTING:
+            return
+        lock = self.r.lock(self.keys.key(RedisKeys.API_LOADER),
+                           timeout=self.LOAD_DEADLINE + 30)
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            # Another worker may have finished while this one waited.
+            if self.keys.get(RedisKeys.API_ROOM_STATUS) == RoomStatus.BOOTING:
+                self.load()
+        except Exception as e:
+            # Never leave the room stuck on LOADING.
+            print(f"Loading Room failed: {e}")
+            self.set_room_status(RoomStatus.ERROR)
+            self.keys.set(RedisKeys.API_LOADING_STATUS, LoadingStatus.IDLE)
+        finally:
+            lock.release()
+
+    def load(self) -> bool:
+        """
+        Load the room, returns True if every pi is READY.
+        """
+        started = time.monotonic()
+        print("Loading Room...")
+        self.keys.set(RedisKeys.API_LOADING_STATUS, LoadingStatus.ACTIVE)
+        self.keys.set(RedisKeys.API_LOAD_PERCENTAGE, 0)
+        self.set_room_status(RoomStatus.LOADING)
+
+        for warmup in self.warmups:
+            try:
+                warmup()
+            except Exception as e:
+                print(f"Warmup {warmup.__name__} failed: {e}")
+
+        pis = [self.pi_node_controller.find_by_name(name)
+               for name in self.pi_node_controller.names]
+        self.__ready = 0
+        self.__report(len(pis))
+        print(f"Loading Room... 0% (0/{len(pis)} READY)")
+        stop_at = started + self.LOAD_DEADLINE
+        # Daemon threads, not a pool, so a worker that's shutting down
+        # never waits on a pi that isn't there.
+        ready = [False] * len(pis)
+        threads = []
+        for i, pi in enumerate(pis):
+            thread = threading.Thread(
+                target=self.__wait_for,
+                args=(pi, len(pis), stop_at, ready, i), daemon=True)
+            thread.start()
+            threads.append(thread)
+        summary = None
+        while True:
+            report_at = time.monotonic() + self.REPORT_INTERVAL
+            for thread in threads:
+                thread.join(max(0, report_at - time.monotonic()))
+            if not any(thread.is_alive() for thread in threads):
+                break
+            summary = self.__summarize(pis, ready, summary)
+        not_ready = [pi.name for pi, done in zip(pis, ready) if not done]
+
+        took = time.monotonic() - started
+        if not_ready:
+            print(f"Room failed to load in {took:.1f}s, not READY: "
+                  f"{', '.join(not_ready)}")
+            self.set_room_status(RoomStatus.ERROR)
+        else:
+            print(f"Room loaded in {took:.1f}s")
+            self.set_room_status(RoomStatus.READY)
+        self.keys.set(RedisKeys.API_LOADING_STATUS, LoadingStatus.IDLE)
+        return not not_ready
+
+    def __wait_for(self, pi, total, stop_at, ready, i) -> None:
+        """
+        Ask one pi for its status until it's READY or time runs out.
+        Sets ready[i] to True if it's READY.
+        """
+        while True:
+            status_was = pi.status
+            pi.get_status(self.STATUS_TIMEOUT, quiet=True)
+            if pi.status != status_was:
+                self.log.record(EventTypes.NODE_STATUS, {
+                    "name": pi.name,
+                    "status": pi.status,
+                    "status_was": status_was,
+                })
+            if pi.status == self.READY:
+                with self.__lock:
+                    self.__ready += 1
+                    self.__report(total)
+                ready[i] = True
+                return
+            wait = min(self.POLL_INTERVAL, stop_at - time.monotonic())
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def __report(self, total):
+        percent = 100
+        if total:
+            percent = self.__ready * 100 // total
+        self.keys.set(RedisKeys.API_LOAD_PERCENTAGE, percent)
+        return
+
+    def __summarize(self, pis, ready, last) -> str:
+        """
+        Print how far along the room is if it changed since "last".
+        Returns the line.
+        """
+        done = sum(ready)
+        unreachable = [pi.name for pi, is_ready in zip(pis, ready)
+                       if not is_ready and not pi.reachable]
+        percent = done * 100 // len(pis) if pis else 100
+        summary = f"Loading Room... {percent}% ({done}/{len(pis)} READY)"
+        if unreachable:
+            summary += f", unreachable: {', '.join(unreachable[:5])}"
+            if len(unreachable) > 5:
+                summary += f" and {len(unreachable) - 5} more"
+        if summary != last:
+            print(summary)
+        return summary
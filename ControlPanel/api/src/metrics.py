@@ -0,0 +1,283 @@
+###############################################################################
+# Description: Counters and latency histograms for "/metrics", every process
+# Version: 0.1
+###############################################################################
+
+import atexit
+import bisect
+import os
+import threading
+import time
+
+from src.redis_keys import RedisKeys
+
+
+class MetricTypes:
+    COUNTER = "counter"
+    GAUGE = "gauge"
+    HISTOGRAM = "histogram"
+
+
+# Seconds, from a redis round trip on localhost to a pi that's timing out.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric the API exports, name: (type, help).
+METRICS = {
+    "escapewright_http_request_seconds": (
+        MetricTypes.HISTOGRAM, "Time to answer a request, by route."),
+    "escapewright_http_responses_total": (
+        MetricTypes.COUNTER, "Responses sent, by route and status."),
+    "escapewright_redis_roundtrip_seconds": (
+        MetricTypes.HISTOGRAM, "Time for a PING to redis and back."),
+    "escapewright_pi_request_seconds": (
+        MetricTypes.HISTOGRAM, "Time for a pi to answer, by kind."),
+    "escapewright_pi_request_errors_total": (
+        MetricTypes.COUNTER, "Requests to a pi that failed, by kind."),
+    "escapewright_node_cache_lookups_total": (
+        MetricTypes.COUNTER, "PiNode cache lookups, by hit or miss."),
+    "escapewright_event_log_dropped_total": (
+        MetricTypes.COUNTER, "Events dropped because the writer was full."),
+    "escapewright_relay_queue_depth": (
+        MetricTypes.GAUGE, "Relays waiting to be sent, by pi."),
+    "escapewright_relay_dead_letters": (
+        MetricTypes.GAUGE, "Relays that ran out of attempts."),
+    "escapewright_event_log_length": (
+        MetricTypes.GAUGE, "Events kept in the room's event stream."),
+    "escapewright_static_cache_hits_total": (
+        MetricTypes.COUNTER, "Static payloads served from the cache."),
+    "escapewright_static_cache_misses_total": (
+        MetricTypes.COUNTER, "Static payloads that had to be rebuilt."),
+    "escapewright_static_cache_hit_ratio": (
+        MetricTypes.GAUGE, "Share of static payloads served from the cache."),
+}
+
+
+def room_label(room_id: str) -> str:
+    """
+    The "room" label of a room, the default room has no id.
+    """
+    return room_id if room_id else "default"
+
+
+def format_labels(labels: dict) -> str:
+    """
+    '{a="1",b="2"}' in the order given, "" for no labels.
+    """
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\")
+        value = value.replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metrics:
+    """
+    Counts and times things in every process (workers, the dispatcher) and
+    adds them up in one redis hash, so "/metrics" shows the whole API no
+    matter which worker answers.
+
+    "inc" and "observe" only touch a dict in memory. A thread in each
+    process adds what changed to redis every FLUSH_INTERVAL, one pipelined
+    round trip no matter how many requests there were, and times a PING
+    while it's there. That's cheap enough to leave on.
+
+    Histograms are kept the way Prometheus wants them: a count per bucket
+    ("le", cumulative), a sum and a count.
+
+    Gauges (queue depths, cache ratios) aren't counted here, they're read
+    from redis when "/metrics" is asked for, see "render".
+
+    Public Methods:
+    -inc: Add to a counter.
+    -observe: Add a value (seconds) to a histogram.
+    -time: Time a block of code into a histogram.
+    -flush: Add this process's counts to redis now.
+    -render: Every metric in the Prometheus text format.
+    -reset: Forget every metric, in redis too.
+    """
+
+    FLUSH_INTERVAL = 5  # Seconds between flushes of one process
+
+    def __init__(self, redis_key=RedisKeys.API_METRICS):
+        self.r = RedisKeys.REDIS.value
+        self.redis_key = str(redis_key)
+        self.__counters = {}  # (name, labels): count
+        self.__histograms = {}  # (name, labels): [bucket counts, sum]
+        self.__pid = None
+        self.__lock = threading.Lock()
+        self.__flush_lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def inc(self, name: str, labels: dict = None, amount: int = 1) -> None:
+        self.__ensure_running()
+        series = (name, format_labels(labels))
+        with self.__lock:
+            self.__counters[series] = self.__counters.get(series, 0) + amount
+        return
+
+    def observe(self, name: str, seconds: float, labels: dict = None) -> None:
+        self.__ensure_running()
+        series = (name, format_labels(labels))
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.__lock:
+            histogram = self.__histograms.get(series)
+            if histogram is None:
+                histogram = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+                self.__histograms[series] = histogram
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+        return
+
+    def time(self, name: str, labels: dict = None) -> "_Timing":
+        """
+        with metrics.time("escapewright_..._seconds", {...}):
+        """
+        return _Timing(self, name, labels)
+
+    def flush(self) -> None:
+        """
+        Add everything counted since the last flush to redis.
+        """
+        if self.__pid != os.getpid():
+            return
+        with self.__lock:
+            counters, self.__counters = self.__counters, {}
+            histograms, self.__histograms = self.__histograms, {}
+        if not counters and not histograms:
+            return
+
+        with self.__flush_lock:
+            pipe = self.r.pipeline(transaction=False)
+            for (name, labels), count in counters.items():
+                pipe.hincrby(self.redis_key, f"{name}{labels}", count)
+            for (name, labels), (buckets, total) in histograms.items():
+                for field, count in self.__histogram_fields(
+                        name, labels, buckets):
+                    pipe.hincrby(self.redis_key, field, count)
+                pipe.hincrbyfloat(self.redis_key, f"{name}_sum{labels}",
+                                  total)
+            pipe.execute()
+        return
+
+    def render(self, gauges: list = None) -> str:
+        """
+        Every metric, with its HELP and TYPE, as "/metrics" returns it.
+        "gauges" is a list of (name, labels, value) read right now.
+        """
+        self.flush()
+        samples = {}  # family: [(sample name, labels, value)]
+        families = {}
+        for name, (kind, _help) in METRICS.items():
+            samples[name] = []
+            families[name] = name
+            if kind == MetricTypes.HISTOGRAM:
+                for suffix in ("_bucket", "_sum", "_count"):
+                    families[name + suffix] = name
+
+        for field, value in self.r.hgetall(self.redis_key).items():
+            field = field.decode("utf-8")
+            sample, _, labels = field.partition("{")
+            family = families.get(sample)
+            if family is None:
+                continue
+            labels = "{" + labels if labels else ""
+            samples[family].append((sample, labels, value.decode("utf-8")))
+        for name, labels, value in gauges or []:
+            if name in samples:
+                samples[name].append((name, format_labels(labels), value))
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            if not samples[name]:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in sorted(samples[name],
+                                                key=_sample_order):
+                lines.append(f"{sample}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__counters = {}
+            self.__histograms = {}
+        self.r.delete(self.redis_key)
+        return
+
+    def __histogram_fields(self, name, labels, buckets):
+        """
+        The cumulative "le" buckets and the count, as hash fields. Every
+        bucket is there, even at 0, so every series has the same buckets.
+        """
+        inner = labels[1:-1] + "," if labels else ""
+        cumulative = 0
+        for i, count in enumerate(buckets):
+            cumulative += count
+            le = "+Inf" if i == len(LATENCY_BUCKETS) else LATENCY_BUCKETS[i]
+            yield f'{name}_bucket{{{inner}le="{le}"}}', cumulative
+        yield f"{name}_count{labels}", cumulative
+
+    def __ensure_running(self):
+        """
+        Threads don't survive a fork, and neither should the counts the
+        master made before it, so every process starts fresh.
+        """
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__counters = {}
+            self.__histograms = {}
+            thread = threading.Thread(target=self.__flusher, daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+        return
+
+    def __flusher(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                with self.time("escapewright_redis_roundtrip_seconds"):
+                    self.r.ping()
+                self.flush()
+            except Exception as e:
+                print(f"Metrics lost redis: {e}")
+
+
+class _Timing:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started,
+                             self.labels)
+        return False
+
+
+def _sample_order(sample):
+    """
+    Series together, buckets in "le" order, then the sum and the count.
+    """
+    name, labels, _value = sample
+    series, _, le = labels.partition('le="')
+    bucket = float(le[:-2]) if le else 0.0
+    suffix = 0
+    if name.endswith("_sum"):
+        suffix = 1
+    elif name.endswith("_count"):
+        suffix = 2
+    return series.strip("{},"), suffix, bucket
+
+
+metrics = Metrics()
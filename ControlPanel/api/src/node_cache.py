@@ -0,0 +1,182 @@
+###############################################################################
+# Description: Worker-local cache of PiNode state, invalidated over pub/sub
+# Version: 0.1
+###############################################################################
+
+import json
+import os
+import threading
+import time
+
+from src.metrics import metrics
+from src.redis_keys import RedisKeys
+
+
+def notify(r, key: str, fields: dict) -> None:
+    """
+    Tell every worker a PiNode hash changed. "r" can be a pipeline, so the
+    notification goes out in the same round trip as the write.
+    """
+    message = {"key": key, "fields": fields, "sent": time.time()}
+    r.publish(str(RedisKeys.PI_NODE_CHANGES), json.dumps(message))
+    return
+
+
+class NodeStateCache:
+    """
+    PiNode state is read far more often than it changes, so every worker
+    keeps its own copy of the PiNode hashes.
+
+    Every write to a PiNode publishes the changed fields (see "notify").
+    A subscriber thread in each worker patches the cached hash with them.
+
+    Staleness is bounded two ways:
+    - An entry is never trusted for more than MAX_AGE seconds, even if no
+      notification came (a message lost while the subscriber reconnected).
+    - While the subscriber is not connected the cache is skipped entirely.
+
+    Public Methods:
+    -get_many: The HGETALL of every key, from the cache where possible.
+    -invalidate: Drop one key, or every key.
+    -stats: Hits, misses and how long notifications take to arrive.
+    """
+
+    MAX_AGE = 2.0  # Seconds an entry can be served without a notification
+
+    def __init__(self):
+        self.r = RedisKeys.REDIS.value
+        self.channel = str(RedisKeys.PI_NODE_CHANGES)
+        self.__entries = {}  # key: (fetched_at, hash)
+        self.__versions = {}  # key: bumped on every change notification
+        self.__lock = threading.Lock()
+        self.__connected = False
+        self.__pid = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__lag_count = 0
+        self.__lag_total = 0.0
+        self.__lag_max = 0.0
+        self.__lag_last = 0.0
+
+    def get_many(self, keys) -> list:
+        """
+        Return the HGETALL of every key, in order. Everything that isn't
+        cached (or is too old) is read in one pipelined round trip.
+        """
+        self.__ensure_running()
+        now = time.monotonic()
+        results = [None] * len(keys)
+        missing = []
+        with self.__lock:
+            for i, key in enumerate(keys):
+                entry = self.__entries.get(key)
+                if self.__connected and entry and now - entry[0] < self.MAX_AGE:
+                    results[i] = entry[1]
+                else:
+                    missing.append(i)
+            versions = {keys[i]: self.__versions.get(keys[i], 0)
+                        for i in missing}
+        self.__hits += len(keys) - len(missing)
+        self.__misses += len(missing)
+        metrics.inc("escapewright_node_cache_lookups_total",
+                    {"result": "hit"}, len(keys) - len(missing))
+        metrics.inc("escapewright_node_cache_lookups_total",
+                    {"result": "miss"}, len(missing))
+        if not missing:
+            return results
+
+        pipe = self.r.pipeline(transaction=False)
+        for i in missing:
+            pipe.hgetall(keys[i])
+        values = pipe.execute()
+
+        with self.__lock:
+            for i, value in zip(missing, values):
+                key = keys[i]
+                results[i] = value
+                # A notification that arrived during the read wins.
+                if value and self.__versions.get(key, 0) == versions[key]:
+                    self.__entries[key] = (now, value)
+        return results
+
+    def invalidate(self, key=None) -> None:
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+        return
+
+    def stats(self) -> dict:
+        stats = {}
+        stats["connected"] = self.__connected
+        stats["entries"] = len(self.__entries)
+        stats["hits"] = self.__hits
+        stats["misses"] = self.__misses
+        stats["max_age_secs"] = self.MAX_AGE
+        stats["invalidations"] = self.__lag_count
+        stats["lag_last_ms"] = self.__lag_last * 1000
+        stats["lag_max_ms"] = self.__lag_max * 1000
+        stats["lag_avg_ms"] = 0.0
+        if self.__lag_count:
+            stats["lag_avg_ms"] = self.__lag_total / self.__lag_count * 1000
+        return stats
+
+    def __apply(self, message):
+        """
+        Patch the cached hash with the fields that changed.
+        """
+        data = json.loads(message["data"])
+        lag = max(0.0, time.time() - data["sent"])
+        key = data["key"]
+        fields = {k.encode("utf-8"): str(v).encode("utf-8")
+                  for k, v in data.get("fields", {}).items()}
+        with self.__lock:
+            self.__versions[key] = self.__versions.get(key, 0) + 1
+            entry = self.__entries.get(key)
+            if entry is not None and fields:
+                patched = dict(entry[1])
+                patched.update(fields)
+                self.__entries[key] = (entry[0], patched)
+            else:
+                self.__entries.pop(key, None)
+            self.__lag_count += 1
+            self.__lag_total += lag
+            self.__lag_last = lag
+            self.__lag_max = max(self.__lag_max, lag)
+        return
+
+    def __ensure_running(self):
+        """
+        Start the subscriber the first time the cache is used in this
+        process. Threads don't survive a fork, so this checks the pid.
+        """
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__entries = {}
+            self.__connected = False
+            thread = threading.Thread(target=self.__listen, daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+        return
+
+    def __listen(self):
+        while True:
+            pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # Anything cached before now may have missed a notification.
+                self.invalidate()
+                self.__connected = True
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.__apply(message)
+            except Exception as e:
+                print(f"PiNode cache lost redis: {e}")
+            finally:
+                self.__connected = False
+                pubsub.close()
+            time.sleep(1)
@@ -13,11 +13,44 @@
 
 import datetime
 import ipaddress
-import subprocess
 import time
 
-import redis
 import requests
+from src.event_log import EventLog, EventTypes
+from src.config_snapshot import diff_pi_nodes
+from src.fan_out import FanOut
+from src.http_pool import HttpPool
+from src.metrics import metrics, room_label
+from src.node_cache import NodeStateCache, notify
+from src.reachability import ReachabilityProber
+from src.redis_keys import RedisKeys, RoomKeys
+from src.redis_pool import get_redis
+from src.relay_queue import RelayQueue
+from src.routing import TriggerRouter
+
+
+fan_out = FanOut()
+http_pool = HttpPool(per_host=4)
+prober = ReachabilityProber(port=12413)
+node_cache = NodeStateCache()
+
+# Moves "status" to "status_was" and sets the new status in one round trip,
+# then tells every worker's cache (see "node_cache.py").
+# KEYS[1] = PiNode hash
+# ARGV = status, status_time, reachable ("" = keep), channel, sent
+save_status_script = get_redis().register_script("""
+local status_was = redis.call('HGET', KEYS[1], 'status') or 'OFFLINE'
+local fields = {status=ARGV[1], status_was=status_was, status_time=ARGV[2]}
+redis.call('HSET', KEYS[1], 'status', ARGV[1], 'status_was', status_was,
+           'status_time', ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[1], 'reachable', ARGV[3])
+    fields['reachable'] = ARGV[3]
+end
+redis.call('PUBLISH', ARGV[4], cjson.encode(
+    {key=KEYS[1], fields=fields, sent=tonumber(ARGV[5])}))
+return status_was
+""")
 
 
 class PiNode:
@@ -49,9 +82,17 @@ class PiNode:
     -to_dict: Returns the information of the pi in a dictionary.
     """
 
-    def __init__(self, name, ip_address, location=None, force_update=False):
-        self.redis_key = f"PiNode:{name}"
-        self.r = redis.Redis(host="localhost", port=6379, db=0)
+    def __init__(self, name, ip_address, location=None, force_update=False,
+                 sync=True, keys: RoomKeys = None):
+        """
+        sync=False skips redis entirely, the caller is expected to load or
+        save the node in bulk with a PiNodeRegistry.
+        "keys" is the room the pi belongs to, the default room if None.
+        """
+        keys = keys or RoomKeys()
+        self.redis_key = keys.key(f"PiNode:{name}")
+        self.__labels = {"room": room_label(keys.room_id), "pi": name}
+        self.r = get_redis()
         self.__name = name
         self.__ip = self.__validate_ip(ip_address)
         self.__location = location
@@ -60,70 +101,98 @@ class PiNode:
         self.__status_time = time.time()
         self.__reachable = False
 
+        if not sync:
+            return
         if force_update:
             self.force_save_to_redis()
         else:
             self.__init_to_redis()
 
     def __str__(self):
-        redis_format = f"{self.name}:{self.ip}:{self.location}"
-        redis_format += f":{self.status}:{self.status_was}:{self.status_time}"
-        redis_format += f":{self.reachable}"
-        return redis_format
+        return " | ".join(f"{k}={v}" for k, v in self.to_redis_hash().items())
+
+    def to_redis_hash(self) -> dict:
+        """
+        The fields of the PiNode as they are stored in its redis hash.
+        """
+        fields = {}
+        fields["name"] = self.name
+        fields["ip"] = self.ip
+        fields["location"] = self.location or ""
+        fields["status"] = self.status
+        fields["status_was"] = self.status_was
+        fields["status_time"] = int(self.status_time)
+        fields["reachable"] = str(self.reachable)
+        return fields
 
     def __init_to_redis(self):
         """
         Initialize the PiNode to redis.
         If the key already exists, load the data.
         """
-        data = self.r.get(self.redis_key)
-
-        if data is None:
+        if not self.__load_from_redis():
             self.__save_to_redis()
-            return
-        else:
-            self.__load_from_redis()
         return
 
     def __save_to_redis(self):
         """
-        Save the timer data to the redis key
+        Save every field of the PiNode to its redis hash.
         """
-        try:
-            self.r.set(self.redis_key, self.__str__())
-        except Exception as e:
-            print(f"Error saving to redis: {str(e)}")
-            return False
-        return True
+        return self.__save_fields(**self.to_redis_hash())
 
     def force_save_to_redis(self):
         """
-        Save the timer data to the redis key
+        Save every field of the PiNode to its redis hash.
+        """
+        return self.__save_to_redis()
+
+    def __save_fields(self, **fields):
+        """
+        Save only the given fields, the rest of the hash is left alone.
+        Every worker's cache is told in the same round trip.
         """
         try:
-            self.r.set(self.redis_key, self.__str__())
+            pipe = self.r.pipeline(transaction=False)
+            pipe.hset(self.redis_key, mapping=fields)
+            notify(pipe, self.redis_key, fields)
+            pipe.execute()
         except Exception as e:
             print(f"Error saving to redis: {str(e)}")
             return False
+        return True
 
     def __load_from_redis(self):
         """
         Load the PiNode from redis.
         """
-        data = self.r.get(self.redis_key)
+        data = self.r.hgetall(self.redis_key)
+        return self.__load_from_data(data)
 
-        if data is None:
+    def __load_from_data(self, data):
+        """
+        Load the PiNode from data already read from redis.
+        """
+        if not data:
             # This should be redundant, but could protect in the case
             # of a redis reset.
             self.__save_to_redis()
             return False
+        return self.load_data(data)
+
+    def load_data(self, data) -> bool:
+        """
+        Load the PiNode from the HGETALL of its redis hash, read by someone
+        else (like a PiNodeRegistry). Returns False if there was no hash.
+        """
+        if not data:
+            return False
 
-        data = data.decode("utf-8").split(":")
-        self.__location = data[2]
-        self.__status = data[3]
-        self.__status_was = data[4]
-        self.__status_time = int(float(data[5]))
-        self.__reachable = self.string_to_bool(data[6])
+        data = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
+        self.__location = data.get("location", self.__location)
+        self.__status = data.get("status", self.__status)
+        self.__status_was = data.get("status_was", self.__status_was)
+        self.__status_time = int(float(data.get("status_time", 0)))
+        self.__reachable = self.string_to_bool(data.get("reachable", "False"))
         return True
 
     def string_to_bool(self, string: str) -> bool:
@@ -148,8 +217,10 @@ class PiNode:
     def address(self) -> str:
         """
         Returns the address of the pi. This is the IP address and the port
-        number.
+        number. IPv6 addresses are wrapped in brackets.
         """
+        if ":" in self.__ip:
+            return f"http://[{self.__ip}]:{self.port}"
         return f"http://{self.__ip}:{self.port}"
 
     @property
@@ -214,6 +285,25 @@ class PiNode:
         self.__status_time = time.time()
         return
 
+    def save_status(self, status, reachable=None) -> bool:
+        """
+        Updates the status of the pi and saves it to redis. Only the status
+        fields are touched, in a single round trip.
+        Returns True if the status is different from what it was.
+        """
+        status_time = int(time.time())
+        status_was = save_status_script(
+            keys=[self.redis_key],
+            args=[status, status_time,
+                  "" if reachable is None else str(reachable),
+                  str(RedisKeys.PI_NODE_CHANGES), time.time()])
+        self.__status_was = status_was.decode("utf-8")
+        self.__status = status
+        self.__status_time = status_time
+        if reachable is not None:
+            self.__reachable = reachable
+        return self.__status != self.__status_was
+
     def __validate_ip(self, ipid) -> str:
         """
         Check if the ip address is valid. If it is, return the ip address.
@@ -227,95 +317,113 @@ class PiNode:
             print(f"Invalid IP address: {ipid}")
             exit(1)
 
-    def clear_status(self) -> None:
+    def clear_status(self, save=True) -> None:
         """
         This clears the current status of the pi. This is useful when
-        resetting a room.
+        resetting a room. save=False only clears it in memory, for when
+        a PiNodeRegistry saves many pis at once.
         """
-        self.__load_from_redis()
         self.__status = "OFFLINE"
         self.__status_was = "OFFLINE"
         self.__status_time = int(time.time())
         self.__reachable = False
-        self.__save_to_redis()
+        if save:
+            self.__save_fields(
+                status=self.__status,
+                status_was=self.__status_was,
+                status_time=self.__status_time,
+                reachable=str(self.__reachable),
+            )
         return
 
     def reach(self) -> bool:
         """
-        This function pings the pi to see if it is reachable. This tests that
+        This function checks if the pi is on the network. This tests that
         that pi is simply on the network, not if it's running all the code
-        it needs to run.
+        it needs to run. See "reachability.py", no ping process is forked.
 
         ***This should only be ran if get_status fails.***
 
         This WILL NOT catch if the pi has failed without being cleared first,
         or if the "get_status" fails then the "reachable" will be set to False.
         """
-        self.__load_from_redis()
-        try:
-            response = subprocess.run(
-                ["ping", "-c", "1", self.__ip],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-            if response.returncode == 0:
-                self.__reachable = True
-            else:
-                self.__reachable = False
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            self.__reachable = False
-        self.__save_to_redis()
+        reachable = prober.probe([self.__ip])[self.__ip]
+        return self.set_reachable(reachable)
+
+    def set_reachable(self, reachable, save=True) -> bool:
+        """
+        Set the result of a reachability check, and save it to redis.
+        save=False only sets it in memory, see PiNodeRegistry.
+        """
+        self.__reachable = reachable
+        if save:
+            self.__save_fields(reachable=str(reachable))
         return self.__reachable
 
-    def get_status(self) -> bool:
+    def get_status(self, timeout=10, quiet=False) -> bool:
         """
         This function gets the status of a pi. It returns the "reachable"
         value, not the status of the pi. This is meant to be used to update
         the statuses, and give a boolean to the function checking the statuses.
 
         The actual status needs to be pulled from the status variable.
+        "quiet" leaves logging a failure to the caller, for callers that poll.
         """
-        self.__load_from_redis()
-        self.__status_was = self.__status.copy()
+        labels = {**self.__labels, "kind": "status"}
         try:
-            response = requests.get(self.address + "/status", timeout=10)
+            url = self.address + "/status"
+            with metrics.time("escapewright_pi_request_seconds", labels):
+                response = http_pool.get(url, timeout=timeout)
             if response.status_code == 200:
                 last_word = response.text.split()[-1]
                 status = last_word.upper()
-                self.update_status(status)
-                self.__reachable = True
+                self.save_status(status, reachable=True)
+            else:
+                metrics.inc("escapewright_pi_request_errors_total", labels)
         except Exception as e:
-            print(f"An error occurred: {e}")
+            metrics.inc("escapewright_pi_request_errors_total", labels)
+            if not quiet:
+                print(f"An error occurred: {e}")
             self.__status = "ERROR"
             self.__reachable = False
-        self.__save_to_redis()
+            self.__save_fields(status=self.__status, reachable="False")
         return self.__reachable
 
-    def relay(self, message) -> bool:
+    def relay(self, message, timeout=5, idempotency_key=None) -> bool:
         """
         This sends a relay to the pi so it knows what is happening in the room.
         Each pi module decides if it's important or not, this is NOT a command
         this is purely sending a message.
+        A pi ignores a relay with an "idempotency_key" it has already seen.
         """
-        '''
+        url = f"{self.address}/relay/{requests.utils.quote(message)}"
+        headers = {}
+        if idempotency_key:
+            headers["Idempotency-Key"] = idempotency_key
+        labels = {**self.__labels, "kind": "relay"}
         try:
-            response = requests.get(self.address + "/relay/" + message, timeout=5)
+            with metrics.time("escapewright_pi_request_seconds", labels):
+                response = http_pool.post(url, timeout=timeout,
+                                          headers=headers)
             if response.status_code == 200:
                 return True
         except requests.exceptions.RequestException:
-            return False
-        '''
-        print(f"Relay not sent to {self.name} - {self.ip} - {message}")
-        print(f"This function is not implemented yet. Pis are not connected.")
+            pass
+        metrics.inc("escapewright_pi_request_errors_total", labels)
+        return False
 
-    def to_dict(self):
+    def to_dict(self, data=None):
         """
         This function returns the information of the pi in a dictionary.
         It includes "name", "ip", "location", and "status" as keys
         and the corresponding values as strings.
+
+        If "data" is given (the HGETALL of the redis hash, read by someone
+        else) it is used instead of reading redis again.
         """
-        self.__load_from_redis()
+        if data is None:
+            data = node_cache.get_many([self.redis_key])[0]
+        self.__load_from_data(data)
         info = {}
         info["type"] = "PiNode"
         info["name"] = self.__name
@@ -330,10 +438,39 @@ class PiNodeController:
     TODO: Add a description of the class
     """
 
-    def __init__(self, pi_nodes_data: dict, initial=False):
-        generator = PiNodeGenerator(pi_nodes_data, initial)
+    RELAY_TIMEOUT = 2  # Seconds a single pi gets to answer a relay
+    STATUS_TIMEOUT = 10  # Seconds a single pi gets to answer a status request
+    STATUS_DEADLINE = 12  # Seconds a whole status sweep gets to finish
+
+    def __init__(self, pi_nodes_data: dict, initial=False, room_info=None,
+                 keys: RoomKeys = None):
+        keys = keys or RoomKeys()
+        self.__keys = keys
+        self.__registry = PiNodeRegistry()
+        generator = PiNodeGenerator(pi_nodes_data, initial, self.__registry,
+                                    keys)
         self.__pi_nodes = generator.generate()
         self.__pi_nodes_dict = {pi.name: pi for pi in self.__pi_nodes}
+        self.__pi_nodes_data = pi_nodes_data
+        self.__router = TriggerRouter(pi_nodes_data, room_info)
+        self.__relay_queue = RelayQueue(keys)
+        self.__event_log = EventLog(keys.key(RedisKeys.API_STREAM_EVENTS))
+
+    @property
+    def names(self) -> list:
+        return [pi.name for pi in self.__pi_nodes]
+
+    @property
+    def router(self) -> TriggerRouter:
+        return self.__router
+
+    @property
+    def relay_queue(self) -> RelayQueue:
+        return self.__relay_queue
+
+    @property
+    def event_log(self) -> EventLog:
+        return self.__event_log
 
     @property
     def all_ready(self) -> bool:
@@ -349,24 +486,124 @@ class PiNodeController:
         Does not check if their servers are online
         Used for testing network and not for production.
         """
-        for pi in self.__pi_nodes:
-            pi.reach()
+        self.__reach(self.__pi_nodes)
+
+    def __reach(self, pis):
+        """
+        Check every pi in one pass, see "reachability.py".
+        """
+        reachable = prober.probe([pi.ip for pi in pis])
+        self.__registry.load(pis)
+        for pi in pis:
+            pi.set_reachable(reachable[pi.ip], save=False)
+        self.__registry.save(pis)
+        return
+
+    def prewarm_connections(self) -> dict:
+        """
+        Open a keep-alive connection to every pi, all at once.
+        Returns {address: answered}.
+        """
+        addresses = [pi.address + "/status" for pi in self.__pi_nodes]
+        warmed = http_pool.prewarm(addresses, timeout=self.RELAY_TIMEOUT)
+        answered = sum(1 for ok in warmed.values() if ok)
+        print(f"Prewarmed connections: {answered}/{len(warmed)} pis answered")
+        return warmed
+
+    def prepare_config(self, diff, pi_nodes_data) -> None:
+        """
+        Fix the redis side of the pis before a new config is stored (see
+        "config_snapshot.py"), once, by whoever stores it: moved pis get
+        their new ip and location, removed pis lose their queued relays.
+        A removed pi's hash is kept, like it is when a pi is taken out of
+        the config between boots.
+        """
+        moved = [pi for pi in pi_nodes_data if pi["name"] in diff["moved"]]
+        pipe = self.__registry.r.pipeline(transaction=False)
+        for pi in moved:
+            redis_key = self.__keys.key(f"PiNode:{pi['name']}")
+            fields = {"ip": pi["ip"], "location": pi["location"] or ""}
+            pipe.hset(redis_key, mapping=fields)
+            notify(pipe, redis_key, fields)
+        for name in diff["removed"]:
+            pipe.delete(self.__relay_queue.key(name))
+        pipe.execute()
+        return
+
+    def apply_config(self, pi_nodes_data, room_info=None) -> dict:
+        """
+        Change the pis to match a new config, without starting over. Pis
+        that were added or moved get a new PiNode, every other pi keeps
+        the one it has. The routes are built again. Returns the diff.
+        """
+        diff = diff_pi_nodes(self.__pi_nodes_data, pi_nodes_data)
+        rebuilt = diff["added"] + diff["moved"]
+        generator = PiNodeGenerator(
+            [pi for pi in pi_nodes_data if pi["name"] in rebuilt],
+            registry=self.__registry, keys=self.__keys)
+        built = {pi.name: pi for pi in generator.generate()}
+        pi_nodes = [built.get(pi["name"]) or self.__pi_nodes_dict[pi["name"]]
+                    for pi in pi_nodes_data]
+        router = TriggerRouter(pi_nodes_data, room_info)
+        # Requests keep running while this happens, they see the old pis or
+        # the new ones.
+        self.__pi_nodes_dict = {pi.name: pi for pi in pi_nodes}
+        self.__pi_nodes = pi_nodes
+        self.__pi_nodes_data = pi_nodes_data
+        self.__router = router
+        return diff
 
     def print_all(self):
         for pi in self.__pi_nodes:
             print(pi)
 
-    def get_statuses(self):
+    def get_statuses(self) -> dict:
+        """
+        Ask every pi for its status at the same time. The pis that didn't
+        answer are then pinged at the same time, to tell an offline pi from
+        a pi whose server is down. Takes about as long as the slowest pi.
+        Returns {name: NodeResult} of the status requests.
+        """
         start = datetime.datetime.now()
-        for pi in self.__pi_nodes:
-            if pi.get_status():
-                print(f"{pi.name: <11} | {pi.status}")
-            else:
-                print(f"Failed to get status of {pi.name}")
-                print(f"Reaching out to {pi.name} at {pi.ip}...")
-                pi.reach()
+        statuses_were = {pi.name: pi.status for pi in self.__pi_nodes}
+        results = fan_out.run(
+            self.__pi_nodes,
+            lambda pi, timeout: pi.get_status(timeout),
+            node_timeout=self.STATUS_TIMEOUT,
+            deadline=self.STATUS_DEADLINE,
+            retries=0,
+        )
+
+        failed = [pi for pi in self.__pi_nodes if not results[pi.name].ok]
+        for pi in failed:
+            print(f"Failed to get status of {pi.name}")
+            print(f"Reaching out to {pi.name} at {pi.ip}...")
+        if failed:
+            self.__reach(failed)
 
-        self.__log_deltatime(start, "Refresh Statuses")
+        for pi in self.__pi_nodes:
+            if pi.status != statuses_were[pi.name]:
+                self.__event_log.record(EventTypes.NODE_STATUS, {
+                    "name": pi.name,
+                    "status": pi.status,
+                    "status_was": statuses_were[pi.name],
+                })
+
+        self.__log_deltatime(start, "Refresh Statuses", results)
+        return results
+
+    def __log_deltatime(self, start, label, results=None):
+        """
+        Log how long "label" took since "start", and how long every pi
+        took if the results of a fan out are given.
+        """
+        delta = datetime.datetime.now() - start
+        print(f"{label} took {delta.total_seconds() * 1000:.0f}ms")
+        if results:
+            for pi in self.__pi_nodes:
+                if pi.name in results:
+                    print(f"  {results[pi.name]} | {pi.status}")
+        return
 
     def soft_reset(self, name):
         pi = self.find_by_name(name)
@@ -376,15 +613,29 @@ class PiNodeController:
         for pi in self.__pi_nodes:
             pi.soft_reset()
 
-    def get_serializable_pis(self):
+    @property
+    def redis_keys(self) -> list:
+        """
+        The redis keys of every pi, in the same order as the pis.
+        """
+        return [pi.redis_key for pi in self.__pi_nodes]
+
+    def get_serializable_pis(self, data=None):
         """
         Returns a list of dictionaries that contain the information of the
         Raspberry Pi Servers. This is used to send the information to the
         Control Console for Javascript to use.
+
+        "data" is an optional list of HGETALL results, one per pi, in the
+        same order as "redis_keys". See "snapshot.py".
         """
+        pi_nodes = self.__pi_nodes
+        if data is None or len(data) != len(pi_nodes):
+            # Read before a config change (see "apply_config").
+            data = [None] * len(pi_nodes)
         pi_dict = {}
-        for pi in self.__pi_nodes:
-            pi_dict[pi.name] = pi.to_dict()
+        for pi, pi_data in zip(pi_nodes, data):
+            pi_dict[pi.name] = pi.to_dict(pi_data)
         return pi_dict
 
     def find_by_name(self, name) -> PiNode:
@@ -394,28 +645,104 @@ class PiNodeController:
             print(f"This should never happen, but {name} was not found.")
             return None
 
-    def broadcast(self, message):
-        for pi in self.__pi_nodes:
-            pi.relay(message)
-        return
+    def broadcast(self, message) -> dict:
+        """
+        Queue a message for every pi node, see "relay_queue.py". The
+        dispatcher sends it, this returns right away.
+        Returns {name: relay id}.
+        """
+        return self.__enqueue(self.names, message, "Broadcast")
 
-    def relay(self, name, message):
+    def dispatch(self, message) -> dict:
         """
-        Relay a message to all the pi nodes.
+        Queue a message only for the pis that subscribed to it, see
+        "routing.py". Returns {name: relay id}.
         """
-        pi = self.find_by_name(name)
-        pi.relay(message)
-        return
+        return self.__enqueue(self.__router.route(message), message,
+                              "Dispatch")
+
+    def relay(self, name, message) -> bool:
+        """
+        Queue a message for a single pi node.
+        """
+        if self.find_by_name(name) is None:
+            return False
+        self.__enqueue([name], message, "Relay")
+        return True
+
+    def __enqueue(self, names, message, label) -> dict:
+        ids = self.__relay_queue.enqueue(names, message)
+        print(f"{label} {message}: queued for {len(ids)} pis")
+        return ids
 
     def clear_all_statuses(self):
+        """
+        Clear every pi and save them all in one round trip.
+        """
         for pi in self.__pi_nodes:
-            pi.clear_status()
+            pi.clear_status(save=False)
+        self.__registry.save(self.__pi_nodes)
 
-    def update_status(self, name, status):
+    def update_status(self, name, status) -> bool:
+        """
+        Save the status a pi reported, and log it if it changed.
+        """
         pi = self.find_by_name(name)
-        pi.update_status(status)
+        if pi is None:
+            return False
+        changed = pi.save_status(status)
+        if changed:
+            self.__event_log.record(EventTypes.NODE_STATUS, {
+                "name": pi.name,
+                "status": pi.status,
+                "status_was": pi.status_was,
+            })
+        return changed
+
+
+
+class PiNodeRegistry:
+    """
+    Loads and saves many PiNodes at once. Every call is a single pipelined
+    round trip to redis, no matter how many pis there are.
+
+    Public Methods:
+    -load: Load every pi from redis, returns the pis that weren't there.
+    -save: Save every pi to redis.
+    -load_or_init: Load every pi, and save the ones that weren't there.
+    """
+
+    def __init__(self, r=None):
+        self.r = r or get_redis()
+
+    def load(self, pis) -> list:
+        if not pis:
+            return []
+        pipe = self.r.pipeline(transaction=False)
+        for pi in pis:
+            pipe.hgetall(pi.redis_key)
+        values = pipe.execute()
+        missing = []
+        for pi, data in zip(pis, values):
+            if not pi.load_data(data):
+                missing.append(pi)
+        return missing
+
+    def save(self, pis) -> None:
+        if not pis:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for pi in pis:
+            fields = pi.to_redis_hash()
+            pipe.hset(pi.redis_key, mapping=fields)
+            notify(pipe, pi.redis_key, fields)
+        pipe.execute()
         return
 
+    def load_or_init(self, pis) -> None:
+        missing = self.load(pis)
+        self.save(missing)
+        return
 
 
 class PiNodeGenerator:
@@ -423,14 +750,18 @@ class PiNodeGenerator:
     Generates PiNodes from the YAML Config file.
     """
 
-    def __init__(self, pi_node_yaml_dict, do_force_update=False):
+    def __init__(self, pi_node_yaml_dict, do_force_update=False,
+                 registry=None, keys: RoomKeys = None):
         self.pi_dicts = pi_node_yaml_dict
         self.do_force_update = do_force_update
+        self.registry = registry or PiNodeRegistry()
+        self.keys = keys
         return
 
     def generate(self):
         """
         Parses the pi_list from the YAML and returns a list of PiNode objects.
+        All the pis are loaded from (or saved to) redis in bulk.
         """
         pi_nodes = []
 
@@ -438,6 +769,47 @@ class PiNodeGenerator:
             name = pi["name"]
             ip = pi["ip"]
             location = pi["location"]
-            pi_node = PiNode(name, ip, location, self.do_force_update)
+            pi_node = PiNode(name, ip, location, sync=False, keys=self.keys)
             pi_nodes.append(pi_node)
+
+        if self.do_force_update:
+            self.registry.save(pi_nodes)
+        else:
+            self.registry.load_or_init(pi_nodes)
         return pi_nodes
+
+
+def migrate_string_keys(r=None) -> int:
+    """
+    PiNodes used to be saved as one colon separated string,
+    "name:ip:location:status:status_was:status_time:reachable".
+    Turn every one of those into a hash. Safe to run on every boot, it does
+    nothing once every key is a hash. Returns how many keys were migrated.
+    """
+    r = r or get_redis()
+    migrated = 0
+    for key in r.scan_iter(match="PiNode:*", _type="string"):
+        data = r.get(key)
+        if data is None:
+            continue
+        parts = data.decode("utf-8").split(":")
+        if len(parts) < 7:
+            print(f"Skipping unreadable PiNode key: {key}")
+            continue
+        fields = {}
+        fields["name"] = parts[0]
+        fields["ip"] = parts[1]
+        # The location is the only field that could have had colons in it.
+        fields["location"] = ":".join(parts[2:-4])
+        fields["status"] = parts[-4]
+        fields["status_was"] = parts[-3]
+        fields["status_time"] = int(float(parts[-2]))
+        fields["reachable"] = parts[-1]
+        pipe = r.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=fields)
+        pipe.execute()
+        migrated += 1
+    if migrated:
+        print(f"Migrated {migrated} PiNode keys to hashes")
+    return migrated
@@ -0,0 +1,192 @@
+###############################################################################
+# Description: Samples the stacks of chosen requests, for finding slow spots
+# Version: 0.1
+###############################################################################
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from src.serving import WorkerModes
+
+PROFILE_HEADER = "X-Profile"  # "X-Profile: 1" profiles one request
+
+
+class RequestProfiler:
+    """
+    Finds out where a slow request spends its time (markdown, YAML, redis,
+    a pi) by looking at its stack every "interval_ms" while it runs. The
+    request itself does nothing extra, so it's slowed down by about what
+    the sampling thread costs, and only while a request is being profiled.
+
+    A request is profiled if it has the PROFILE_HEADER, or at random for
+    "sample_rate" of all requests. Every profiled request is saved as a
+    collapsed stack file ("frame;frame;frame count" per line, what
+    flamegraph.pl and speedscope read) in "directory". Only the newest
+    "kept" files are kept.
+
+    Stacks are sampled per thread, so profiling is off in gevent mode,
+    where every request shares one thread.
+
+    Public Properties:
+    -enabled: False in gevent mode.
+    -directory: Where the profiles are saved.
+
+    Public Methods:
+    -wanted: If the request should be profiled.
+    -start / stop: Profile the current thread, stop saves the profile.
+    -profiles: The newest saved profiles.
+    -collapsed: The stacks of many profiles added up.
+    """
+
+    INTERVAL_MS = 5  # Default milliseconds between samples
+    KEPT = 200  # Default profiles kept on disk
+    DIRECTORY = "/tmp/escapewright-profiles"  # Default place for profiles
+    SUFFIX = ".folded"
+
+    def __init__(self, settings: dict = None,
+                 worker_mode: str = WorkerModes.GTHREAD):
+        settings = settings or {}
+        self.enabled = worker_mode != WorkerModes.GEVENT
+        self.sample_rate = float(settings.get("sample_rate", 0.0))
+        self.allow_header = settings.get("allow_header", True)
+        self.interval = settings.get("interval_ms", self.INTERVAL_MS) / 1000
+        self.kept = settings.get("kept", self.KEPT)
+        self.directory = settings.get("directory", self.DIRECTORY)
+        self.__active = {}  # thread id: {stack: samples}
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__pid = None
+
+    def wanted(self, headers) -> bool:
+        if not self.enabled:
+            return False
+        if self.allow_header and headers.get(PROFILE_HEADER) == "1":
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> int:
+        """
+        Start sampling this thread, returns what "stop" needs.
+        """
+        self.__ensure_running()
+        thread_id = threading.get_ident()
+        with self.__lock:
+            self.__active[thread_id] = {"stacks": {},
+                                        "started": time.perf_counter()}
+        self.__wake.set()
+        return thread_id
+
+    def stop(self, thread_id: int, label: str) -> str:
+        """
+        Stop sampling and save the profile, returns its file name.
+        "label" (the route) goes in the file name.
+        """
+        with self.__lock:
+            profile = self.__active.pop(thread_id, None)
+        if profile is None:
+            return None
+        took_ms = (time.perf_counter() - profile["started"]) * 1000
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "_", label).strip("_") or "root"
+        file_name = (f"{time.time_ns() // 1000000}-{os.getpid()}-"
+                     f"{took_ms:.0f}ms-{slug}{self.SUFFIX}")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, file_name), "w") as f:
+                for stack, samples in profile["stacks"].items():
+                    f.write(f"{stack} {samples}\n")
+            self.__rotate()
+        except OSError as e:
+            print(f"Profile not saved: {e}")
+            return None
+        return file_name
+
+    def profiles(self, route: str = None, count: int = 50) -> list:
+        """
+        The newest saved profiles first, only the ones for "route" if given.
+        """
+        try:
+            names = sorted(os.listdir(self.directory), reverse=True)
+        except FileNotFoundError:
+            return []
+        names = [name for name in names if name.endswith(self.SUFFIX)]
+        if route:
+            slug = re.sub(r"[^A-Za-z0-9_-]+", "_", route).strip("_")
+            names = [name for name in names
+                     if name[:-len(self.SUFFIX)].split("-", 3)[3] == slug]
+        return names[:count]
+
+    def collapsed(self, names) -> str:
+        """
+        Add up the stacks of the profiles, the busiest stacks first.
+        """
+        stacks = {}
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name), "r") as f:
+                    for line in f:
+                        stack, _, samples = line.rstrip("\n").rpartition(" ")
+                        stacks[stack] = stacks.get(stack, 0) + int(samples)
+            except (OSError, ValueError):
+                continue
+        ordered = sorted(stacks.items(), key=lambda item: -item[1])
+        return "".join(f"{stack} {samples}\n" for stack, samples in ordered)
+
+    def __rotate(self):
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith(self.SUFFIX))
+        for name in names[:-self.kept]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass  # Another worker got it first
+
+    def __ensure_running(self):
+        """
+        Threads don't survive a fork, every worker starts its own sampler
+        the first time it profiles something.
+        """
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            self.__active = {}
+            thread = threading.Thread(target=self.__sampler, daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+        return
+
+    def __sampler(self):
+        while True:
+            if not self.__active:
+                self.__wake.wait()
+                self.__wake.clear()
+                continue
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.__lock:
+                for thread_id, profile in self.__active.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = collapse(frame)
+                    stacks = profile["stacks"]
+                    stacks[stack] = stacks.get(stack, 0) + 1
+
+
+def collapse(frame) -> str:
+    """
+    "file:function;file:function" from the outermost call to "frame".
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        names.append(f"{module}:{code.co_qualname}")
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names).replace(" ", "_")
@@ -0,0 +1,198 @@
+###############################################################################
+# Description: Checks if PiNodes are on the network, without forking ping
+# Version: 0.1
+###############################################################################
+
+import errno
+import ipaddress
+import selectors
+import socket
+import struct
+import threading
+import time
+
+# Errors from a TCP connect that still prove the host answered.
+HOST_ANSWERED = (0, errno.ECONNREFUSED)
+# Errors that prove the host is not there, no point in an ICMP echo.
+HOST_MISSING = (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN)
+
+
+class ReachabilityProber:
+    """
+    Checks if many hosts are on the network in a single pass, from inside
+    the worker. No processes are spawned.
+
+    1. A non-blocking TCP connect to every host at once. Connecting, or
+       being refused, both mean the host is on the network.
+    2. Hosts that didn't answer in time get an ICMP echo through an
+       unprivileged ICMP socket, if the kernel allows it
+       (net.ipv4.ping_group_range). If it doesn't they count as unreachable.
+
+    Results are cached for "ttl" seconds, so asking again right away is free.
+
+    Public Methods:
+    -probe: Returns {ip: reachable} for every ip.
+    -forget: Drops the cached results.
+    """
+
+    def __init__(self, port: int = 12413, timeout: float = 1.0,
+                 ttl: float = 5.0):
+        self.port = port
+        self.timeout = timeout
+        self.ttl = ttl
+        self.__cache = {}
+        self.__lock = threading.Lock()
+
+    def probe(self, ips) -> dict:
+        """
+        Return {ip: reachable}, only the hosts that aren't cached get probed.
+        """
+        now = time.monotonic()
+        results = {}
+        with self.__lock:
+            for ip in ips:
+                cached = self.__cache.get(ip)
+                if cached is not None and cached[0] > now:
+                    results[ip] = cached[1]
+
+        missing = [ip for ip in dict.fromkeys(ips) if ip not in results]
+        if not missing:
+            return results
+
+        probed, unanswered = self.__tcp_sweep(missing)
+        if unanswered:
+            probed.update(self.__icmp_sweep(unanswered))
+
+        expires = time.monotonic() + self.ttl
+        with self.__lock:
+            for ip, reachable in probed.items():
+                self.__cache[ip] = (expires, reachable)
+        results.update(probed)
+        return results
+
+    def forget(self) -> None:
+        with self.__lock:
+            self.__cache.clear()
+        return
+
+    def __tcp_sweep(self, ips):
+        """
+        Start a connect to every host, then wait for all of them at once.
+        Returns ({ip: reachable} for the hosts that answered, [the rest]).
+        """
+        results = {}
+        selector = selectors.DefaultSelector()
+        for ip in ips:
+            family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            code = sock.connect_ex((ip, self.port))
+            if code in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                selector.register(sock, selectors.EVENT_WRITE, ip)
+                continue
+            sock.close()
+            if code in HOST_ANSWERED:
+                results[ip] = True
+            elif code in HOST_MISSING:
+                results[ip] = False
+
+        stop_at = time.monotonic() + self.timeout
+        while selector.get_map():
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                sock = key.fileobj
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code in HOST_ANSWERED:
+                    results[key.data] = True
+                elif code in HOST_MISSING:
+                    results[key.data] = False
+                selector.unregister(sock)
+                sock.close()
+
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+        return results, [ip for ip in ips if ip not in results]
+
+    def __icmp_sweep(self, ips) -> dict:
+        """
+        Send one echo request to every host and wait for the replies.
+        Every host that doesn't reply is unreachable.
+        """
+        results = {ip: False for ip in ips}
+        by_family = {socket.AF_INET: [], socket.AF_INET6: []}
+        for ip in ips:
+            family = socket.AF_INET6 if ":" in ip else socket.AF_INET
+            by_family[family].append(ip)
+
+        sockets = {}
+        for family, family_ips in by_family.items():
+            if not family_ips:
+                continue
+            sock = self.__icmp_socket(family)
+            if sock is None:
+                continue
+            for seq, ip in enumerate(family_ips):
+                try:
+                    sock.sendto(self.__echo_request(family, seq), (ip, 0))
+                except OSError:
+                    continue
+            sockets[sock] = family
+
+        stop_at = time.monotonic() + self.timeout
+        selector = selectors.DefaultSelector()
+        for sock in sockets:
+            selector.register(sock, selectors.EVENT_READ)
+        waiting = set(ips)
+        while waiting and sockets:
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                try:
+                    _, address = key.fileobj.recvfrom(1024)
+                except OSError:
+                    continue
+                ip = str(ipaddress.ip_address(address[0].split("%")[0]))
+                if ip in waiting:
+                    results[ip] = True
+                    waiting.discard(ip)
+
+        selector.close()
+        for sock in sockets:
+            sock.close()
+        return results
+
+    def __icmp_socket(self, family):
+        protocol = socket.IPPROTO_ICMP
+        if family == socket.AF_INET6:
+            protocol = socket.IPPROTO_ICMPV6
+        try:
+            sock = socket.socket(family, socket.SOCK_DGRAM, protocol)
+        except OSError:
+            # Not allowed to ping without root on this machine.
+            return None
+        sock.setblocking(False)
+        return sock
+
+    def __echo_request(self, family, seq) -> bytes:
+        """
+        Build an ICMP echo request. The kernel fills in the identifier for
+        unprivileged ICMP sockets.
+        """
+        echo_type = 128 if family == socket.AF_INET6 else 8
+        header = struct.pack("!BBHHH", echo_type, 0, 0, 0, seq)
+        payload = b"escapewright"
+        checksum = self.__checksum(header + payload)
+        header = struct.pack("!BBHHH", echo_type, 0, checksum, 0, seq)
+        return header + payload
+
+    def __checksum(self, data: bytes) -> int:
+        if len(data) % 2:
+            data += b"\0"
+        total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+        total = (total >> 16) + (total & 0xFFFF)
+        total += total >> 16
+        return ~total & 0xFFFF
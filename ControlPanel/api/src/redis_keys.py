@@ -8,9 +8,10 @@
 #
 ###############################################################################
 
-import redis
 from enum import Enum
 
+from src.redis_pool import get_redis
+
 
 class RedisKeys(Enum):
     """
@@ -21,15 +22,32 @@ class RedisKeys(Enum):
     ***IMPORTANT***
     No keys here are responsible for setting themselves in redis.
     """
-    REDIS = redis.Redis(host="localhost", port=6379, db=0)
+    REDIS = get_redis()
     GUNICORN_PID = "GUNICORN_PID"
     API_WORKER_ID = "APIWorkerID"
     API_ROOM_STATUS = "APIRoomStatus"
     API_LOADING_STATUS = "APILoadingStatus"
     API_LOAD_PERCENTAGE = "APILoadPercentage"
+    API_LOADER = "APILoader"
     API_YAML_CONFIG = "APIYAMLConfig"
     API_ROOM_TIMER = "APIRoomTimer"
+    API_ROOM_STATE_VERSION = "APIRoomStateVersion"
+    API_ROOM_OUTBOX = "APIRoomOutbox"
+    API_ROOM_OUTBOX_LOCK = "APIRoomOutboxLock"
+    API_RELAY_WAKE = "APIRelayWake"
+    API_RELAY_WOKEN = "APIRelayWokenQueues"
+    API_RELAY_DEAD = "APIRelayDeadLetters"
+    API_RELAY_DISPATCHER = "APIRelayDispatcher"
     API_LAST_BOOT = "APILastBoot"
+    API_BOOT_TIMES = "APIBootTimes"
+    API_STATIC_PAYLOAD = "APIStaticPayload"
+    API_STATIC_CACHE_STATS = "APIStaticCacheStats"
+    API_STREAM_EVENTS = "APIStreamEvents"
+    API_METRICS = "APIMetrics"
+    API_CONFIG_SNAPSHOT = "APIConfigSnapshot"
+    API_CONFIG_VERSION = "APIConfigVersion"
+    API_CONFIG_WATCHER = "APIConfigWatcher"
+    PI_NODE_CHANGES = "PiNodeChanges"
 
     def __str__(self):
         return self.value
@@ -46,6 +64,17 @@ class RedisKeys(Enum):
         r.set(string, value)
         return
 
+    def swap(self, value) -> str:
+        """
+        Set the key and return the value it had before, in one round trip.
+        """
+        string = str(self)
+        r = RedisKeys.REDIS.value
+        value_was = r.set(string, value, get=True)
+        if value_was is None:
+            return None
+        return value_was.decode("utf-8")
+
     def get_then_increment(self):
         """
         This should only be used for the APIWorkerID, but can be used for any
@@ -68,3 +97,72 @@ class RedisKeys(Enum):
         finally:
             # Release the lock
             lock.release()
+
+
+class RoomKeys:
+    """
+    The redis keys of one room. The default room keeps the keys it had
+    before there was more than one room, every other room's keys start with
+    "Room:<room_id>:".
+
+    Only the keys in ROOM_SCOPED (and names like "PiNode:<name>") belong to
+    a room. The rest (the worker ids, the gunicorn pid, the relay
+    dispatcher) are shared by the whole API, and come back unchanged.
+
+    Public Properties:
+    -room_id: The id of the room, None for the default room.
+    -prefix: What every key of the room starts with.
+
+    Public Methods:
+    -key: The name of a key for this room.
+    -get / set / swap: Like RedisKeys, on this room's copy of the key.
+    """
+
+    ROOM_SCOPED = (
+        RedisKeys.API_ROOM_STATUS,
+        RedisKeys.API_LOADING_STATUS,
+        RedisKeys.API_LOAD_PERCENTAGE,
+        RedisKeys.API_LOADER,
+        RedisKeys.API_YAML_CONFIG,
+        RedisKeys.API_ROOM_TIMER,
+        RedisKeys.API_ROOM_STATE_VERSION,
+        RedisKeys.API_ROOM_OUTBOX,
+        RedisKeys.API_ROOM_OUTBOX_LOCK,
+        RedisKeys.API_RELAY_DEAD,
+        RedisKeys.API_STATIC_PAYLOAD,
+        RedisKeys.API_STATIC_CACHE_STATS,
+        RedisKeys.API_STREAM_EVENTS,
+        RedisKeys.API_CONFIG_SNAPSHOT,
+    )
+
+    def __init__(self, room_id: str = None):
+        self.room_id = room_id
+        self.prefix = f"Room:{room_id}:" if room_id else ""
+
+    def key(self, key) -> str:
+        """
+        "key" is a RedisKeys, or the name of a per room key like
+        "PiNode:<name>".
+        """
+        if isinstance(key, RedisKeys) and key not in self.ROOM_SCOPED:
+            return str(key)
+        return self.prefix + str(key)
+
+    def get(self, key) -> str:
+        value = RedisKeys.REDIS.value.get(self.key(key))
+        if value is None:
+            return None
+        return value.decode("utf-8")
+
+    def set(self, key, value) -> None:
+        RedisKeys.REDIS.value.set(self.key(key), value)
+        return
+
+    def swap(self, key, value) -> str:
+        """
+        Set the key and return the value it had before, in one round trip.
+        """
+        value_was = RedisKeys.REDIS.value.set(self.key(key), value, get=True)
+        if value_was is None:
+            return None
+        return value_was.decode("utf-8")
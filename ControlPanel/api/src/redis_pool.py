@@ -0,0 +1,68 @@
+###############################################################################
+# Description: One redis connection pool per process
+# Version: 0.1
+###############################################################################
+
+import os
+
+import redis
+from src.enums import ConfigKeys
+from src.serving import serving_settings
+from src.yaml_reader import open_yaml_as_dict
+
+DEFAULT_SETTINGS = {
+    "host": "localhost",
+    "port": 6379,
+    "db": 0,
+}
+
+
+def load_settings(config_file=ConfigKeys.CONFIG_YAML) -> dict:
+    """
+    Read the "redis" section of the config, anything missing falls back to
+    a local redis. The config is optional here, the pool is needed before
+    anything else knows where the config is.
+
+    "max_connections" defaults to what one worker can use at once in its
+    "worker_mode" (see serving_settings), a gevent worker holds far more
+    requests than a gthread one.
+    """
+    config = {}
+    if os.path.exists(config_file):
+        config = open_yaml_as_dict(config_file) or {}
+    needed = serving_settings(config.get("api"))["redis_connections"]
+    settings = dict(DEFAULT_SETTINGS)
+    settings["max_connections"] = needed
+    settings.update(config.get(ConfigKeys.REDIS) or {})
+    if settings["max_connections"] < needed:
+        print(f"Redis max_connections {settings['max_connections']} is "
+              f"under the {needed} a worker can use, requests will wait "
+              f"on the pool")
+    return settings
+
+
+def build_client(settings: dict) -> redis.Redis:
+    """
+    Every connection in the process comes out of one blocking pool. When
+    all of them are busy a caller waits for one instead of opening more.
+    redis-py throws the pool's sockets away after a fork, so every gunicorn
+    worker ends up with its own connections.
+    """
+    pool = redis.BlockingConnectionPool(
+        host=settings["host"],
+        port=settings["port"],
+        db=settings["db"],
+        max_connections=settings["max_connections"],
+        timeout=5,
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+client = build_client(load_settings())
+
+
+def get_redis() -> redis.Redis:
+    """
+    The redis client every module should use.
+    """
+    return client
@@ -0,0 +1,209 @@
+###############################################################################
+# Description: Durable, ordered, per pi queues of relays waiting to be sent
+# Version: 0.1
+###############################################################################
+
+import json
+import time
+import uuid
+
+from src.redis_keys import RedisKeys, RoomKeys
+
+# KEYS = dead letters, wake up, woken queues
+# ARGV = queue key prefix, then the name of every pi in the config
+# Moves every dead letter of a known pi back to the head of its queue,
+# oldest first, so each pi still gets its relays in the order they were
+# queued. Dead letters of pis no longer in the config stay where they are.
+# Returns how many were requeued.
+RETRY_DEAD_SCRIPT = """
+local known = {}
+for i = 2, #ARGV do
+    known[ARGV[i]] = true
+end
+
+local kept = {}
+local requeued = 0
+-- Newest first, so each LPUSH puts an older relay in front.
+for _, raw in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+    local relay = cjson.decode(raw)
+    if known[relay['name']] then
+        relay['error'] = nil
+        relay['died_at'] = nil
+        local queue = ARGV[1] .. relay['name']
+        redis.call('LPUSH', queue, cjson.encode(relay))
+        redis.call('SADD', KEYS[3], queue)
+        requeued = requeued + 1
+    else
+        table.insert(kept, raw)
+    end
+end
+
+redis.call('DEL', KEYS[1])
+for _, raw in ipairs(kept) do
+    redis.call('RPUSH', KEYS[1], raw)
+end
+if requeued > 0 then
+    redis.call('DEL', KEYS[2])
+    redis.call('RPUSH', KEYS[2], 1)
+end
+return requeued
+"""
+
+
+class RelayQueue:
+    """
+    Every pi has its own redis list of relays waiting to be sent. Request
+    threads only push onto the lists, one pipelined round trip, and return.
+    The dispatcher (see "dispatcher.py") is the only thing that sends.
+
+    Each relay gets an id when it's queued. It's sent as the
+    "Idempotency-Key", so a pi never acts on the same relay twice, even if
+    the dispatcher has to send it again.
+
+    Relays stay at the head of their list until the pi takes them, so a pi
+    always gets its relays in the order they were queued. Relays that ran
+    out of attempts go to a dead letter list to be looked at (and retried).
+
+    Every room has its own queues and dead letters under its own keys (see
+    "RoomKeys"). The wake up is shared, one dispatcher serves every room.
+    It names the queues that changed, so the dispatcher only looks at
+    those instead of every pi of every room.
+
+    Public Methods:
+    -enqueue: Queue a message for some pis.
+    -heads: The relay each pi should get next, in one round trip.
+    -done: Take a delivered relay off a pi's queue.
+    -kill: Move a relay that ran out of attempts to the dead letters.
+    -dead_letters / retry_dead: Look at, and requeue, dead letters.
+    -wake: Tell the dispatcher to look at some queues.
+    -wait: Block until a queue needs looking at, or the timeout.
+    -stats: How many relays are waiting for each pi.
+    """
+
+    PREFIX = "RelayQueue"  # Every pi's list is "RelayQueue:<name>"
+    DEAD_LETTERS_KEPT = 1000  # Dead letters kept for inspection
+
+    def __init__(self, keys: RoomKeys = None):
+        self.r = RedisKeys.REDIS.value
+        self.keys = keys or RoomKeys()
+        # One wake up for every room, there is one dispatcher for them all.
+        self.wake_key = str(RedisKeys.API_RELAY_WAKE)
+        self.woken_key = str(RedisKeys.API_RELAY_WOKEN)
+        self.dead_key = self.keys.key(RedisKeys.API_RELAY_DEAD)
+        self.__retry_dead = self.r.register_script(RETRY_DEAD_SCRIPT)
+
+    def key(self, name) -> str:
+        return self.keys.key(f"{self.PREFIX}:{name}")
+
+    def enqueue(self, names, message) -> dict:
+        """
+        Queue "message" for every pi in "names". Returns {name: relay id}.
+        """
+        queued_at = time.time()
+        ids = {}
+        pipe = self.r.pipeline(transaction=True)
+        for name in names:
+            relay = {}
+            relay["id"] = uuid.uuid4().hex
+            relay["name"] = name
+            relay["message"] = message
+            relay["queued_at"] = queued_at
+            pipe.rpush(self.key(name), json.dumps(relay))
+            ids[name] = relay["id"]
+        if ids:
+            self.wake([self.key(name) for name in ids], pipe)
+            pipe.execute()
+        return ids
+
+    def heads(self, names) -> dict:
+        """
+        Return {name: (raw, relay)} for the next relay for each pi, pis with
+        nothing queued are left out. "raw" is what "done" and "kill" need.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for name in names:
+            pipe.lindex(self.key(name), 0)
+        heads = {}
+        for name, raw in zip(names, pipe.execute()):
+            if raw is not None:
+                heads[name] = raw, json.loads(raw)
+        return heads
+
+    def done(self, name, raw) -> None:
+        self.r.lrem(self.key(name), 1, raw)
+        return
+
+    def kill(self, name, raw, error) -> None:
+        """
+        Move a relay from a pi's queue to the dead letters, in one
+        transaction so it's never in both or neither.
+        """
+        relay = json.loads(raw)
+        relay["error"] = error
+        relay["died_at"] = time.time()
+        pipe = self.r.pipeline(transaction=True)
+        pipe.lrem(self.key(name), 1, raw)
+        pipe.lpush(self.dead_key, json.dumps(relay))
+        pipe.ltrim(self.dead_key, 0, self.DEAD_LETTERS_KEPT - 1)
+        pipe.execute()
+        return
+
+    def dead_letters(self, count: int = 100) -> list:
+        """
+        The newest dead letters first.
+        """
+        raws = self.r.lrange(self.dead_key, 0, count - 1)
+        return [json.loads(raw) for raw in raws]
+
+    def retry_dead(self, names) -> int:
+        """
+        Queue the dead letters of every pi in "names" again, with the same
+        id, ahead of anything queued since. One transaction, so a relay is
+        never lost or requeued twice. Returns how many were requeued.
+        """
+        return self.__retry_dead(
+            keys=[self.dead_key, self.wake_key, self.woken_key],
+            args=[self.key("")] + list(names))
+
+    def wake(self, queue_keys, pipe=None) -> None:
+        """
+        Wake the dispatcher to look at "queue_keys" (see "key"), any
+        room's. Pass "pipe" to do it in a caller's transaction.
+        """
+        execute = pipe is None
+        if execute:
+            pipe = self.r.pipeline(transaction=True)
+        if queue_keys:
+            pipe.sadd(self.woken_key, *queue_keys)
+        # One token is enough however many queues, the set says which.
+        pipe.delete(self.wake_key)
+        pipe.rpush(self.wake_key, 1)
+        if execute:
+            pipe.execute()
+        return
+
+    def wait(self, timeout: float) -> set:
+        """
+        Block until something wakes the dispatcher or "timeout" seconds
+        pass. Returns the queue keys it was woken for, and forgets them.
+        """
+        self.r.blpop([self.wake_key], timeout=max(0.01, timeout))
+        pipe = self.r.pipeline(transaction=True)
+        pipe.smembers(self.woken_key)
+        pipe.delete(self.woken_key)
+        woken, _ = pipe.execute()
+        return {key.decode("utf-8") for key in woken}
+
+    def stats(self, names) -> dict:
+        pipe = self.r.pipeline(transaction=False)
+        for name in names:
+            pipe.llen(self.key(name))
+        pipe.llen(self.dead_key)
+        lengths = pipe.execute()
+        stats = {}
+        stats["pending"] = dict(zip(names, lengths[:-1]))
+        stats["dead_letters"] = lengths[-1]
+        return stats
+
+
+relay_queue = RelayQueue()
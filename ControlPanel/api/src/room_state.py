@@ -0,0 +1,206 @@
+###############################################################################
+# Description: Atomic room state transitions (timer, status, broadcasts)
+# Version: 0.1
+###############################################################################
+
+import json
+
+from src.enums import Broadcasts, RoomStatus
+from src.redis_keys import RedisKeys, RoomKeys
+from src.event_log import EventLog
+from src.timer import (TIMER_LUA, TimerResults, TimerSnapshot, now_ms,
+                       wall_ms)
+
+# KEYS = timer, room status, version, outbox, event log
+# ARGV = op, length, now_ms, wall_ms, expected version ('' for any),
+#        outcomes (json {timer op: [room status, broadcast]}), log maxlen
+# Returns {result, op, version, timer HGETALL}, result is one of TimerResults
+ROOM_TRANSITION_SCRIPT = TIMER_LUA + """
+local version = tonumber(redis.call('GET', KEYS[3]) or '0')
+if ARGV[5] ~= '' and tonumber(ARGV[5]) ~= version then
+    return {'STALE', ARGV[1], version, {}}
+end
+
+local result, op = timer_transition(KEYS[1], ARGV[1], ARGV[2], ARGV[3])
+if result ~= 'OK' then
+    return {result, op, version, redis.call('HGETALL', KEYS[1])}
+end
+
+local outcome = cjson.decode(ARGV[6])[op]
+local room_status = outcome[1]
+local broadcast = outcome[2]
+local status_was = redis.call('GET', KEYS[2])
+redis.call('SET', KEYS[2], room_status)
+version = redis.call('INCR', KEYS[3])
+redis.call('RPUSH', KEYS[4], cjson.encode({
+    version = version, op = op, broadcast = broadcast}))
+
+local t = {}
+local flat = redis.call('HGETALL', KEYS[1])
+for i = 1, #flat, 2 do
+    t[flat[i]] = flat[i + 1]
+end
+local state = 'RUNNING'
+if t['is_stopped'] == 'True' then
+    state = 'STOPPED'
+elseif t['has_started'] ~= 'True' then
+    state = 'IDLE'
+elseif t['is_paused'] == 'True' then
+    state = 'PAUSED'
+end
+
+-- Every transition leaves since_ms at now, so remaining_ms is exact.
+local time = redis.call('TIME')
+local ts_us = time[1] .. string.format('%06d', tonumber(time[2]))
+redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[7], '*',
+    'event', 'timer', 'ts_us', ts_us, 'data', cjson.encode({
+        state = state, running = state == 'RUNNING',
+        remaining_ms = tonumber(t['remaining_ms']),
+        server_time_ms = tonumber(ARGV[4]),
+        length_ms = tonumber(t['length']) * 60000,
+        version = version}))
+if status_was ~= room_status then
+    redis.call('XADD', KEYS[5], 'MAXLEN', '~', ARGV[7], '*',
+        'event', 'room_status', 'ts_us', ts_us, 'data', cjson.encode({
+            room_status = room_status, room_status_was = status_was,
+            version = version}))
+end
+return {result, op, version, flat}
+"""
+
+
+class RoomTransition:
+    """
+    The outcome of one room state transition.
+
+    Public Properties:
+    -result: One of TimerResults, STALE if the room changed since the
+      caller's version.
+    -op: The timer op that ran, a toggle turns into start/pause/resume.
+    -version: The room state version after the transition, or the current
+      one if it was refused.
+    -timer: The TimerSnapshot after the transition.
+    -room_status: The room status the transition set, None if refused.
+    """
+
+    def __init__(self, result, op, version, timer, room_status=None):
+        self.result = result
+        self.op = op
+        self.version = version
+        self.timer = timer
+        self.room_status = room_status
+
+    @property
+    def ok(self) -> bool:
+        return self.result == TimerResults.OK
+
+    def __str__(self):
+        return f"{self.op}: {self.result} (version {self.version})"
+
+
+class RoomStateEngine:
+    """
+    Moves the timer, the room status and the broadcast that goes with them
+    together, in one redis transaction, so concurrent button presses on
+    different workers can never leave them disagreeing.
+
+    Every transition bumps a state version. A caller can pass the version
+    it last saw, if something else changed the room since, the transition
+    is refused as STALE inside redis without touching anything.
+    No lock is ever held, let alone across a network call.
+
+    The broadcast is not sent inside the transaction. It is queued in an
+    outbox list in the same transaction, and "flush" sends it after commit.
+    Flushes hold the room's outbox lock, so the broadcasts reach every pi's
+    relay queue in version order even when workers flush at once.
+    The timer and room status events are added to the event log (see
+    "event_log.py") in the same transaction too, so neither the log nor
+    the streams ever show a half finished transition.
+
+    Public Properties:
+    -version: The current room state version.
+
+    Public Methods:
+    -transition: Run "toggle", "start", "stop" or "reset".
+    -flush: Send every queued broadcast.
+    """
+
+    # The room status and broadcast that go with each timer op.
+    OUTCOMES = {
+        "start": [RoomStatus.RUNNING, Broadcasts.ROOM_START],
+        "pause": [RoomStatus.PAUSED, Broadcasts.PAUSE],
+        "resume": [RoomStatus.RUNNING, Broadcasts.RESUME],
+        "stop": [RoomStatus.STOPPED, Broadcasts.STOP],
+        "reset": [RoomStatus.LOADING, Broadcasts.RESET],
+    }
+    FLUSH_LOCK_TTL = 10  # Seconds the lock outlives a worker that died
+    FLUSH_LOCK_WAIT = 5  # Seconds a flush waits for another one to finish
+
+    def __init__(self, pi_node_controller, length: int = 60,
+                 keys: RoomKeys = None):
+        self.r = RedisKeys.REDIS.value
+        self.pi_node_controller = pi_node_controller
+        self.length = length
+        keys = keys or RoomKeys()
+        self.version_key = keys.key(RedisKeys.API_ROOM_STATE_VERSION)
+        self.outbox_key = keys.key(RedisKeys.API_ROOM_OUTBOX)
+        self.outbox_lock_key = keys.key(RedisKeys.API_ROOM_OUTBOX_LOCK)
+        self.keys = [
+            keys.key(RedisKeys.API_ROOM_TIMER),
+            keys.key(RedisKeys.API_ROOM_STATUS),
+            self.version_key,
+            self.outbox_key,
+            keys.key(RedisKeys.API_STREAM_EVENTS),
+        ]
+        self.__outcomes = json.dumps(self.OUTCOMES)
+        self.__script = self.r.register_script(ROOM_TRANSITION_SCRIPT)
+
+    @property
+    def version(self) -> int:
+        return int(self.r.get(self.version_key) or 0)
+
+    def transition(self, op, expected_version=None) -> RoomTransition:
+        """
+        Run one transition, one round trip. Nothing is sent to the pis,
+        call "flush" after.
+        """
+        if expected_version is None:
+            expected_version = ""
+        now = now_ms()
+        result, op, version, flat = self.__script(keys=self.keys, args=[
+            op, self.length, now, wall_ms(), expected_version,
+            self.__outcomes, EventLog.RETENTION])
+        op = op.decode("utf-8")
+        result = result.decode("utf-8")
+        timer = TimerSnapshot.from_flat(flat, self.length, now)
+        room_status = None
+        if result == TimerResults.OK:
+            room_status = self.OUTCOMES[op][0]
+        return RoomTransition(result, op, version, timer, room_status)
+
+    def flush(self) -> int:
+        """
+        Send the queued broadcasts, oldest first. Any worker can flush,
+        every entry is popped by exactly one of them. Popping and queueing
+        happen under the outbox lock, or a worker could pop PAUSE and queue
+        it while another is still queueing the ROOM_START before it.
+        Returns how many were sent.
+        """
+        lock = self.r.lock(self.outbox_lock_key, timeout=self.FLUSH_LOCK_TTL)
+        if not lock.acquire(blocking=True,
+                            blocking_timeout=self.FLUSH_LOCK_WAIT):
+            # Left in the outbox, the next flush sends it.
+            print("Outbox busy, leaving the broadcasts for the next flush")
+            return 0
+        sent = 0
+        try:
+            while True:
+                entry = self.r.lpop(self.outbox_key)
+                if entry is None:
+                    return sent
+                entry = json.loads(entry)
+                self.pi_node_controller.broadcast(entry["broadcast"])
+                sent += 1
+        finally:
+            lock.release()
+
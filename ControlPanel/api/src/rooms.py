@@ -0,0 +1,239 @@
+###############################################################################
+# Description: Every room the API serves, and what each one needs
+# Version: 0.1
+###############################################################################
+
+import re
+import threading
+
+from src.config_snapshot import config_store
+from src.enums import ConfigKeys, LoadingStatus, RoomStatus
+from src.event_log import EventTypes
+from src.pi_node import PiNodeController
+from src.redis_keys import RedisKeys, RoomKeys
+from src.room_state import RoomStateEngine
+from src.static_cache import StaticPayloadCache
+from src.timer import Timer
+
+ROOM_ID = re.compile(r"^[A-Za-z0-9_-]+$")  # Room ids go in urls and keys
+
+
+class Room:
+    """
+    One room: its config, its pis, its timer and its log, all under the
+    room's own redis keys (see "RoomKeys").
+
+    A room is only its state. The threads, the connection pools and the
+    relay dispatcher are shared by every room, so a room costs about what
+    its pis cost.
+
+    Public Properties:
+    -room_id: The id of the room, None for the default room.
+    -url_prefix: Where the room's routes are, "" for the default room.
+    -keys: The room's RoomKeys.
+    -config_file / config: The room's config, compiled (see
+        "config_snapshot.py").
+    -config_version: The version of the config in use.
+    -pi_node_controller: The room's pis.
+    -room_state: The room's RoomStateEngine.
+    -event_log: The room's event log.
+    -relay_queue: The room's relay queues.
+    -static_cache: The room's static payload cache.
+
+    Public Methods:
+    -timer: The room's Timer.
+    -set_status: Set the room status, and log it if it changed.
+    -initialize: Put the room back to BOOTING, for a boot or a reset.
+    -prepare / apply: Change the room to a new config while it runs.
+    """
+
+    def __init__(self, room_id: str, config_file: str, initial=False,
+                 snapshot: dict = None):
+        self.room_id = room_id
+        self.keys = RoomKeys(room_id)
+        self.config_file = config_file
+        snapshot = snapshot or config_store.load(self.keys, config_file)
+        self.config = snapshot["config"]
+        self.config_version = snapshot["version"]
+        self.config_hash = snapshot["hash"]
+        self.pi_node_controller = PiNodeController(
+            self.config[ConfigKeys.PI_NODES], initial=initial,
+            room_info=self.config["room_info"], keys=self.keys)
+        self.room_state = RoomStateEngine(
+            self.pi_node_controller, self.timer().length, keys=self.keys)
+        self.static_cache = StaticPayloadCache(
+            redis_key=self.keys.key(RedisKeys.API_STATIC_PAYLOAD),
+            stats_key=self.keys.key(RedisKeys.API_STATIC_CACHE_STATS))
+
+    @property
+    def url_prefix(self) -> str:
+        if self.room_id is None:
+            return ""
+        return f"/rooms/{self.room_id}"
+
+    @property
+    def event_log(self):
+        return self.pi_node_controller.event_log
+
+    @property
+    def relay_queue(self):
+        return self.pi_node_controller.relay_queue
+
+    def timer(self, new_timer=False) -> Timer:
+        return Timer(redis_key=self.keys.key(RedisKeys.API_ROOM_TIMER),
+                     new_timer=new_timer)
+
+    def set_status(self, status) -> None:
+        status_was = self.keys.swap(RedisKeys.API_ROOM_STATUS, status)
+        if status_was != status:
+            self.event_log.record(EventTypes.ROOM_STATUS, {
+                "room_status": status,
+                "room_status_was": status_was,
+            })
+        return
+
+    def initialize(self) -> None:
+        """
+        Back to BOOTING, with a new timer and every pi cleared. The next
+        RoomLoader (see "loader.py") loads it again.
+        """
+        self.keys.set(RedisKeys.API_LOADING_STATUS, LoadingStatus.IDLE)
+        self.keys.set(RedisKeys.API_LOAD_PERCENTAGE, 0)
+        self.keys.set(RedisKeys.API_YAML_CONFIG, self.config_file)
+        self.timer(new_timer=True)
+        self.pi_node_controller.clear_all_statuses()
+        self.set_status(RoomStatus.BOOTING)
+        return
+
+    def prepare(self, diff, config) -> None:
+        """
+        Get redis ready for a new config, before it's stored. Only the
+        process that stores it calls this.
+        """
+        self.pi_node_controller.prepare_config(diff,
+                                               config[ConfigKeys.PI_NODES])
+        return
+
+    def apply(self, snapshot) -> dict:
+        """
+        Use a new config from now on, every process calls this. Only what
+        changed is touched, see "PiNodeController.apply_config". Returns
+        what changed about the pis.
+        """
+        config = snapshot["config"]
+        diff = self.pi_node_controller.apply_config(
+            config[ConfigKeys.PI_NODES], config["room_info"])
+        self.config = config
+        self.config_version = snapshot["version"]
+        self.config_hash = snapshot["hash"]
+        return diff
+
+    def to_dict(self) -> dict:
+        info = {}
+        info["id"] = self.room_id
+        info["name"] = self.config["room_info"]["name"]
+        info["url_prefix"] = self.url_prefix
+        info["pi_nodes"] = len(self.pi_node_controller.names)
+        info["config_version"] = self.config_version
+        return info
+
+
+class RoomRegistry:
+    """
+    Every room in the main config. The main config is the default room,
+    with its routes at "/". The "rooms" section lists the other rooms, each
+    with its own config file, with their routes at "/rooms/<room_id>/".
+
+        rooms:
+          lab: "./src/rooms/lab.yaml"
+
+    Rooms are built the first time they're asked for, so a process only
+    pays for the rooms it uses. The gunicorn master builds them all before
+    forking, so the workers share them (see "preload").
+
+    The configs come from the ConfigStore. With "initial" (a boot) every
+    config is compiled again, otherwise they're loaded as they were stored.
+
+    Public Properties:
+    -room_ids: Every room id, None for the default room.
+    -config: The main config, compiled.
+
+    Public Methods:
+    -get: A room by id, None if there is no such room.
+    -rooms: Every room, built if needed.
+    -stream_keys: Every room's event stream, without building the rooms.
+    -config_files: Every room's config file.
+    -apply: Give every built room its newest config.
+    """
+
+    def __init__(self, config_file=ConfigKeys.CONFIG_YAML, initial=False):
+        self.initial = initial
+        self.__files = {None: config_file}
+        self.__snapshots = {None: self.__snapshot(None, config_file)}
+        self.config = self.__snapshots[None]["config"]
+        for room_id, room_file in (self.config.get("rooms") or {}).items():
+            room_id = str(room_id)
+            if not ROOM_ID.match(room_id):
+                print(f"Skipping room {room_id}, use letters, numbers, "
+                      "- and _ only")
+                continue
+            self.__files[room_id] = room_file
+            if initial:
+                self.__snapshots[room_id] = self.__snapshot(room_id,
+                                                            room_file)
+        self.__rooms = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def room_ids(self) -> list:
+        return list(self.__files)
+
+    def get(self, room_id: str = None) -> Room:
+        room = self.__rooms.get(room_id)
+        if room is not None or room_id not in self.__files:
+            return room
+        with self.__lock:
+            if room_id not in self.__rooms:
+                self.__rooms[room_id] = Room(
+                    room_id, self.__files[room_id], self.initial,
+                    self.__snapshots.pop(room_id, None))
+        return self.__rooms[room_id]
+
+    def rooms(self) -> list:
+        return [self.get(room_id) for room_id in self.__files]
+
+    def stream_keys(self) -> list:
+        return [RoomKeys(room_id).key(RedisKeys.API_STREAM_EVENTS)
+                for room_id in self.__files]
+
+    def config_files(self) -> dict:
+        return dict(self.__files)
+
+    def apply(self, store) -> bool:
+        """
+        Load every built room's config from "store", and apply the ones
+        that changed. Returns if any did.
+        """
+        rooms = list(self.__rooms.values())
+        snapshots = store.get_many([room.keys for room in rooms])
+        applied = False
+        for room, snapshot in zip(rooms, snapshots):
+            if snapshot is None or snapshot["hash"] == room.config_hash:
+                continue
+            if snapshot["config_file"] != room.config_file:
+                continue
+            diff = room.apply(snapshot)
+            if room.room_id is None:
+                self.config = room.config
+            applied = True
+            print(f"Config v{room.config_version} applied to "
+                  f"{room.url_prefix or '/'}: +{len(diff['added'])} "
+                  f"-{len(diff['removed'])} "
+                  f"~{len(diff['moved']) + len(diff['rerouted'])} pis")
+        return applied
+
+    def __snapshot(self, room_id, config_file) -> dict:
+        keys = RoomKeys(room_id)
+        if self.initial:
+            return config_store.publish(keys, config_file)[1]
+        return config_store.load(keys, config_file)
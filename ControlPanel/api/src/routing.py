@@ -0,0 +1,92 @@
+###############################################################################
+# Description: Which pis get which triggers
+# Version: 0.1
+###############################################################################
+
+from src.enums import Broadcasts
+
+# Every pi gets these, no matter what it subscribes to.
+STANDARD_BROADCASTS = (
+    Broadcasts.ROOM_START,
+    Broadcasts.PAUSE,
+    Broadcasts.RESUME,
+    Broadcasts.STOP,
+    Broadcasts.RESET,
+)
+
+
+class TriggerRouter:
+    """
+    A routing table from a trigger to the pis that care about it, built
+    once from the config. Finding the pis for a trigger is one dict lookup.
+
+    Subscriptions come from two places in the config:
+    - "triggers" on a pi node, the triggers that one pi wants.
+    - "subroom_triggers" in "room_info", the triggers every pi in that
+      subroom (its "location") wants.
+
+    A pi with no subscriptions at all gets every trigger, like before
+    there was routing. The standard Broadcasts always go to every pi.
+
+    Public Properties:
+    -groups: {subroom: [pi names]}
+
+    Public Methods:
+    -route: The names of the pis a trigger goes to.
+    -to_dict: The whole table, for debugging.
+    """
+
+    def __init__(self, pi_nodes_data: list, room_info: dict = None,
+                 wildcards=STANDARD_BROADCASTS):
+        room_info = room_info or {}
+        subrooms = [value for key, value in room_info.items()
+                    if key.startswith("subroom_") and isinstance(value, str)]
+        self.__groups = {subroom: [] for subroom in subrooms}
+        for pi in pi_nodes_data:
+            location = pi.get("location")
+            if location not in self.__groups:
+                self.__groups[location] = []
+            self.__groups[location].append(pi["name"])
+
+        subscriptions = {pi["name"]: set(pi.get("triggers") or [])
+                         for pi in pi_nodes_data}
+        subroom_triggers = room_info.get("subroom_triggers") or {}
+        for subroom, triggers in subroom_triggers.items():
+            if subroom not in self.__groups:
+                print(f"Routing: unknown subroom {subroom}, ignoring it")
+                continue
+            for name in self.__groups[subroom]:
+                subscriptions[name].update(triggers or [])
+
+        everyone = tuple(pi["name"] for pi in pi_nodes_data)
+        # Pis that never subscribed to anything hear every trigger.
+        self.__unsubscribed = tuple(
+            name for name in everyone if not subscriptions[name])
+
+        self.__table = {}
+        for name in everyone:
+            for trigger in subscriptions[name]:
+                self.__table.setdefault(trigger, set()).add(name)
+        for trigger, names in self.__table.items():
+            names.update(self.__unsubscribed)
+            # Keep the config order so fan outs are predictable.
+            self.__table[trigger] = tuple(n for n in everyone if n in names)
+        for trigger in wildcards:
+            self.__table[trigger] = everyone
+
+    @property
+    def groups(self) -> dict:
+        return {group: list(names) for group, names in self.__groups.items()}
+
+    def route(self, trigger: str) -> tuple:
+        """
+        Return the names of every pi that should get "trigger".
+        """
+        return self.__table.get(trigger, self.__unsubscribed)
+
+    def to_dict(self) -> dict:
+        table = {}
+        table["routes"] = {t: list(n) for t, n in self.__table.items()}
+        table["everything_else"] = list(self.__unsubscribed)
+        table["groups"] = self.groups
+        return table
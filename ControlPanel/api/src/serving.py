@@ -0,0 +1,67 @@
+###############################################################################
+# Description: How the API is served, picked with "worker_mode" in the config
+# Version: 0.1
+###############################################################################
+
+
+class WorkerModes:
+    GTHREAD = "gthread"  # A few real threads per worker (the default)
+    GEVENT = "gevent"  # A green thread per connection
+
+
+DEFAULT_STREAM_CLIENTS = 4  # Streams per gthread worker
+DEFAULT_WORKER_CONNECTIONS = 1000  # Connections per gevent worker
+REQUEST_HEADROOM = 100  # gevent connections streams can never take
+BACKGROUND_REDIS = 26  # Redis connections a worker's own threads can hold
+
+
+def serving_settings(api_config: dict) -> dict:
+    """
+    Turn the "api" section of the config into the gunicorn settings.
+
+    gthread: Every request holds one of a few threads until it's done, so
+    streams get their own threads ("stream_clients") on top of 2 for normal
+    requests, and a slow pi holds a thread for as long as it takes.
+
+    gevent: Every connection gets a green thread, and waiting on a socket
+    (a pi, redis, a stream that's idle) lets the others run. A worker holds
+    "worker_connections" at once, streams can use all but REQUEST_HEADROOM.
+
+    "redis_connections" is what one worker can use at once: one for every
+    request it can hold, plus BACKGROUND_REDIS for its own threads (the
+    event writer, the stream hub, pi polls, fan outs).
+    """
+    api_config = api_config or {}
+    mode = api_config.get("worker_mode", WorkerModes.GTHREAD)
+    if mode not in (WorkerModes.GTHREAD, WorkerModes.GEVENT):
+        print(f"Unknown worker_mode {mode}, using {WorkerModes.GTHREAD}")
+        mode = WorkerModes.GTHREAD
+
+    settings = {}
+    settings["worker_mode"] = mode
+    settings["worker_class"] = mode
+    if mode == WorkerModes.GEVENT:
+        connections = api_config.get("worker_connections",
+                                     DEFAULT_WORKER_CONNECTIONS)
+        settings["threads"] = 1
+        settings["worker_connections"] = connections
+        settings["stream_clients"] = max(1, connections - REQUEST_HEADROOM)
+    else:
+        stream_clients = api_config.get("stream_clients",
+                                        DEFAULT_STREAM_CLIENTS)
+        settings["threads"] = 2 + stream_clients
+        settings["worker_connections"] = None
+        settings["stream_clients"] = stream_clients
+    requests = settings["worker_connections"] or settings["threads"]
+    settings["redis_connections"] = requests + BACKGROUND_REDIS
+    return settings
+
+
+def patch_for_gevent() -> None:
+    """
+    Make sockets, locks, threads and sleeps cooperative. Has to run in the
+    master before anything else imports them, the app is preloaded there.
+    """
+    from gevent import monkey
+    monkey.patch_all()
+    return
@@ -0,0 +1,84 @@
+###############################################################################
+# Description: One round trip read of the room state
+# Version: 0.1
+###############################################################################
+
+from src.pi_node import node_cache
+from src.redis_keys import RedisKeys, RoomKeys
+from src.timer import TimerSnapshot
+
+
+class RoomSnapshot:
+    """
+    Reads every key the dynamic payload needs. The room keys and the timer
+    come from one MULTI/EXEC round trip, so they are always from the same
+    moment in time. The pis come from the worker's PiNode cache (see
+    "node_cache.py"), the ones that aren't cached are read in one more
+    pipelined round trip.
+    Nothing here goes back to redis after the read.
+
+    Public Properties:
+    -load_percentage: The load percentage of the room.
+    -room_status: The status of the room.
+    -version: The room state version (see "room_state.py").
+    -timer: The TimerSnapshot from the same read.
+
+    Public Methods:
+    -to_payload: Returns the dynamic payload.
+    """
+
+    ROOM_KEYS = [
+        RedisKeys.API_LOAD_PERCENTAGE,
+        RedisKeys.API_ROOM_STATUS,
+        RedisKeys.API_ROOM_STATE_VERSION,
+    ]
+
+    def __init__(self, pi_node_controller, keys: RoomKeys = None):
+        self.pi_node_controller = pi_node_controller
+        keys = keys or RoomKeys()
+        pipe = RedisKeys.REDIS.value.pipeline(transaction=True)
+        pipe.mget([keys.key(key) for key in self.ROOM_KEYS])
+        pipe.hgetall(keys.key(RedisKeys.API_ROOM_TIMER))
+        room_values, timer_data = pipe.execute()
+        self.__pi_data = node_cache.get_many(pi_node_controller.redis_keys)
+        self.__load_percentage = self.__decode(room_values[0])
+        self.__room_status = self.__decode(room_values[1])
+        self.__version = int(room_values[2] or 0)
+        self.__timer = TimerSnapshot(timer_data)
+
+    def __decode(self, value):
+        if value is None:
+            return None
+        return value.decode("utf-8")
+
+    @property
+    def load_percentage(self) -> str:
+        return self.__load_percentage
+
+    @property
+    def room_status(self) -> str:
+        return self.__room_status
+
+    @property
+    def version(self) -> int:
+        return self.__version
+
+    @property
+    def timer(self) -> TimerSnapshot:
+        return self.__timer
+
+    def to_payload(self, worker_id) -> dict:
+        """
+        Build the dynamic payload from the snapshot.
+        """
+        payload = {}
+        payload["worker_id"] = worker_id
+        payload["load_percentage"] = self.__load_percentage
+        payload["room_status"] = self.__room_status
+        payload["state_version"] = self.__version
+        payload["time_remaining_secs"] = self.__timer.remaining
+        payload["time_remaining_formatted"] = self.__timer.formatted
+        payload["timer"] = self.__timer.descriptor()
+        payload["pi_nodes"] = self.pi_node_controller.get_serializable_pis(
+            self.__pi_data)
+        return payload
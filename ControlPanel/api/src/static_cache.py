@@ -0,0 +1,201 @@
+###############################################################################
+# Description: Static payload cache shared by all the gunicorn workers
+# Version: 0.1
+###############################################################################
+
+import hashlib
+import json
+import os
+import time
+
+from src.redis_keys import RedisKeys
+
+
+class MissingFileError(Exception):
+    """
+    A file the static payload is built from is gone (a renamed script).
+    Nothing is cached, the next request tries again.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        super().__init__(f"File not found: {file_name}")
+
+
+class StaticPayloadCache:
+    """
+    The static payload only changes when the config or the script changes,
+    so it is built once and shared between every gunicorn worker through
+    redis. Each worker also keeps its own copy, so a hit is a couple of
+    os.stat() calls and no redis round trip at all.
+
+    The cache is keyed on a fingerprint of the watched files
+    (path, mtime, size). When the fingerprint changes the files are hashed,
+    and the payload is only rebuilt if the contents actually changed.
+    A new config version (see "config_snapshot.py") always rebuilds it.
+
+    Public Properties:
+    -hits: Requests served from the cache by this worker.
+    -misses: Requests that had to rebuild the payload in this worker.
+
+    Public Methods:
+    -get: Returns the payload, rebuilding it if any watched file changed.
+        Raises a MissingFileError if a file it needs is gone.
+    -invalidate: Throws away the cached payload for every worker.
+    -stats: Returns the hit/miss counters for this worker and all workers.
+    """
+
+    FLUSH_INTERVAL = 5  # Seconds between pushing hit counters to redis
+
+    def __init__(self, redis_key=RedisKeys.API_STATIC_PAYLOAD,
+                 stats_key=RedisKeys.API_STATIC_CACHE_STATS):
+        self.r = RedisKeys.REDIS.value
+        self.redis_key = str(redis_key)
+        self.stats_key = str(stats_key)
+        self.__entry = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__unflushed_hits = 0
+        self.__last_flush = time.time()
+
+    @property
+    def hits(self) -> int:
+        return self.__hits
+
+    @property
+    def misses(self) -> int:
+        return self.__misses
+
+    def get(self, config_file: str, builder, version: int = None) -> dict:
+        """
+        Return the static payload for "config_file" at config "version".
+        builder(config_file) must return (payload, watched_files), it is only
+        called when the cache is cold or one of the watched files changed.
+        """
+        entry = self.__entry
+        if (entry is None or entry["config_file"] != config_file
+                or entry.get("version") != version):
+            entry = self.__load_shared(config_file, version)
+
+        if entry is not None:
+            fingerprint = self.__fingerprint(entry["files"])
+            if fingerprint == entry["fingerprint"]:
+                self.__entry = entry
+                self.__record_hit()
+                return entry["payload"]
+            entry = self.__refresh(entry, fingerprint)
+
+        if entry is None:
+            entry = self.__rebuild(config_file, builder, version)
+        self.__entry = entry
+        return entry["payload"]
+
+    def invalidate(self) -> None:
+        """
+        Drop the payload for every worker, the next get() rebuilds it.
+        """
+        self.__entry = None
+        self.r.delete(self.redis_key)
+        return
+
+    def stats(self) -> dict:
+        """
+        Return the counters for this worker, and the totals of all workers.
+        """
+        self.__flush_hits(force=True)
+        totals = self.r.hgetall(self.stats_key)
+        totals = {k.decode("utf-8"): int(v) for k, v in totals.items()}
+        stats = {}
+        stats["worker_hits"] = self.__hits
+        stats["worker_misses"] = self.__misses
+        stats["total_hits"] = totals.get("hits", 0)
+        stats["total_misses"] = totals.get("misses", 0)
+        total = stats["total_hits"] + stats["total_misses"]
+        stats["hit_ratio"] = stats["total_hits"] / total if total else 0.0
+        return stats
+
+    def __load_shared(self, config_file, version):
+        """
+        Load the entry another worker already built, if it exists.
+        """
+        data = self.r.get(self.redis_key)
+        if data is None:
+            return None
+        entry = json.loads(data)
+        if (entry.get("config_file") != config_file
+                or entry.get("version") != version):
+            return None
+        return entry
+
+    def __refresh(self, entry, fingerprint):
+        """
+        The files were touched. If the contents did not change, keep the
+        payload and only store the new fingerprint. Otherwise return None
+        so the payload gets rebuilt.
+        """
+        try:
+            hashes = self.__hash_files(entry["files"])
+        except FileNotFoundError:
+            return None
+        if hashes != entry["hashes"]:
+            return None
+        entry["fingerprint"] = fingerprint
+        self.r.set(self.redis_key, json.dumps(entry))
+        self.__record_hit()
+        return entry
+
+    def __rebuild(self, config_file, builder, version):
+        try:
+            payload, files = builder(config_file)
+            files = [config_file] + [f for f in files if f != config_file]
+            hashes = self.__hash_files(files)
+        except FileNotFoundError as e:
+            print(f"Static payload not rebuilt, missing {e.filename}")
+            raise MissingFileError(e.filename)
+        entry = {}
+        entry["config_file"] = config_file
+        entry["version"] = version
+        entry["files"] = files
+        entry["fingerprint"] = self.__fingerprint(files)
+        entry["hashes"] = hashes
+        entry["payload"] = payload
+        self.r.set(self.redis_key, json.dumps(entry))
+        self.__misses += 1
+        self.r.hincrby(self.stats_key, "misses", 1)
+        print(f"Static payload rebuilt from {', '.join(files)}")
+        return entry
+
+    def __record_hit(self):
+        self.__hits += 1
+        self.__unflushed_hits += 1
+        self.__flush_hits()
+
+    def __flush_hits(self, force=False):
+        """
+        Hits are counted locally and pushed to redis every few seconds,
+        so a hit never pays for a round trip.
+        """
+        now = time.time()
+        if not force and now - self.__last_flush < self.FLUSH_INTERVAL:
+            return
+        if self.__unflushed_hits:
+            self.r.hincrby(self.stats_key, "hits", self.__unflushed_hits)
+            self.__unflushed_hits = 0
+        self.__last_flush = now
+
+    def __fingerprint(self, files) -> list:
+        fingerprint = []
+        for file in files:
+            try:
+                stat = os.stat(file)
+                fingerprint.append(f"{file}:{stat.st_mtime_ns}:{stat.st_size}")
+            except FileNotFoundError:
+                fingerprint.append(f"{file}:missing")
+        return fingerprint
+
+    def __hash_files(self, files) -> list:
+        hashes = []
+        for file in files:
+            with open(file, "rb") as f:
+                hashes.append(hashlib.sha1(f.read()).hexdigest())
+        return hashes
@@ -0,0 +1,253 @@
+###############################################################################
+# Description: Server-Sent Events for the Control Panel
+# Version: 0.1
+###############################################################################
+
+import json
+import os
+import threading
+
+from src.event_log import EventTypes
+from src.redis_keys import RedisKeys
+
+
+class StreamEvents(EventTypes):
+    """
+    The events that are pushed down "/stream", every event in the log (see
+    "event_log.py") plus the snapshot a client starts from.
+    """
+    SNAPSHOT = "snapshot"
+    RESYNC = "resync"  # Events were missed, fetch everything again
+
+
+def format_event(event_id, event, data) -> str:
+    """
+    Format one event in the text/event-stream format.
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+def parse_id(event_id):
+    """
+    Redis stream ids are "milliseconds-sequence", turn them into a tuple
+    that can be compared. Returns None for anything that isn't an id.
+    """
+    try:
+        ms, seq = event_id.split("-")
+        return (int(ms), int(seq))
+    except (AttributeError, ValueError):
+        return None
+
+
+class StreamHub:
+    """
+    One per worker, for every room. A single background thread blocks on
+    every room's redis stream at once (one XREAD) and wakes up every open
+    "/stream" connection when something happens in its room.
+    While the rooms are idle the thread sleeps inside redis, and every
+    client sleeps on the same condition, so open tablets cost nothing.
+
+    The newest HISTORY events of each room are kept in memory. A client
+    that fell further behind than that is caught up from the redis stream,
+    and if redis trimmed them too it gets a "resync" event and should
+    fetch the whole room again.
+
+    The number of open streams per worker is capped, so streams can never
+    take every thread a worker has. Clients over the cap get a 503 and
+    should fall back to polling.
+
+    Public Properties:
+    -clients: The number of open streams on this worker.
+
+    Public Methods:
+    -connect: Claim a stream slot, returns what gives it back.
+    -last_id: The id of the newest event seen in a room's stream.
+    -events: The body of one "/stream" response.
+    -replay: Events newer than an id, straight from redis.
+    -wait: Block until there are events newer than an id.
+    """
+
+    HISTORY = 500  # Events per room kept in memory for waiting clients
+    HEARTBEAT = 15  # Seconds between heartbeats on an idle stream
+    RETRY_MS = 3000  # How long the browser waits before reconnecting
+    BLOCK_MS = 30000  # How long the hub blocks on redis per read
+
+    def __init__(self, max_clients: int, stream_keys=None):
+        self.r = RedisKeys.REDIS.value
+        self.stream_keys = list(
+            stream_keys or [str(RedisKeys.API_STREAM_EVENTS)])
+        self.max_clients = max_clients
+        self.__clients = 0
+        self.__lock = threading.Lock()
+        self.__condition = threading.Condition()
+        self.__recent = {}  # stream key: newest events
+        self.__trimmed = {}  # stream key: id of the newest event dropped
+        self.__last_ids = {}  # stream key: id of the newest event
+        self.__pid = None
+
+    @property
+    def clients(self) -> int:
+        return self.__clients
+
+    def last_id(self, stream_key: str) -> str:
+        self.__ensure_running()
+        return self.__last_ids[stream_key]
+
+    def connect(self):
+        """
+        Claim a stream slot, returns None if the worker is full. Otherwise
+        returns a function that gives the slot back, only its first call
+        counts, so every way a response can end can call it.
+        """
+        with self.__lock:
+            if self.__clients >= self.max_clients:
+                return None
+            self.__clients += 1
+        self.__ensure_running()
+        released = []
+
+        def release():
+            with self.__lock:
+                if released:
+                    return
+                released.append(True)
+                self.__clients -= 1
+
+        return release
+
+    def events(self, stream_key, last_id, snapshot, release=None):
+        """
+        Generate the text/event-stream body for one client of one room.
+        The client gets every event after "last_id" if it can be replayed,
+        otherwise "snapshot()" is sent so it starts from a known state.
+        Calls "release" (see "connect") when the client goes away.
+        """
+        try:
+            yield f"retry: {self.RETRY_MS}\n\n"
+            replayed = None
+            if last_id:
+                replayed = self.replay(stream_key, last_id)
+            if replayed is None:
+                last_id = self.last_id(stream_key)
+                yield format_event(last_id, StreamEvents.SNAPSHOT, snapshot())
+                replayed = []
+
+            for event in replayed:
+                last_id = event[0]
+                yield format_event(*event)
+
+            while True:
+                events = self.wait(stream_key, last_id, self.HEARTBEAT)
+                if events is None:
+                    last_id = self.last_id(stream_key)
+                    yield format_event(last_id, StreamEvents.RESYNC,
+                                       {"last_id": last_id})
+                    continue
+                if not events:
+                    yield ": heartbeat\n\n"
+                for event in events:
+                    last_id = event[0]
+                    yield format_event(*event)
+        finally:
+            if release is not None:
+                release()
+
+    def replay(self, stream_key: str, after_id: str):
+        """
+        Return every event newer than "after_id", or None if the id is
+        unknown or too old to replay (the caller should send a snapshot).
+        """
+        after = parse_id(after_id)
+        if after is None:
+            return None
+        oldest = self.r.xrange(stream_key, count=1)
+        if not oldest or after < parse_id(self.__decode_id(oldest[0][0])):
+            return None
+        entries = self.r.xrange(stream_key, min=f"({after_id}")
+        return [self.__decode(entry) for entry in entries]
+
+    def wait(self, stream_key: str, after_id: str, timeout: float):
+        """
+        Block until there are events newer than "after_id" or the timeout
+        runs out. Returns a (possibly empty) list of events, or None if
+        some of them are gone from memory and from redis.
+        """
+        after = parse_id(after_id) or (0, 0)
+        with self.__condition:
+            self.__condition.wait_for(
+                lambda: self.__newer(stream_key, after), timeout=timeout)
+            trimmed = self.__trimmed.get(stream_key)
+            if trimmed is None or after >= parse_id(trimmed):
+                recent = self.__recent.get(stream_key, [])
+                return [e for e in recent if parse_id(e[0]) > after]
+        # Behind by more than HISTORY, the rest are only in redis.
+        return self.replay(stream_key, after_id)
+
+    def __newer(self, stream_key, after) -> bool:
+        last_id = self.__last_ids.get(stream_key)
+        return last_id is not None and parse_id(last_id) > after
+
+    def __ensure_running(self):
+        """
+        Start the hub thread the first time it's needed in this process.
+        Threads don't survive a fork, so this is checked against the pid.
+        """
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            pipe = self.r.pipeline(transaction=False)
+            for stream_key in self.stream_keys:
+                pipe.xrevrange(stream_key, count=1)
+            self.__recent = {}
+            self.__trimmed = {}
+            self.__last_ids = {}
+            for stream_key, latest in zip(self.stream_keys, pipe.execute()):
+                self.__last_ids[stream_key] = "0-0"
+                if latest:
+                    self.__last_ids[stream_key] = self.__decode_id(
+                        latest[0][0])
+            thread = threading.Thread(target=self.__listen, daemon=True)
+            thread.start()
+            self.__pid = os.getpid()
+        return
+
+    def __listen(self):
+        last_ids = dict(self.__last_ids)
+        while True:
+            try:
+                response = self.r.xread(last_ids, block=self.BLOCK_MS,
+                                        count=100)
+            except Exception as e:
+                print(f"Stream hub lost redis: {e}")
+                threading.Event().wait(1)
+                continue
+            if not response:
+                continue
+            with self.__condition:
+                for stream_key, entries in response:
+                    stream_key = self.__decode_id(stream_key)
+                    events = [self.__decode(entry) for entry in entries]
+                    last_ids[stream_key] = events[-1][0]
+                    recent = self.__recent.get(stream_key, []) + events
+                    if len(recent) > self.HISTORY:
+                        dropped = recent[:-self.HISTORY]
+                        self.__trimmed[stream_key] = dropped[-1][0]
+                        recent = recent[-self.HISTORY:]
+                    self.__recent[stream_key] = recent
+                    self.__last_ids[stream_key] = events[-1][0]
+                self.__condition.notify_all()
+
+    def __decode_id(self, event_id) -> str:
+        if isinstance(event_id, bytes):
+            return event_id.decode("utf-8")
+        return event_id
+
+    def __decode(self, entry):
+        event_id, fields = entry
+        event = fields[b"event"].decode("utf-8")
+        data = fields[b"data"].decode("utf-8")
+        return (self.__decode_id(event_id), event, data)
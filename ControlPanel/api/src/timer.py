@@ -13,12 +13,264 @@ class TimerStates:
     STOPPED = "STOPPED"
 
 
+class TimerResults:
+    """
+    What a timer transition answers with. Nothing is written unless the
+    result is OK. The Lua scripts answer with the same strings.
+    """
+    OK = "OK"
+    ALREADY_STARTED = "ALREADY_STARTED"
+    ALREADY_PAUSED = "ALREADY_PAUSED"
+    NOT_PAUSED = "NOT_PAUSED"
+    STOPPED = "STOPPED"
+    STALE = "STALE"  # The room changed since the caller's version
+
+
+def now_ms() -> int:
+    """
+    Milliseconds on the monotonic clock. Every worker runs on the same box,
+    so they all share this clock, and it never jumps when the wall clock
+    is set (NTP, a tablet setting the time, daylight savings).
+    """
+    return time.monotonic_ns() // 1_000_000
+
+
+def wall_ms() -> int:
+    """
+    Milliseconds on the wall clock, only used to tell clients when a
+    snapshot was taken so they can line it up with their own clock.
+    """
+    return time.time_ns() // 1_000_000
+
+
+# Every state change of the timer happens inside redis, so two workers can
+# never interleave a read-modify-write. It's a plain function so bigger
+# scripts can include it and change the timer in the same transaction.
+#   timer_transition(key, op, length, now) -> result, op
+#   op: "reset", "start", "pause", "resume", "toggle" or "stop". A toggle
+#   answers with the op it turned into.
+#   now is now_ms() from the caller.
+#
+# The timer banks the time it has left: "remaining_ms" is what was left at
+# "since_ms". A pause takes what ran since then off the bank, a resume just
+# moves "since_ms". Nothing is rounded, so pauses never add up to drift.
+TIMER_LUA = """
+local function timer_transition(key, op, length, now)
+    if op == 'reset' then
+        redis.call('DEL', key)
+        redis.call('HSET', key, 'length', length,
+                   'remaining_ms', tonumber(length) * 60000, 'since_ms', 0,
+                   'start_ms', 0, 'paused_ms', 0, 'has_started', 'False',
+                   'is_paused', 'False', 'is_stopped', 'False')
+        return 'OK', op
+    end
+
+    local t = {}
+    local flat = redis.call('HGETALL', key)
+    for i = 1, #flat, 2 do
+        t[flat[i]] = flat[i + 1]
+    end
+
+    if op == 'toggle' then
+        if t['is_stopped'] == 'True' then
+            return 'STOPPED', op
+        elseif t['has_started'] ~= 'True' then
+            op = 'start'
+        elseif t['is_paused'] ~= 'True' then
+            op = 'pause'
+        else
+            op = 'resume'
+        end
+    end
+
+    if op == 'start' then
+        if t['has_started'] == 'True' then
+            return 'ALREADY_STARTED', op
+        end
+        if t['is_stopped'] == 'True' then
+            return 'STOPPED', op
+        end
+        local remaining = t['remaining_ms'] or tonumber(length) * 60000
+        redis.call('HSET', key, 'has_started', 'True', 'start_ms', now,
+                   'since_ms', now, 'remaining_ms', remaining)
+    elseif op == 'pause' then
+        if t['is_paused'] == 'True' then
+            return 'ALREADY_PAUSED', op
+        end
+        local ran = now - tonumber(t['since_ms'] or now)
+        local remaining = tonumber(t['remaining_ms'] or 0) - ran
+        redis.call('HSET', key, 'remaining_ms', math.max(0, remaining),
+                   'since_ms', now, 'paused_ms', now, 'is_paused', 'True')
+    elseif op == 'resume' then
+        if t['is_paused'] ~= 'True' then
+            return 'NOT_PAUSED', op
+        end
+        redis.call('HSET', key, 'since_ms', now, 'is_paused', 'False')
+    elseif op == 'stop' then
+        redis.call('HSET', key, 'is_stopped', 'True', 'remaining_ms', 0,
+                   'since_ms', now)
+    end
+    return 'OK', op
+end
+"""
+
+# KEYS[1] = timer, ARGV = op, length, now_ms
+# Returns {result, op, the HGETALL of the timer after the transition}
+TIMER_TRANSITION_SCRIPT = TIMER_LUA + """
+local result, op = timer_transition(KEYS[1], ARGV[1], ARGV[2], ARGV[3])
+return {result, op, redis.call('HGETALL', KEYS[1])}
+"""
+
+TIMER_ERRORS = {
+    TimerResults.STOPPED: "Timer is stopped. Reset the timer to start.",
+    TimerResults.ALREADY_PAUSED: "Timer is already paused.",
+    TimerResults.NOT_PAUSED: "Timer can't resume if it's not paused.",
+}
+
+
+class TimerSnapshot:
+    """
+    The timer as it was at one read. Every value is worked out from that
+    one read, so they can never disagree with each other, and nothing here
+    goes back to redis.
+
+    Public Properties:
+    -length: The length of the timer in minutes.
+    -start_time, end_time, paused_time: Monotonic milliseconds.
+    -has_started, is_paused, is_stopped: As stored.
+    -state: One of TimerStates.
+    -running: If the timer is counting down.
+    -remaining_ms: Milliseconds left on the timer.
+    -remaining: Seconds left, rounded up like a countdown clock.
+    -formatted: Seconds left as "HH:MM:SS".
+
+    Public Methods:
+    -descriptor: What a client needs to run the clock on its own.
+    """
+
+    def __init__(self, data: dict, length: int = 60, now: int = None):
+        """
+        "data" is the HGETALL of the timer, "length" is used until the
+        timer has been reset once. "now" is now_ms() at the read.
+        """
+        data = {self.__decode(k): self.__decode(v) for k, v in data.items()}
+        self.__length = int(data.get("length", length))
+        self.__remaining_ms = int(float(
+            data.get("remaining_ms", self.__length * 60000)))
+        self.__since_ms = int(float(data.get("since_ms", 0)))
+        self.__start_ms = int(float(data.get("start_ms", 0)))
+        self.__paused_ms = int(float(data.get("paused_ms", 0)))
+        self.__has_started = data.get("has_started") == "True"
+        self.__is_paused = data.get("is_paused") == "True"
+        self.__is_stopped = data.get("is_stopped") == "True"
+        self.__now = now_ms() if now is None else int(now)
+        self.__wall = wall_ms()
+
+    @staticmethod
+    def from_flat(flat: list, length: int = 60, now: int = None):
+        """
+        Lua returns an HGETALL as [field, value, field, value, ...]
+        """
+        return TimerSnapshot(dict(zip(flat[::2], flat[1::2])), length, now)
+
+    def __decode(self, value) -> str:
+        if isinstance(value, bytes):
+            return value.decode("utf-8")
+        return value
+
+    @property
+    def length(self) -> int:
+        return self.__length
+
+    @property
+    def start_time(self) -> int:
+        """
+        When the timer was first started, 0 if it hasn't been. Pauses don't
+        move it, only for debugging.
+        """
+        return self.__start_ms
+
+    @property
+    def end_time(self) -> int:
+        """
+        When the timer will hit zero if nobody pauses it, 0 if it isn't
+        running.
+        """
+        if not self.running:
+            return 0
+        return self.__since_ms + self.__remaining_ms
+
+    @property
+    def paused_time(self) -> int:
+        return self.__paused_ms
+
+    @property
+    def has_started(self) -> bool:
+        return self.__has_started
+
+    @property
+    def is_paused(self) -> bool:
+        return self.__is_paused
+
+    @property
+    def is_stopped(self) -> bool:
+        return self.__is_stopped
+
+    @property
+    def state(self) -> str:
+        if self.__is_stopped:
+            return TimerStates.STOPPED
+        if not self.__has_started:
+            return TimerStates.IDLE
+        if self.__is_paused:
+            return TimerStates.PAUSED
+        return TimerStates.RUNNING
+
+    @property
+    def running(self) -> bool:
+        return self.state == TimerStates.RUNNING
+
+    @property
+    def remaining_ms(self) -> int:
+        if not self.running:
+            return max(0, self.__remaining_ms)
+        ran = max(0, self.__now - self.__since_ms)
+        return max(0, self.__remaining_ms - ran)
+
+    @property
+    def remaining(self) -> int:
+        return -(-self.remaining_ms // 1000)
+
+    @property
+    def formatted(self) -> str:
+        """
+        Format the time in a string of "HH:MM:SS"
+        """
+        hrs, remainder = divmod(self.remaining, 3600)
+        mins, secs = divmod(remainder, 60)
+        return "{:02}:{:02}:{:02}".format(int(hrs), int(mins), int(secs))
+
+    def descriptor(self) -> dict:
+        """
+        The timer as "remaining_ms as of server_time_ms". While "running"
+        a client counts down from there on its own clock (corrected by its
+        offset to the server, see /fetch/clock) until the next transition.
+        """
+        descriptor = {}
+        descriptor["state"] = self.state
+        descriptor["running"] = self.running
+        descriptor["remaining_ms"] = self.remaining_ms
+        descriptor["server_time_ms"] = self.__wall
+        descriptor["length_ms"] = self.__length * 60000
+        return descriptor
+
+
 class Timer:
 
     def __init__(
         self,
         length: int = 60,
-        redis_key: str = RedisKeys.API_ROOM_TIMER.get(),
+        redis_key: str = str(RedisKeys.API_ROOM_TIMER),
         new_timer: bool = False,
     ):
         """
@@ -30,94 +282,75 @@ class Timer:
         Keep track of the room time for the Game Guide.
         Length - The length of the timer in minutes, defaults to 60 minutes.
 
+        The timer is a redis hash. Every state change is one script run
+        inside redis (one round trip, atomic), and every read is one HGETALL
+        turned into a TimerSnapshot.
+
         Public Properties:
         length      - The length of the timer.
-        start_time  - Time the timer started. Returns None if not started.
-        end_time    - The time the timer will end.
-        paused_time - The time the timer was paused.
+        start_time  - Monotonic ms of the first start, 0 if not started.
+                      For debugging, the countdown comes from the bank
+                      ("remaining_ms" at "since_ms"), not from this.
+        end_time    - Monotonic ms the timer hits zero, 0 if not running.
+        paused_time - Monotonic ms of the last pause, 0 if never paused.
         is_paused   - If the timer is paused. (Recoverable)
         is_stopped  - If the timer is stopped. (Not Recoverable)
+        last_snapshot - The timer as of the last read or state change.
 
         Public Functions:
+        snapshot()     - Read the timer once.
         start()        - Start the timer.
         pause()        - Pause the timer.
         resume()       - Resume the timer.
+        toggle()       - Start, pause or resume, whichever is next.
         stop()         - Stop the timer.
         reset()        - Reset the timer, clears all data.
-        get_time()     - String in HH:MM:SS format, or PAUSED/STOPPED.
-
-        Private Functions:
-        calc_time_remaining() - Calculate the time remaining.
-        format_time() - Format the time for easy reading.
+        get_time_formatted() - String in HH:MM:SS format.
 
 
         TREAT Timer() like a global!! It's shared memory if you don't
         define a new redis_key
         """
         self.redis_key = redis_key
+        self.r = RedisKeys.REDIS.value
         self.__length = length
-        self.__start_time = 0
-        self.__end_time = 0
-        self.__paused_time = 0
-        self.__has_started = False
-        self.__is_paused = False
-        self.__is_stopped = False
+        self.__last_snapshot = None
+        self.__transition_script = self.r.register_script(
+            TIMER_TRANSITION_SCRIPT)
 
         if new_timer:
             self.reset()
-        else:
-            self.load_from_redis()
 
-    def __str__(self) -> str:
+    def snapshot(self) -> TimerSnapshot:
         """
-        Format the data for saving to redis.
+        Read the timer from redis, once.
         """
-        redis_format = f"{self.__length}:"
-        redis_format += f"{self.__start_time}:"
-        redis_format += f"{self.__end_time}:"
-        redis_format += f"{self.__paused_time}:"
-        redis_format += f"{self.__has_started}:"
-        redis_format += f"{self.__is_paused}:"
-        redis_format += f"{self.__is_stopped}"
-        return redis_format
+        data = self.r.hgetall(self.redis_key)
+        self.__last_snapshot = TimerSnapshot(data, self.__length)
+        return self.__last_snapshot
 
-    def save_to_redis(self):
+    @property
+    def last_snapshot(self) -> TimerSnapshot:
         """
-        Save the timer data to the redis key
+        The timer as of the last read or state change, reads it if there
+        wasn't one yet.
         """
-        RedisKeys.API_ROOM_TIMER.set(self.__str__())
-        return
+        if self.__last_snapshot is None:
+            return self.snapshot()
+        return self.__last_snapshot
 
-    def load_from_redis(self):
+    def transition(self, op) -> tuple:
         """
-        Load the timer data from the redis key. This should be done
-        when the timer is doing anything to change states incase it already
-        did change a state.
+        Change the state of the timer inside redis. The new state comes
+        back in the same round trip (see "last_snapshot").
+        Returns (one of TimerResults, the op that ran).
         """
-        data = RedisKeys.API_ROOM_TIMER.get()
-
-        if data is None:
-            print("No timer data found in redis.")
-            return False
-
-        data = data.split(":")
-        self.__start_time = int(data[1])
-        self.__end_time = int(data[2])
-        self.__paused_time = int(data[3])
-        self.__has_started = self.string_to_bool(data[4])
-        self.__is_paused = self.string_to_bool(data[5])
-        self.__is_stopped = self.string_to_bool(data[6])
-        return True
-
-    def string_to_bool(self, string: str) -> bool:
-        """
-        Convert a string to a boolean.
-        """
-        if string == "True":
-            return True
-        elif string == "False":
-            return False
-        raise ValueError("String is not a boolean.")
+        now = now_ms()
+        result, op, flat = self.__transition_script(
+            keys=[self.redis_key], args=[op, self.__length, now])
+        self.__last_snapshot = TimerSnapshot.from_flat(
+            flat, self.__length, now)
+        return result.decode("utf-8"), op.decode("utf-8")
 
     @property
     def length(self) -> int:
@@ -130,85 +363,67 @@ class Timer:
     @property
     def start_time(self) -> int:
         """
-        Returns an ugly int start time, this is purely for debugging
+        Returns an ugly monotonic ms start time, 0 if the timer hasn't
+        started, this is purely for debugging
         """
-        self.load_from_redis()
-        return self.__start_time
+        return self.snapshot().start_time
 
     @property
     def end_time(self):
         """
-        Returns an ugly int end time, this is purely for debugging
+        Returns an ugly monotonic ms end time, this is purely for debugging
         """
-        self.load_from_redis()
-        return self.__end_time
+        return self.snapshot().end_time
 
     @property
     def paused_time(self):
         """
-        Returns an ugly int paused time, this is purely for debugging
+        Returns an ugly monotonic ms paused time, this is purely for debugging
         """
-        self.load_from_redis()
-        return self.__paused_time
+        return self.snapshot().paused_time
 
     @property
     def has_started(self):
         """
         Check if the timer has started.
         """
-        self.load_from_redis()
-        return self.__has_started
+        return self.snapshot().has_started
 
     @property
     def is_paused(self):
         """
         Check if the timer is paused.
         """
-        self.load_from_redis()
-        return self.__is_paused
+        return self.snapshot().is_paused
 
     @property
     def is_stopped(self):
         """
         Check if the timer is stopped
         """
-        self.load_from_redis()
-        return self.__is_stopped
+        return self.snapshot().is_stopped
 
     # Start the timer
     def start(self) -> bool:
         """
         Starts the timer.
-        If the time is already running, raise a ValueError.
-        Sets start time to now, and sets endtime based on "self.length".
+        Returns False if the timer is already running.
+        If the timer is stopped, raise a ValueError.
+        Starts counting down the full "self.length" from now.
         """
-        self.load_from_redis()
-
-        if self.__has_started:
+        result, _ = self.transition("start")
+        if result == TimerResults.ALREADY_STARTED:
             return False
-
-        if self.__is_stopped:
-            raise ValueError("Timer is stopped. Reset the timer to start.")
-
-        self.__has_started = True
-        self.__start_time = int(time.time())
-        self.__end_time = int(time.time()) + (self.__length * 60)
-        self.save_to_redis()
+        self.__raise_if_failed(result)
         return True
 
     def pause(self):
         """
-        Sets a is_paused flag to True, and sets the paused_time to now.
-        On resume, the time will be adjusted to account for the pause.
+        Sets a is_paused flag to True, and banks the time that's left.
+        On resume, the timer counts down from the bank again.
         Raises an error if the timer is already paused.
         """
-        self.load_from_redis()
-        if self.__is_paused:
-            raise ValueError("Timer is already paused.")
-
-        self.__paused_time = int(time.time())
-        self.__is_paused = True
-        self.save_to_redis()
+        self.__raise_if_failed(self.transition("pause")[0])
         return
 
     def resume(self):
@@ -216,26 +431,28 @@ class Timer:
         Resumes the timer accounting for the time paused.
         Raises an error if the timer is not paused.
         """
-        self.load_from_redis()
-        if not self.__is_paused:
-            raise ValueError("Timer can't resume if it's not paused.")
-
-        delta = int(time.time()) - self.__paused_time
-        self.__end_time += delta
-        self.__is_paused = False
-        self.save_to_redis()
+        self.__raise_if_failed(self.transition("resume")[0])
         return
 
+    def toggle(self) -> str:
+        """
+        Start the timer if it hasn't started, otherwise pause or resume it.
+        The decision is made inside redis, so two clicks at the same time
+        are two toggles and never a double pause.
+        Returns "start", "pause" or "resume", whichever ran.
+        Raises a ValueError if the timer is stopped.
+        """
+        result, op = self.transition("toggle")
+        self.__raise_if_failed(result)
+        return op
+
     def stop(self):
         """
         Stops the timer, and sets the is_stopped flag to True.
         The timer can't be resumed after being stopped!
         You must reset the timer to start it again.
         """
-        self.load_from_redis()
-        self.__is_stopped = True
-        self.__end_time = 0
-        self.save_to_redis()
+        self.transition("stop")
         return
 
     def reset(self) -> None:
@@ -245,58 +462,22 @@ class Timer:
         If you call reset, it resets.
         Always succeeds.
         """
-        self.load_from_redis()
-        self.__start_time = 0
-        self.__end_time = 0
-        self.__paused_time = 0
-        self.__has_started = False
-        self.__is_paused = False
-        self.__is_stopped = False
-        self.save_to_redis()
+        self.transition("reset")
         return
 
-    def get_remaining_time(self) -> str:
-        """
-        Get the time remaining in proper format.
-        If the timer is paused, return "PAUSED".
-        If the timer is stopped, return "STOPPED".
-        Format is "HH:MM:SS"
-        """
-        self.load_from_redis()
-
-        if self.__is_paused:
-            remaining_time = self.__end_time - self.__paused_time
-        else:
-            remaining_time = self.__calc_time_remaining()
-
-        return int(remaining_time)
-
-    def get_time_formatted(self) -> str:
-        time = self.get_remaining_time()
-        return self.__format_time(time)
+    def __raise_if_failed(self, result):
+        if result in TIMER_ERRORS:
+            raise ValueError(TIMER_ERRORS[result])
+        return
 
-    def __calc_time_remaining(self) -> int:
+    def get_remaining_time(self) -> int:
         """
-        Calculate the time remaining on the timer. Returns a timedelta object.
-        This should be only ran internally, and not called by the user.
+        Get the seconds remaining on the timer, from one read.
         """
-        self.load_from_redis()
-        time_remaining = None
-
-        if not self.__has_started:
-            time_remaining = self.__length * 60
-        else:
-            time_remaining = int(self.__end_time) - int(time.time())
+        return self.snapshot().remaining
 
-        if time_remaining <= 0:
-            return 0
-        return time_remaining
-
-    def __format_time(self, seconds) -> str:
+    def get_time_formatted(self) -> str:
         """
-        Format the time in a string of "HH:MM:SS"
+        Get the time remaining as "HH:MM:SS", from one read.
         """
-        self.load_from_redis()
-        hrs, remainder = divmod(seconds, 3600)
-        mins, secs = divmod(remainder, 60)
-        return "{:02}:{:02}:{:02}".format(int(hrs), int(mins), int(secs))
+        return self.snapshot().formatted
@@ -0,0 +1,34 @@
+###############################################################################
+# Description: Every test runs against an in memory fakeredis
+# Version: 0.1
+###############################################################################
+"""
+Run from "ControlPanel/api":
+
+    pipenv run python -m pytest tests
+"""
+
+import os
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+os.chdir(API_DIR)  # The config paths are relative to "ControlPanel/api"
+
+# Before anything in "src" is imported, it connects to redis on import.
+from bench.environment import use_fake_redis  # noqa: E402
+
+use_fake_redis()
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def redis_client():
+    """
+    The shared fakeredis, empty at the start of every test.
+    """
+    from src.redis_keys import RedisKeys
+    r = RedisKeys.REDIS.value
+    r.flushall()
+    return r
@@ -0,0 +1,81 @@
+import os
+
+import yaml
+
+from src.config_snapshot import (RESTART_SECTIONS, ConfigStore,
+                                 compile_config, diff_configs)
+from src.redis_keys import RoomKeys
+
+
+def write_config(path, **changes):
+    script = path.parent / "script.md"
+    script.write_text("# Script\n")
+    config = {
+        "script": str(script),
+        "room_info": {"name": "Test Room", "subroom_1": "Lobby"},
+        "api": {"worker_mode": "gthread"},
+        "pi_nodes": [{"name": "door", "ip": "127.0.0.1",
+                      "location": "Lobby"}],
+    }
+    config.update(changes)
+    path.write_text(yaml.safe_dump(config))
+    return str(path)
+
+
+def test_publish_bumps_the_version_only_on_new_content(tmp_path):
+    store = ConfigStore()
+    keys = RoomKeys("test")
+    config_file = write_config(tmp_path / "room.yaml")
+
+    changed, first = store.publish(keys, config_file)
+    assert changed and first["version"] == 1
+    changed, again = store.publish(keys, config_file)
+    assert not changed and again["version"] == 1
+
+    # A new mtime isn't new content.
+    stat = os.stat(config_file)
+    os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    changed, touched = store.publish(keys, config_file)
+    assert not changed and touched["version"] == 1
+    assert store.get(keys)["fingerprint"] == touched["fingerprint"]
+
+    write_config(tmp_path / "room.yaml",
+                 room_info={"name": "Renamed", "subroom_1": "Lobby"})
+    changed, renamed = store.publish(keys, config_file)
+    assert changed and renamed["version"] == 2
+    assert store.get(keys)["config"]["room_info"]["name"] == "Renamed"
+    assert store.version() == 2
+
+
+def test_the_version_counter_is_shared_by_every_room(tmp_path):
+    store = ConfigStore()
+    config_file = write_config(tmp_path / "room.yaml")
+    assert store.publish(RoomKeys("one"), config_file)[1]["version"] == 1
+    assert store.publish(RoomKeys("two"), config_file)[1]["version"] == 2
+    assert store.publish(RoomKeys("one"), config_file)[1]["version"] == 1
+    assert store.version() == 2
+
+
+def test_only_boot_sections_need_a_restart(tmp_path):
+    old = compile_config(write_config(tmp_path / "room.yaml"))
+    new = compile_config(write_config(
+        tmp_path / "room.yaml",
+        api={"worker_mode": "gevent"},
+        room_info={"name": "Renamed", "subroom_1": "Lobby"},
+        pi_nodes=[{"name": "door", "ip": "127.0.0.1", "location": "Lobby",
+                   "triggers": ["DOOR_OPEN"]}]))
+
+    diff = diff_configs(old, new)
+    assert diff["sections"] == ["api", "room_info"]
+    assert diff["restart_needed"] == ["api"]
+    assert diff["rerouted"] == ["door"]
+    assert diff["moved"] == diff["added"] == diff["removed"] == []
+
+
+def test_every_restart_section_is_flagged():
+    for section in RESTART_SECTIONS:
+        diff = diff_configs({section: 1}, {section: 2})
+        assert diff["restart_needed"] == [section]
+    diff = diff_configs({"room_overrides": []}, {"room_overrides": ["X"]})
+    assert diff["sections"] == ["room_overrides"]
+    assert diff["restart_needed"] == []
@@ -0,0 +1,119 @@
+import threading
+import time
+
+import pytest
+
+from src import dispatcher as dispatcher_module
+from src.dispatcher import Dispatcher
+from src.pi_node import PiNode, PiNodeController
+from src.redis_keys import RoomKeys
+from src.relay_queue import RelayQueue
+
+PIS = [
+    {"name": "one", "ip": "127.0.0.1", "location": "A"},
+    {"name": "two", "ip": "127.0.0.2", "location": "A"},
+    {"name": "three", "ip": "127.0.0.3", "location": "A"},
+]
+
+
+class Stop(Exception):
+    pass
+
+
+@pytest.fixture
+def relays(monkeypatch):
+    """
+    Every relay the pis got, as (name, message). The pis always answer.
+    """
+    relays = []
+
+    def relay(pi, message, timeout=5, idempotency_key=None):
+        relays.append((pi.name, message))
+        return True
+
+    monkeypatch.setattr(PiNode, "relay", relay)
+    return relays
+
+
+@pytest.fixture
+def heads(monkeypatch):
+    """
+    The names every "RelayQueue.heads" call looked at.
+    """
+    calls = []
+    real = RelayQueue.heads
+
+    def spy(queue, names):
+        calls.append(sorted(names))
+        return real(queue, names)
+
+    monkeypatch.setattr(RelayQueue, "heads", spy)
+    return calls
+
+
+def run_until(monkeypatch, dispatcher, done):
+    """
+    Run "dispatcher" on a thread until "done()" is true after a pass.
+    """
+    real = dispatcher_module.relay_queue.wait
+
+    def wait(timeout):
+        if done():
+            raise Stop()
+        return real(min(timeout, 0.1))
+
+    monkeypatch.setattr(dispatcher_module.relay_queue, "wait", wait)
+    errors = []
+
+    def run():
+        try:
+            dispatcher.run()
+        except Stop:
+            return
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, errors
+
+
+def test_only_woken_queues_are_read(monkeypatch, relays, heads):
+    controller = PiNodeController(PIS, initial=True)
+    controller.relay("two", "B1")
+    controller.relay("two", "B2")
+    dispatcher = Dispatcher([controller])
+
+    thread, errors = run_until(monkeypatch, dispatcher,
+                               lambda: len(relays) == 3)
+    while not heads:
+        time.sleep(0.01)
+    controller.relay("three", "C")
+    thread.join(10)
+
+    assert not thread.is_alive() and not errors
+    # Each pi is relayed to on its own thread, only its own order holds.
+    assert [m for name, m in relays if name == "two"] == ["B1", "B2"]
+    assert sorted(relays) == [("three", "C"), ("two", "B1"), ("two", "B2")]
+    # Every queue once at start, then only the ones that changed.
+    assert heads[0] == ["one", "three", "two"]
+    assert all(call in (["two"], ["three"], ["three", "two"])
+               for call in heads[1:])
+
+
+def test_refresh_adds_a_thread_per_new_pi(monkeypatch, relays):
+    controller = PiNodeController(PIS[:1], initial=True)
+    dispatcher = Dispatcher([controller])
+    assert dispatcher.workers == 1
+
+    lab = PiNodeController(PIS, initial=True, keys=RoomKeys("lab"))
+    dispatcher.controllers.append(lab)
+    dispatcher.refresh()
+    lab.broadcast("L")
+    thread, errors = run_until(monkeypatch, dispatcher,
+                               lambda: len(relays) == 3)
+    thread.join(10)
+
+    assert not thread.is_alive() and not errors
+    assert dispatcher.workers == 4
+    assert sorted(relays) == [("one", "L"), ("three", "L"), ("two", "L")]
@@ -0,0 +1,67 @@
+from src.event_log import EventLog, EventTypes
+
+
+def fill(log, types):
+    """
+    One event per type, "data" says where it is in the log.
+    """
+    return [log.append(event_type, {"n": n})
+            for n, event_type in enumerate(types)]
+
+
+def pages(log, **kwargs):
+    """
+    Follow the cursor until there is no next page.
+    """
+    cursor = None
+    while True:
+        page = log.range(cursor=cursor, **kwargs)
+        yield page["events"]
+        cursor = page["next"]
+        if cursor is None:
+            return
+
+
+def test_cursor_walks_every_event_once():
+    log = EventLog("TestEvents")
+    ids = fill(log, [EventTypes.TRIGGER] * 5)
+
+    walked = list(pages(log, count=2))
+    assert [[e["data"]["n"] for e in page] for page in walked] == [
+        [0, 1], [2, 3], [4]]
+    assert [e["id"] for page in walked for e in page] == ids
+
+
+def test_reverse_walks_newest_first():
+    log = EventLog("TestEvents")
+    fill(log, [EventTypes.TRIGGER] * 5)
+
+    walked = list(pages(log, count=2, reverse=True))
+    assert [[e["data"]["n"] for e in page] for page in walked] == [
+        [4, 3], [2, 1], [0]]
+
+
+def test_types_fill_a_page_past_the_other_events():
+    log = EventLog("TestEvents")
+    fill(log, [EventTypes.TIMER] + [EventTypes.NODE_STATUS] * 6
+         + [EventTypes.TIMER, EventTypes.OVERRIDE, EventTypes.TIMER])
+
+    page = log.range(count=2, types=[EventTypes.TIMER, EventTypes.OVERRIDE])
+    assert [e["data"]["n"] for e in page["events"]] == [0, 7]
+    page = log.range(cursor=page["next"], count=2,
+                     types=[EventTypes.TIMER, EventTypes.OVERRIDE])
+    assert [e["data"]["n"] for e in page["events"]] == [8, 9]
+    page = log.range(cursor=page["next"], count=2,
+                     types=[EventTypes.TIMER, EventTypes.OVERRIDE])
+    assert page == {"events": [], "next": None}
+
+
+def test_cursor_picks_up_events_written_since():
+    log = EventLog("TestEvents")
+    fill(log, [EventTypes.TRIGGER] * 2)
+    page = log.range(count=10)
+    assert len(page["events"]) == 2 and page["next"] is None
+
+    last = page["events"][-1]["id"]
+    new = log.append(EventTypes.TIMER, {"n": 2})
+    assert [e["id"] for e in log.range(cursor=last)["events"]] == [new]
@@ -0,0 +1,40 @@
+import time
+
+from src.fan_out import FanOut
+
+
+class Pi:
+    def __init__(self, name, dead=False):
+        self.name = name
+        self.dead = dead
+
+
+def call(pi, timeout):
+    if pi.dead:
+        time.sleep(timeout)  # Never answers
+        return False
+    return "READY"
+
+
+def test_dead_pis_never_hold_up_the_healthy_ones():
+    fan_out = FanOut(min_workers=4)
+    dead = [Pi(f"dead{i}", dead=True) for i in range(20)]
+    healthy = [Pi(f"ok{i}") for i in range(5)]
+
+    started = time.monotonic()
+    results = fan_out.run(dead + healthy, call, node_timeout=0.5,
+                          deadline=1, retries=0)
+
+    assert time.monotonic() - started < 1
+    assert all(results[pi.name].ok for pi in healthy)
+    assert all(results[pi.name].error == "failed" for pi in dead)
+
+
+def test_a_sweep_never_waits_on_the_last_one():
+    fan_out = FanOut(min_workers=1)
+    dead = [Pi(f"dead{i}", dead=True) for i in range(10)]
+    fan_out.run(dead, call, node_timeout=5, deadline=0.2, retries=0)
+
+    results = fan_out.run([Pi("ok")], call, node_timeout=0.5, deadline=0.5)
+
+    assert results["ok"].ok
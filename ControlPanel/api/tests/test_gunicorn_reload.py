@@ -0,0 +1,160 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import redis
+import requests
+import yaml
+
+pytest.importorskip("gunicorn")
+from fakeredis import TcpFakeServer  # noqa: E402
+from fakeredis._clients import _tcp_server  # noqa: E402
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAB_PI = "127.0.7.1"  # Pis always listen on 12413, so each gets its own ip
+DEFAULT_PI = "127.0.7.2"  # Nothing listens here
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def get(url) -> int:
+    try:
+        return requests.get(url, timeout=5).status_code
+    except requests.exceptions.RequestException:
+        return None
+
+
+def wait_for(check, timeout=30):
+    stop_at = time.monotonic() + timeout
+    while time.monotonic() < stop_at:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+class AnswerErrors(_tcp_server.FakeRedisConnection):
+    """
+    Fakeredis' TCP server hangs up on a client that got an error, a real
+    redis answers with it. Hanging up on the first "NOSCRIPT" breaks every
+    "register_script".
+    """
+
+    def read_response(self, *args, **kwargs):
+        try:
+            return super().read_response(*args, **kwargs)
+        except redis.exceptions.ResponseError as e:
+            return e
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    """
+    A fakeredis the API's processes can all reach, over TCP.
+    """
+    monkeypatch.setattr(_tcp_server, "FakeRedisConnection", AnswerErrors)
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield port
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def lab_pi():
+    """
+    The messages relayed to the lab's pi, which always answers.
+    """
+    relayed = []
+
+    class Pi(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.answer()
+
+        def do_POST(self):
+            relayed.append(self.path)
+            self.answer()
+
+        def answer(self):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"READY")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((LAB_PI, 12413), Pi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield relayed
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def api_dir(tmp_path, redis_server):
+    """
+    A copy of "ControlPanel/api" with its own config, the code is linked.
+    """
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in os.listdir(os.path.join(API_DIR, "src")):
+        if name not in ("config.yaml", "gunicorn.pid", "__pycache__"):
+            os.symlink(os.path.join(API_DIR, "src", name), src / name)
+    with open(os.path.join(API_DIR, "src", "config.yaml"), "r") as f:
+        config = yaml.safe_load(f)
+    config.pop("rooms", None)
+    config["api"]["worker_mode"] = "gthread"
+    config["redis"]["port"] = redis_server
+    config["pi_nodes"] = [{"name": "default", "ip": DEFAULT_PI,
+                           "location": config["room_info"]["subroom_1"]}]
+    (src / "config.yaml").write_text(yaml.safe_dump(config))
+    (src / "lab.yaml").write_text(yaml.safe_dump({
+        "script": "./src/script.md",
+        "room_info": {"name": "Lab", "description": "Second room",
+                      "subroom_1": "Lab 1"},
+        "pi_nodes": [{"name": "io", "ip": LAB_PI, "location": "Lab 1"}],
+    }))
+    return tmp_path
+
+
+def test_reload_serves_the_new_rooms_relays(api_dir, redis_server, lab_pi):
+    r = redis.Redis(port=redis_server)
+    port = free_port()
+    gunicorn = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "./src/gunicorn.conf.py",
+         "--pid", "./src/gunicorn.pid", "-b", f"127.0.0.1:{port}",
+         "src.app:app"],
+        cwd=api_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        assert wait_for(lambda: r.exists("APIRelayDispatcher"))
+        dispatcher = r.get("APIRelayDispatcher")
+
+        config_file = api_dir / "src" / "config.yaml"
+        config = yaml.safe_load(config_file.read_text())
+        config["rooms"] = {"lab": "./src/lab.yaml"}
+        config_file.write_text(yaml.safe_dump(config))
+        gunicorn.send_signal(signal.SIGHUP)
+        # The new dispatcher took the lock from the old one.
+        assert wait_for(lambda: r.get("APIRelayDispatcher")
+                        not in (None, dispatcher))
+
+        lab = f"http://127.0.0.1:{port}/rooms/lab"
+        assert wait_for(lambda: get(f"{lab}/fetch/room_status") == 200)
+        response = requests.post(f"{lab}/override/HELLO/io", timeout=5)
+        assert response.status_code == 501  # Queued, see "override_relay"
+        assert wait_for(lambda: "/relay/HELLO" in lab_pi)
+        assert wait_for(lambda: r.llen("Room:lab:RelayQueue:io") == 0)
+    finally:
+        gunicorn.send_signal(signal.SIGINT)  # Quick shutdown
+        gunicorn.wait(30)
@@ -0,0 +1,63 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.enums import RoomStatus
+from src.loader import RoomLoader
+from src.pi_node import PiNodeController
+from src.redis_keys import RedisKeys, RoomKeys
+
+SLOW_PI = "127.0.9.1"  # Pis always listen on 12413, so each gets its own ip
+OFFLINE_PI = "127.0.9.2"  # Nothing listens here
+
+
+@pytest.fixture
+def slow_pi():
+    """
+    A pi that says it's READY a second after it's first asked.
+    """
+    first_asked = []
+
+    class Pi(BaseHTTPRequestHandler):
+        def do_GET(self):
+            first_asked.append(first_asked[0] if first_asked
+                               else time.monotonic())
+            ready = time.monotonic() - first_asked[0] > 1
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"READY" if ready else b"LOADING")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((SLOW_PI, 12413), Pi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+def test_only_a_summary_is_logged_while_polling(slow_pi, capsys):
+    keys = RoomKeys("test")
+    controller = PiNodeController([
+        {"name": "slow", "ip": SLOW_PI, "location": "A"},
+        {"name": "offline", "ip": OFFLINE_PI, "location": "A"},
+    ], initial=True, keys=keys)
+    loader = RoomLoader(controller, keys=keys)
+    loader.POLL_INTERVAL = 0.05
+    loader.LOAD_DEADLINE = 3
+    capsys.readouterr()
+
+    assert not loader.load()
+    lines = capsys.readouterr().out.splitlines()
+
+    assert not [line for line in lines if "error occurred" in line]
+    progress = [line for line in lines if line.startswith("Loading Room..")]
+    # One line to start, then one a second at most, when something changed.
+    assert len(progress) <= 1 + loader.LOAD_DEADLINE
+    assert "50% (1/2 READY), unreachable: offline" in progress[-1]
+    assert "not READY: offline" in lines[-1]
+    assert keys.get(RedisKeys.API_ROOM_STATUS) == RoomStatus.ERROR
+    assert keys.get(RedisKeys.API_LOAD_PERCENTAGE) == "50"
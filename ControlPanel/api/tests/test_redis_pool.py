@@ -0,0 +1,29 @@
+import yaml
+
+from src.redis_pool import load_settings
+from src.serving import DEFAULT_WORKER_CONNECTIONS
+
+
+def write_config(path, api, redis=None):
+    config = {"api": api}
+    if redis is not None:
+        config["redis"] = redis
+    path.write_text(yaml.safe_dump(config))
+    return str(path)
+
+
+def test_the_pool_fits_a_gevent_worker(tmp_path):
+    gthread = load_settings(write_config(
+        tmp_path / "gthread.yaml", {"worker_mode": "gthread"}))
+    gevent = load_settings(write_config(
+        tmp_path / "gevent.yaml", {"worker_mode": "gevent"}))
+    assert gevent["max_connections"] > DEFAULT_WORKER_CONNECTIONS
+    assert gthread["max_connections"] < DEFAULT_WORKER_CONNECTIONS
+
+
+def test_the_config_sets_the_pool(tmp_path, capsys):
+    settings = load_settings(write_config(
+        tmp_path / "config.yaml", {"worker_mode": "gevent"},
+        {"max_connections": 64}))
+    assert settings["max_connections"] == 64
+    assert "requests will wait on the pool" in capsys.readouterr().out
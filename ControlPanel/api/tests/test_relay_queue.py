@@ -0,0 +1,37 @@
+import json
+
+from src.redis_keys import RoomKeys
+from src.relay_queue import RelayQueue
+
+
+def kill_head(queue, name):
+    raw = queue.heads([name])[name][0]
+    queue.kill(name, raw, "failed 10 times")
+
+
+def test_retry_dead_keeps_each_pis_order(redis_client):
+    queue = RelayQueue(RoomKeys("test"))
+    queue.enqueue(["one"], "A")
+    queue.enqueue(["one"], "B")
+    queue.enqueue(["gone"], "G")
+    kill_head(queue, "one")
+    kill_head(queue, "one")
+    kill_head(queue, "gone")
+    queue.enqueue(["one"], "C")  # Queued after A and B died
+    queue.wait(0.01)
+
+    assert queue.retry_dead(["one"]) == 2
+
+    raws = redis_client.lrange(queue.key("one"), 0, -1)
+    relays = [json.loads(raw) for raw in raws]
+    assert [relay["message"] for relay in relays] == ["A", "B", "C"]
+    assert all("error" not in relay for relay in relays)
+    # "gone" isn't in the config anymore, its relay stays dead.
+    assert [relay["name"] for relay in queue.dead_letters()] == ["gone"]
+    assert queue.wait(0.01) == {queue.key("one")}
+
+
+def test_retry_dead_with_nothing_dead(redis_client):
+    queue = RelayQueue(RoomKeys("test"))
+    assert queue.retry_dead(["one"]) == 0
+    assert queue.dead_letters() == []
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from src.redis_keys import RoomKeys
+from src.room_state import RoomStateEngine
+from src.timer import TimerResults
+
+
+class SlowController:
+    """
+    Stands in for a PiNodeController, the first broadcast takes a while to
+    queue, like a worker that got descheduled between LPOP and RPUSH.
+    """
+
+    def __init__(self):
+        self.broadcasts = []
+        self.lock = threading.Lock()
+
+    def broadcast(self, message):
+        if message == "RESET":
+            time.sleep(0.2)
+        with self.lock:
+            self.broadcasts.append(message)
+        return {}
+
+
+def test_concurrent_flushes_keep_version_order():
+    controller = SlowController()
+    engine = RoomStateEngine(controller, keys=RoomKeys("test"))
+    for op in ("reset", "toggle", "toggle", "toggle", "stop"):
+        assert engine.transition(op).ok
+
+    threads = [threading.Thread(target=engine.flush) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert controller.broadcasts == [
+        "RESET", "ROOM_START", "PAUSE", "RESUME", "STOP"]
+
+
+def test_flush_leaves_the_outbox_to_the_lock_holder(redis_client):
+    engine = RoomStateEngine(SlowController(), keys=RoomKeys("test"))
+    engine.FLUSH_LOCK_WAIT = 0.1
+    assert engine.transition("reset").ok
+    lock = redis_client.lock(engine.outbox_lock_key, timeout=5)
+    assert lock.acquire(blocking=False)
+    assert engine.flush() == 0
+    lock.release()
+    assert engine.flush() == 1
+
+
+def test_a_stale_version_changes_nothing():
+    engine = RoomStateEngine(SlowController(), keys=RoomKeys("test"))
+    seen = engine.transition("reset").version
+    assert engine.transition("toggle", seen).ok
+
+    stale = engine.transition("toggle", seen)
+    assert stale.result == TimerResults.STALE
+    assert not stale.ok and stale.version == seen + 1
+    assert engine.version == seen + 1
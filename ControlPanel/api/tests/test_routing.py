@@ -0,0 +1,45 @@
+from src.enums import Broadcasts
+from src.routing import STANDARD_BROADCASTS, TriggerRouter
+
+ROOM_INFO = {
+    "name": "Test Room",
+    "subroom_1": "Lobby",
+    "subroom_2": "Vault",
+    "subroom_triggers": {"Vault": ["VAULT_OPEN"]},
+}
+
+PI_NODES = [
+    {"name": "door", "location": "Lobby", "triggers": ["DOOR_OPEN"]},
+    {"name": "safe", "location": "Vault", "triggers": ["DOOR_OPEN"]},
+    {"name": "lights", "location": "Vault"},
+    {"name": "speaker", "location": "Lobby"},
+]
+
+
+def test_subscribed_triggers_go_to_their_pis_and_the_unsubscribed():
+    router = TriggerRouter(PI_NODES, ROOM_INFO)
+    # "speaker" never subscribed to anything, so it hears every trigger.
+    assert router.route("DOOR_OPEN") == ("door", "safe", "speaker")
+    # Every pi in the Vault subscribes to "VAULT_OPEN".
+    assert router.route("VAULT_OPEN") == ("safe", "lights", "speaker")
+
+
+def test_unknown_triggers_only_go_to_the_unsubscribed():
+    router = TriggerRouter(PI_NODES, ROOM_INFO)
+    assert router.route("NOBODY_ASKED") == ("speaker",)
+
+
+def test_standard_broadcasts_go_to_every_pi():
+    router = TriggerRouter(PI_NODES, ROOM_INFO)
+    for broadcast in STANDARD_BROADCASTS:
+        assert router.route(broadcast) == (
+            "door", "safe", "lights", "speaker")
+
+
+def test_no_subscriptions_routes_everything_everywhere():
+    pi_nodes = [{"name": "a", "location": "Lobby"},
+                {"name": "b", "location": "Vault"}]
+    router = TriggerRouter(pi_nodes, {"subroom_1": "Lobby"})
+    assert router.route("ANYTHING") == ("a", "b")
+    assert router.route(Broadcasts.RESET) == ("a", "b")
+    assert router.groups == {"Lobby": ["a"], "Vault": ["b"]}
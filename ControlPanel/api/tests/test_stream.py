@@ -0,0 +1,87 @@
+import json
+import time
+
+import pytest
+
+from src.stream import StreamHub
+
+KEY = "Room:test:APIStreamEvents"
+
+
+def add(r, count):
+    return [r.xadd(KEY, {"event": "timer", "data": json.dumps({"n": n})})
+            .decode("utf-8") for n in range(count)]
+
+
+def events(chunks):
+    """
+    The (id, event) of every event in some text/event-stream chunks.
+    """
+    found = []
+    for chunk in chunks:
+        fields = dict(line.split(": ", 1) for line in chunk.splitlines()
+                      if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            found.append((fields["id"], fields["event"]))
+    return found
+
+
+@pytest.fixture
+def hub(redis_client):
+    hub = StreamHub(max_clients=4, stream_keys=[KEY])
+    hub.HEARTBEAT = 0.1
+    return hub
+
+
+def caught_up(hub, event_id):
+    stop_at = time.monotonic() + 5
+    while hub.last_id(KEY) != event_id:
+        assert time.monotonic() < stop_at
+        time.sleep(0.01)
+
+
+def test_last_event_id_resumes_after_it(hub, redis_client):
+    ids = add(redis_client, 3)
+    body = hub.events(KEY, ids[0], lambda: {"snapshot": True})
+
+    chunks = [next(body) for _ in range(3)]
+
+    assert chunks[0].startswith("retry:")
+    assert events(chunks[1:]) == [(ids[1], "timer"), (ids[2], "timer")]
+
+
+def test_unknown_last_event_id_gets_a_snapshot(hub, redis_client):
+    ids = add(redis_client, 2)
+    body = hub.events(KEY, "not-an-id", lambda: {"snapshot": True})
+
+    chunks = [next(body) for _ in range(2)]
+
+    assert events(chunks[1:]) == [(ids[-1], "snapshot")]
+
+
+def test_a_client_behind_the_memory_is_caught_up_from_redis(hub,
+                                                            redis_client):
+    hub.HISTORY = 2
+    first = add(redis_client, 1)[0]
+    caught_up(hub, first)
+    ids = add(redis_client, 5)
+    caught_up(hub, ids[-1])
+
+    replayed = hub.wait(KEY, first, 0.1)
+
+    assert [event[0] for event in replayed] == ids
+
+
+def test_a_client_behind_redis_is_told_to_resync(hub, redis_client):
+    hub.HISTORY = 2
+    first = add(redis_client, 1)[0]
+    caught_up(hub, first)
+    body = hub.events(KEY, first, lambda: {"snapshot": True})
+    next(body)  # "retry:"
+    assert next(body) == ": heartbeat\n\n"  # Waiting for events after it
+    ids = add(redis_client, 5)
+    caught_up(hub, ids[-1])
+    redis_client.xtrim(KEY, maxlen=2, approximate=False)
+
+    assert events([next(body)]) == [(ids[-1], "resync")]
+    assert next(body) == ": heartbeat\n\n"
@@ -0,0 +1,81 @@
+import pytest
+
+from src import timer as timer_module
+from src.timer import Timer, TimerResults, TimerStates
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    The timer's monotonic clock, moved by hand.
+    """
+    now = [1_000_000]
+    monkeypatch.setattr(timer_module, "now_ms", lambda: now[0])
+    return now
+
+
+def test_toggle_starts_pauses_and_resumes(clock):
+    timer = Timer(length=1, redis_key="TestTimer", new_timer=True)
+    assert timer.last_snapshot.state == TimerStates.IDLE
+
+    assert timer.toggle() == "start"
+    assert timer.last_snapshot.state == TimerStates.RUNNING
+    clock[0] += 10_000
+    assert timer.toggle() == "pause"
+    assert timer.last_snapshot.state == TimerStates.PAUSED
+    clock[0] += 5_000
+    assert timer.toggle() == "resume"
+    assert timer.last_snapshot.state == TimerStates.RUNNING
+
+
+def test_pauses_bank_the_time_left(clock):
+    timer = Timer(length=1, redis_key="TestTimer", new_timer=True)
+    assert timer.start()
+    clock[0] += 10_000
+    timer.pause()
+    assert timer.last_snapshot.remaining_ms == 50_000
+
+    # Nothing comes off the bank while paused.
+    clock[0] += 30_000
+    assert timer.snapshot().remaining_ms == 50_000
+    timer.resume()
+    assert timer.last_snapshot.remaining_ms == 50_000
+    assert timer.last_snapshot.end_time == clock[0] + 50_000
+
+    clock[0] += 20_000
+    timer.pause()
+    assert timer.last_snapshot.remaining_ms == 30_000
+    assert timer.last_snapshot.formatted == "00:00:30"
+
+
+def test_transitions_that_do_not_apply_change_nothing(clock):
+    timer = Timer(length=1, redis_key="TestTimer", new_timer=True)
+    assert timer.transition("resume") == (TimerResults.NOT_PAUSED, "resume")
+    timer.start()
+    assert timer.transition("start") == (
+        TimerResults.ALREADY_STARTED, "start")
+    assert not timer.start()
+    timer.pause()
+    assert timer.transition("pause") == (
+        TimerResults.ALREADY_PAUSED, "pause")
+    with pytest.raises(ValueError):
+        timer.pause()
+    assert timer.snapshot().state == TimerStates.PAUSED
+
+
+def test_stop_holds_until_reset(clock):
+    timer = Timer(length=1, redis_key="TestTimer", new_timer=True)
+    timer.start()
+    clock[0] += 10_000
+    assert timer.transition("stop") == (TimerResults.OK, "stop")
+    assert timer.last_snapshot.state == TimerStates.STOPPED
+    assert timer.last_snapshot.remaining_ms == 0
+    assert timer.transition("toggle") == (TimerResults.STOPPED, "toggle")
+    with pytest.raises(ValueError):
+        timer.toggle()
+    assert not timer.start()
+    assert timer.snapshot().state == TimerStates.STOPPED
+
+    timer.reset()
+    assert timer.last_snapshot.state == TimerStates.IDLE
+    assert timer.last_snapshot.remaining_ms == 60_000
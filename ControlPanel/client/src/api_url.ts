@@ -6,6 +6,7 @@ interface ApiConfig {
   api: {
     host: string;
     port: number;
+    room?: string; // Rooms other than the default are under "/rooms/<room>"
   };
 }
 
@@ -18,6 +19,9 @@ let api_url: string = "";
 // Safely access api host and port if they exist
 if (config.api?.host && config.api?.port) {
   api_url = `http://${config.api.host}:${config.api.port}`;
+  if (config.api.room) {
+    api_url += `/rooms/${encodeURIComponent(config.api.room)}`;
+  }
   console.log(api_url); // Output the API URL
 } else {
   throw new Error("Host or port information is missing in the config file.");
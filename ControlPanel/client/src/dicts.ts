@@ -1,14 +1,34 @@
 export const Globals: { [key: string]: string } = {
   status: "UNKNOWN",
   timer: "UNKNOWN",
+  version: "",
 };
 
 export const RoomStatus: { [key: string]: string } = {
   loading: "LOADING",
   ready: "READY",
+  running: "RUNNING",
 };
 
 export const ApiRoutes: { [key: string]: string } = {
   api: "/api/",
   status: "status",
+  stream: "stream",
+  all: "fetch/all",
+  timer: "fetch/timer",
+  clock: "fetch/clock",
 };
+
+/*
+ * The timer as the API sends it. "remaining_ms" was the time left at
+ * "server_time_ms" on the server's clock. While "running" it keeps
+ * counting down from there.
+ */
+export interface TimerDescriptor {
+  state: string;
+  running: boolean;
+  remaining_ms: number;
+  server_time_ms: number;
+  length_ms: number;
+  version?: number;
+}
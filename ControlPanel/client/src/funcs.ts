@@ -5,6 +5,14 @@
 import { ApiRoutes } from "./dicts.ts";
 import { RoomStatus } from "./dicts.ts";
 import { Globals } from "./dicts.ts";
+import { TimerDescriptor } from "./dicts.ts";
+
+// How far the server's clock is ahead of this tablet's, in ms.
+let clockOffset: number = 0;
+// The last timer descriptor from the API, the clock runs from this.
+let timerDescriptor: TimerDescriptor | null = null;
+// Redraws the clock while the timer is running.
+let timerTicker: number | null = null;
 
 /*
  * This function sets the inner text of an element.
@@ -85,26 +93,112 @@ export async function getStatusFromAPI(): Promise<void> {
 };
 
 /*
- * Function that requests the current time from the API and updates the timer text.
- * It times out after 10 seconds of errors, this allows for only real errors to be shown
- * and not just skipping a beat in the API.
- *
- * This needs to work much better.
- * First it should check LOADING constantly, maybe every 10 seconds?
- * If ready it should chill until the player presses start
- * If the timer is running it should check every 10 seconds for an update,
- * and simulate updates for the other 10 seconds.
- * If the user presses pause, it should pause the timer and stop checking
- * If the user resumes the timer, it should get a time and then start checking again.
- * If the user stops the timer, it should stop checking and show the timer as stopped.
- * If the user resets the timer, it should restart the loop and be back in LOADING territory.
- *
- * Right now all it does it check every second and update the timer text.
- * The above way will be added in the future if the load on the API is too high.
+ * Estimate how far the server's clock is from this tablet's clock.
+ * Each sample times a round trip to the API and assumes the server read
+ * its clock halfway through it. The sample with the shortest round trip
+ * is the most trustworthy, so that one wins.
+ */
+export async function estimateClockOffset(samples: number = 5): Promise<void> {
+  let bestRoundTrip = Infinity;
+  for (let i = 0; i < samples; i++) {
+    try {
+      const sent = Date.now();
+      const response = await fetch(`${ApiRoutes.api}${ApiRoutes.clock}`);
+      const received = Date.now();
+      const server = (await response.json()).server_time_ms;
+      if (received - sent < bestRoundTrip) {
+        bestRoundTrip = received - sent;
+        clockOffset = server - (sent + received) / 2;
+      }
+    } catch (error) {
+      console.error("Error estimating clock offset", error);
+    }
+  }
+  console.log("Clock offset", clockOffset, "ms, round trip", bestRoundTrip, "ms");
+  return;
+}
+
+/*
+ * Take a new timer descriptor from the API and run the clock from it.
+ * This only happens on a transition (start, pause, resume, stop) or when
+ * the stream reconnects, in between the clock runs locally.
+ */
+export function syncTimer(descriptor: TimerDescriptor): void {
+  timerDescriptor = descriptor;
+  if (descriptor.version !== undefined) {
+    Globals.version = String(descriptor.version);
+  }
+  if (descriptor.running && timerTicker === null) {
+    timerTicker = window.setInterval(renderTimer, 250);
+  } else if (!descriptor.running) {
+    stopTicker();
+  }
+  renderTimer();
+}
+
+function stopTicker(): void {
+  if (timerTicker !== null) {
+    window.clearInterval(timerTicker);
+    timerTicker = null;
+  }
+}
+
+/*
+ * Work out the time left from the last descriptor, without asking the API.
+ */
+function renderTimer(): void {
+  if (timerDescriptor === null) {
+    return;
+  }
+
+  switch (timerDescriptor.state) {
+    case "IDLE":
+      showTimer("READY");
+      return;
+    case "PAUSED":
+      showTimer("PAUSED");
+      return;
+    case "STOPPED":
+      showTimer("STOPPED");
+      return;
+  }
+
+  const serverNow = Date.now() + clockOffset;
+  const elapsed = Math.max(0, serverNow - timerDescriptor.server_time_ms);
+  const remaining = Math.max(0, timerDescriptor.remaining_ms - elapsed);
+  showTimer(formatTime(Math.ceil(remaining / 1000)));
+  if (remaining === 0) {
+    // Nothing left to count, the next descriptor starts it again.
+    stopTicker();
+  }
+}
+
+function formatTime(seconds: number): string {
+  const hrs = Math.floor(seconds / 3600);
+  const mins = Math.floor((seconds % 3600) / 60);
+  const secs = seconds % 60;
+  return [hrs, mins, secs].map((n) => String(n).padStart(2, "0")).join(":");
+}
+
+/*
+ * Ask the API for the timer and resync the clock.
+ * It times out after 10 seconds of errors, this allows for only real errors
+ * to be shown and not just skipping a beat in the API.
  */
 export async function updateTimer(): Promise<void> {
-  let updatedTimerText: string = await fetchStringFromApi("time_remaining");
+  const data = await fetchStringFromApi(ApiRoutes.timer);
+  if (data === "ERROR") {
+    showTimer("ERROR");
+    return;
+  }
+  syncTimer(JSON.parse(data));
+  return;
+};
 
+/*
+ * Show the timer text, only touches the page when the text changed.
+ */
+function showTimer(updatedTimerText: string): void {
   if (updatedTimerText === Globals.timer) {
     return;
   } else {
@@ -132,7 +226,7 @@ export async function updateTimer(): Promise<void> {
       timerElement.classList.add("ready");
     } else if (Globals.timer === "ERROR") {
       timerElement.classList.add("error");
-    } else if (Globals.timer === "00:00:00") {
+    } else if (Globals.timer === "00:00:00" || Globals.timer === "STOPPED") {
       timerElement.classList.add("stopped");
     } else if (Globals.timer === "PAUSED") {
       timerElement.classList.add("paused");
@@ -143,6 +237,66 @@ export async function updateTimer(): Promise<void> {
   return;
 };
 
+/*
+ * Listen to the API's event stream instead of polling it.
+ * The API only sends an event when the room, the timer, or a node changes.
+ * Every timer event carries a descriptor, the clock runs locally between
+ * them (see syncTimer), so nothing is polled while the room is running.
+ *
+ * If the stream can't be opened (old browser, or the API is full and
+ * answered 503) this falls back to resyncing the timer every 10 seconds.
+ */
+export function subscribeToStream(): void {
+  estimateClockOffset();
+
+  if (!window.EventSource) {
+    updateTimer();
+    window.setInterval(updateTimer, 10000);
+    return;
+  }
+
+  const source = new EventSource(`${ApiRoutes.api}${ApiRoutes.stream}`);
+
+  source.addEventListener("snapshot", (event: MessageEvent) => {
+    applySnapshot(JSON.parse(event.data));
+  });
+
+  // Events were missed and can't be replayed, start over from the room.
+  source.addEventListener("resync", async () => {
+    const data = await fetchStringFromApi(ApiRoutes.all);
+    if (data === "ERROR") {
+      return;
+    }
+    applySnapshot(JSON.parse(data).dynamic);
+  });
+
+  source.addEventListener("room_status", (event: MessageEvent) => {
+    Globals.status = JSON.parse(event.data).room_status;
+  });
+
+  source.addEventListener("timer", (event: MessageEvent) => {
+    syncTimer(JSON.parse(event.data));
+  });
+
+  source.onerror = () => {
+    // The browser reconnects on its own, unless the API refused the stream.
+    if (source.readyState === EventSource.CLOSED) {
+      console.error("Stream closed, falling back to polling");
+      updateTimer();
+      window.setInterval(updateTimer, 10000);
+    }
+  };
+}
+
+/*
+ * Take the room as "/fetch/dynamic" (or a stream snapshot) describes it.
+ */
+function applySnapshot(snapshot: any): void {
+  Globals.status = snapshot.room_status;
+  Globals.version = String(snapshot.state_version);
+  syncTimer(snapshot.timer);
+}
+
 function updateGameControl(status: string): void {
   const controlButton = document.getElementById("game-control");
   if (controlButton === null) {
@@ -195,22 +349,33 @@ export function sendGameControl(): void {
 
   console.log("Control Button Clicked");
 
+  // Send the room state version this tablet is showing, if another tablet
+  // changed the room since, the API refuses the press (409) instead of
+  // acting on a stale screen.
+  const headers: { [key: string]: string } = {};
+  if (Globals.version !== "") {
+    headers["X-State-Version"] = Globals.version;
+  }
+
   if (controlButton.classList.contains("ready")) {
     console.log("TODO, THIS NEEDS TO BRING UP A MODAL TO CONFIRM");
     fetch(`${ApiRoutes.api}toggle`, {
       method: "POST",
+      headers: headers,
     });
   }
 
   if (controlButton.classList.contains("pause")) {
     fetch(`${ApiRoutes.api}toggle`, {
       method: "POST",
+      headers: headers,
     });
   }
 
   if (controlButton.classList.contains("resume")) {
     fetch(`${ApiRoutes.api}toggle`, {
       method: "POST",
+      headers: headers,
     });
   }
 }
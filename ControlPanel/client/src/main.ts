@@ -4,7 +4,7 @@
 import { setInnerText } from "./funcs.ts";
 import { setInnerHTML } from "./funcs.ts";
 import { fetchStringFromApi } from "./funcs.ts";
-import { updateTimer } from "./funcs.ts";
+import { subscribeToStream } from "./funcs.ts";
 import { initializeLoadFromAPI } from "./funcs.ts";
 import { unblockPage } from "./funcs.ts";
 import { setActivePanel } from "./funcs.ts";
@@ -185,7 +185,7 @@ setInnerHTML("#nav_reset", `<img src="/images/reset.png" alt="Reset" />`);
 setInnerHTML("#nav_stop", `<img src="/images/stop.png" alt="Stop" />`);
 
 initializeLoadFromAPI();
-setInterval(updateTimer, 1000);
+subscribeToStream();
 
 const NAV_BUTTONS: NodeListOf<HTMLButtonElement> =
   document.querySelectorAll(".nav-btn");
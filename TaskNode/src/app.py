@@ -7,9 +7,10 @@ import os
 import time
 import importlib
 
-from flask import Flask, render_template
+from flask import Flask, render_template, request
 from flask_cors import CORS
 from src.enums import Broadcasts
+from src.seen_relays import SeenRelays
 from src.yaml_reader import open_yaml_as_dict
 
 config = open_yaml_as_dict("config.yaml")
@@ -24,6 +25,7 @@ app = Flask(__name__)
 CORS(app)
 role = role_class(config)
 last_boot = time.time()
+relays_seen = SeenRelays()  # Next to "config.yaml", see "seen_relays.py"
 
 
 ###############################################################################
@@ -65,7 +67,14 @@ def home():
 def relay(message):
     """
     Relay a message to the Node
+    A relay with an "Idempotency-Key" that was already taken is answered,
+    but not run again. It's only remembered once the role took it, a relay
+    that raised is run again when the control panel retries it.
     """
+    key = request.headers.get("Idempotency-Key")
+    if key is not None and key in relays_seen:
+        return f"Relay Already Received: {message}", 200
+
     message = message.upper()
     message = message.replace("-", "_")
     message = message.replace(" ", "_")
@@ -73,19 +82,23 @@ def relay(message):
     # The only special non-role required message is reset.
     if message == Broadcasts.RESET:
         role.relay(Broadcasts.STOP)
+        relays_seen.remember(key)
         return restart_api()
 
     if message == Broadcasts.STOP:
         # Try "STOP" on the role, and do handling if it fails
         try:
             role.relay(Broadcasts.STOP)
+            relays_seen.remember(key)
             return f"Relay Received, Action Taken: {message}", 200
         except Exception as e:
             print(f"STOP FAILED: {e}")
             print("Restarting Server")
+            relays_seen.remember(key)  # The restart stops it
             return restart_api()
 
     action = role.relay(message)
+    relays_seen.remember(key)
     if action:
         return f"Relay Received, Action Taken: {message}", 200
     else:
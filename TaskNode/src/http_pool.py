@@ -0,0 +1,70 @@
+###############################################################################
+# Description: Keep-alive HTTP connection to the control panel
+# Version: 0.1
+###############################################################################
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpPool:
+    """
+    One keep-alive requests.Session per process. Everything a node sends
+    goes to the control panel, so every request reuses one of a couple of
+    open connections instead of doing a new TCP handshake.
+
+    At most "per_host" connections are open, extra requests wait for one
+    to come back instead of opening more.
+
+    Public Methods:
+    -post: Same as requests.post.
+    -prewarm: Open a connection ahead of time.
+    """
+
+    def __init__(self, per_host: int = 2):
+        self.per_host = per_host
+        self.__session = None
+        self.__pid = None
+        self.__lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        Sockets can't be shared with a forked child, so every process
+        builds its own session the first time it needs one.
+        """
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__session = self.__build_session()
+                    self.__pid = os.getpid()
+        return self.__session
+
+    def __build_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.per_host,
+            pool_block=True,
+            max_retries=0,
+        )
+        session.mount("http://", adapter)
+        return session
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.session.post(url, **kwargs)
+
+    def prewarm(self, url, timeout: float = 1.0) -> bool:
+        """
+        Send an OPTIONS to "url" so the connection is already open when the
+        first trigger goes out. The server doesn't run the view for it.
+        Returns whether the control panel answered.
+        """
+        try:
+            self.session.options(url, timeout=timeout)
+            return True
+        except requests.exceptions.RequestException:
+            return False
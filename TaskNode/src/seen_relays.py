@@ -0,0 +1,78 @@
+###############################################################################
+# Description: Remembers the relays a node already took, across restarts
+# Version: 0.1
+###############################################################################
+
+import os
+from collections import OrderedDict
+
+
+class SeenRelays:
+    """
+    The idempotency keys of the relays already taken, oldest first.
+    The control panel resends a relay it didn't hear back about with the
+    same key, so a trigger never runs twice.
+
+    Every key is appended to a small file (next to "config.yaml"), so a
+    restart, a reboot or a recycled worker still knows what it took.
+    The file is rewritten with only the remembered keys once it holds
+    twice as many.
+
+    Public Methods:
+    -remember: Save a key, forgetting the oldest ones.
+    """
+
+    REMEMBERED = 1024  # Keys kept, far more than the control panel retries
+
+    def __init__(self, file_name="relays_seen.txt"):
+        self.file_name = file_name
+        self.keys = OrderedDict()
+        self.lines = 0  # Keys in the file, remembered or not
+        self.__load()
+
+    def __contains__(self, key) -> bool:
+        return key in self.keys
+
+    def remember(self, key) -> None:
+        if key is None or key in self.keys:
+            return
+        self.keys[key] = True
+        while len(self.keys) > self.REMEMBERED:
+            self.keys.popitem(last=False)
+        if self.lines >= 2 * self.REMEMBERED:
+            self.__rewrite()
+            return
+        with open(self.file_name, "a") as file:
+            file.write(f"{key}\n")
+            file.flush()
+            os.fsync(file.fileno())  # Pis lose power, not just restart
+        self.lines += 1
+        return
+
+    def __load(self):
+        try:
+            with open(self.file_name, "r") as file:
+                for line in file:
+                    key = line.strip()
+                    if key:
+                        self.keys[key] = True
+                        self.lines += 1
+        except FileNotFoundError:
+            return
+        while len(self.keys) > self.REMEMBERED:
+            self.keys.popitem(last=False)
+        return
+
+    def __rewrite(self):
+        """
+        Replace the file with only the remembered keys, all at once, so a
+        crash halfway leaves the old file.
+        """
+        temp_name = f"{self.file_name}.tmp"
+        with open(temp_name, "w") as file:
+            file.writelines(f"{key}\n" for key in self.keys)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_name, self.file_name)
+        self.lines = len(self.keys)
+        return
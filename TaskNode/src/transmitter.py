@@ -3,12 +3,29 @@
 # Version: 0.1
 ###############################################################################
 
+import random
 import threading
+import time
 
 import requests
+from src.http_pool import HttpPool
+
+# Every trigger and status update goes to the same control panel, so one
+# keep-alive connection (and a spare) is all the node needs.
+http_pool = HttpPool(per_host=2)
 
 
 class Transmitter:
+    """
+    Sends triggers and status updates to the control panel on their own
+    threads. A request is retried, with backoff, while the control panel
+    can't be reached or answers with a 5xx.
+    """
+
+    ATTEMPTS = 10  # Tries for each trigger or status update
+    BACKOFF_BASE = 0.25  # Seconds before the first retry
+    BACKOFF_MAX = 10  # Longest wait between retries
+
     def __init__(self, data):
         self.__name = data["name"]
         self.__activated = False
@@ -22,8 +39,16 @@ class Transmitter:
             self.__control_ip = data["control_panel"]["ip"]
             self.__port = data["control_panel"]["port"]
             control_url = f"http://{self.__control_ip}:{self.__port}"
+            # A control panel can run more than one room.
+            room = data["control_panel"].get("room")
+            if room:
+                control_url += f"/rooms/{room}"
             self.__trigger_url = f"{control_url}/trigger"
             self.__status_url = f"{control_url}/update_status"
+            threading.Thread(
+                target=http_pool.prewarm,
+                args=(self.__trigger_url + "/",),
+                daemon=True).start()
         else:
             print(
                 "No control panel data provided, this role will not be able to transmit"
@@ -42,20 +67,39 @@ class Transmitter:
         if not self.__activated:
             return "Transmitter not activated"
 
-        attempts = 10
-        while attempts > 0:
+        # Only an unreachable or failing control panel is worth retrying,
+        # a request it turned down (a 404, a 400) is turned down again.
+        for attempt in range(1, self.ATTEMPTS + 1):
             try:
-                requests.get(url, timeout=5)
+                response = http_pool.post(url, timeout=5)
+                if response.status_code < 500:
+                    if response.status_code != 200:
+                        print(f"Control panel turned down {url}: "
+                              f"{response.status_code}")
+                    return
+                print(f"Control panel error {response.status_code} for "
+                      f"{url}")
             except requests.exceptions.RequestException as e:
                 print(f"Error sending request to {url}: {e}")
+            if attempt < self.ATTEMPTS:
+                time.sleep(self.__backoff(attempt))
+        print(f"Gave up on {url} after {self.ATTEMPTS} attempts")
         return
 
+    def __backoff(self, attempt) -> float:
+        """
+        Exponential, with jitter so a room full of nodes doesn't retry at
+        the same moment when the control panel comes back.
+        """
+        delay = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
     def __threaded_request(self, url):
         threading.Thread(target=self.__send_request, args=(url,)).start()
         return "Request sent to " + url
 
     def trigger(self, message):
-        url = f"{self.__transmit_url}/{message}"
+        url = f"{self.__trigger_url}/{message}"
         self.__threaded_request(url)
         return
 